@@ -43,6 +43,7 @@ def enable_step_for_pipeline(pipeline):
     pipeline._stepper = Stepper()
 
     # Wrap all get_input() methods of module infos
+    pipeline.load_all_modules()
     for module_name, module in pipeline.module_infos.items():
         # Check each of the outputs to see whether it's a tarred corpus
         wrap_output_names = []
@@ -19,28 +19,15 @@ import sys
 from operator import itemgetter
 from traceback import print_exc
 
+from importlib import import_module
+
 from pimlico import cfg
 
-from pimlico.cli.newmodule import NewModuleCmd
-from pimlico.cli.check import InstallCmd, DepsCmd, LicensesCmd
-from pimlico.cli.clean import CleanCmd
-from pimlico.cli.loaddump import DumpCmd, LoadCmd
-from pimlico.cli.locations import InputsCmd, OutputCmd, ListStoresCmd, MoveStoresCmd
-from pimlico.cli.pyshell import PythonShellCmd
-from pimlico.cli.reset import ResetCmd
-from pimlico.cli.run import RunCmd
-from pimlico.cli.shell.runner import ShellCLICmd
-from pimlico.cli.status import StatusCmd
 from pimlico.cli.subcommands import PimlicoCLISubcommand
-from pimlico.cli.testemail import EmailCmd
-from pimlico.cli.fixlength import FixLengthCmd
-from pimlico.cli.recover import RecoverCmd
 from pimlico.cli.util import module_number_to_name, module_numbers_to_names
 from pimlico.core.config import PipelineConfig, PipelineConfigParseError, PipelineStructureError
 from pimlico.core.modules.options import ModuleOptionParseError
 from pimlico.utils.system import set_proc_title
-from pimlico.cli.jupyter import JupyterCmd
-from pimlico.cli.pimarc import Tar2PimarcCmd
 
 
 class VariantsCmd(PimlicoCLISubcommand):
@@ -133,24 +120,82 @@ class VisualizeCmd(PimlicoCLISubcommand):
         build_graph_with_status(pipeline, all=opts.all)
 
 
+# All subcommands, registered by name, so that a command's code (and everything it depends on) only gets
+#  imported when the command is used. Commands defined in this module are given directly, others by the
+#  fully qualified name of their class
 SUBCOMMANDS = [
-    StatusCmd, VariantsCmd, RunCmd, RecoverCmd, FixLengthCmd, BrowseCmd, ShellCLICmd, PythonShellCmd, ResetCmd, CleanCmd,
-    ListStoresCmd, MoveStoresCmd, UnlockCmd,
-    DumpCmd, LoadCmd, DepsCmd, InstallCmd, InputsCmd, OutputCmd, NewModuleCmd, VisualizeCmd, EmailCmd,
-    JupyterCmd, Tar2PimarcCmd, LicensesCmd,
+    ("status", "pimlico.cli.status.StatusCmd"),
+    ("variants", VariantsCmd),
+    ("run", "pimlico.cli.run.RunCmd"),
+    ("recover", "pimlico.cli.recover.RecoverCmd"),
+    ("fixlength", "pimlico.cli.fixlength.FixLengthCmd"),
+    ("browse", BrowseCmd),
+    ("shell", "pimlico.cli.shell.runner.ShellCLICmd"),
+    ("python", "pimlico.cli.pyshell.PythonShellCmd"),
+    ("reset", "pimlico.cli.reset.ResetCmd"),
+    ("clean", "pimlico.cli.clean.CleanCmd"),
+    ("stores", "pimlico.cli.locations.ListStoresCmd"),
+    ("movestores", "pimlico.cli.locations.MoveStoresCmd"),
+    ("unlock", UnlockCmd),
+    ("dump", "pimlico.cli.loaddump.DumpCmd"),
+    ("load", "pimlico.cli.loaddump.LoadCmd"),
+    ("deps", "pimlico.cli.check.DepsCmd"),
+    ("install", "pimlico.cli.check.InstallCmd"),
+    ("inputs", "pimlico.cli.locations.InputsCmd"),
+    ("output", "pimlico.cli.locations.OutputCmd"),
+    ("newmodule", "pimlico.cli.newmodule.NewModuleCmd"),
+    ("visualize", VisualizeCmd),
+    ("email", "pimlico.cli.testemail.EmailCmd"),
+    ("jupyter", "pimlico.cli.jupyter.JupyterCmd"),
+    ("tar2pimarc", "pimlico.cli.pimarc.Tar2PimarcCmd"),
+    ("licenses", "pimlico.cli.check.LicensesCmd"),
 ]
 
 
-if __name__ == "__main__":
-    if len(sys.argv) == 2 and sys.argv[1] == "setup":
-        # Special case that doesn't require loading a pipeline
-        # Don't complain about missing arguments, but just exit
-        # If we've got this far, we've already been through the core dependency checks/installation, so they've
-        #  already reported any problems or actions
-        # This allows you to run Pimlico once after installation and perform basic setup without doing anything else
-        sys.exit(0)
+def load_subcommand(command_name):
+    """
+    Import the class that implements the named subcommand.
+
+    :return: subclass of :class:`~pimlico.cli.subcommands.PimlicoCLISubcommand`
+    """
+    subcommand_cls = dict(SUBCOMMANDS)[command_name]
+    if not isinstance(subcommand_cls, type):
+        module_name, __, cls_name = subcommand_cls.rpartition(".")
+        subcommand_cls = getattr(import_module(module_name), cls_name)
+    return subcommand_cls
+
+
+def load_all_subcommands():
+    """
+    Import the classes for all subcommands, e.g. for generating documentation.
+
+    :return: list of subcommand classes, in the order they're registered
+    """
+    return [load_subcommand(command_name) for (command_name, __) in SUBCOMMANDS]
+
+
+class _SubcommandNotFound(Exception):
+    pass
+
+
+class _SubcommandNameParser(argparse.ArgumentParser):
+    """
+    Parser used to find out which subcommand has been selected, before the subcommand's own arguments are known.
+    Raises an exception instead of reporting errors, so they can be reported by the full parser.
+
+    """
+    def error(self, message):
+        raise _SubcommandNotFound(message)
 
-    parser = argparse.ArgumentParser(description="Main command line interface to PiMLiCo")
+
+def make_arg_parser(subcommands, parser_class=argparse.ArgumentParser, add_help=True):
+    """
+    Build the argument parser for the main command-line interface. All subcommands are available to choose
+    from, but only those given are fully set up, with their help text and arguments.
+
+    :param subcommands: list of subcommand classes to set up
+    """
+    parser = parser_class(description="Main command line interface to PiMLiCo", add_help=add_help)
     parser.add_argument("pipeline_config", help="Config file to load a pipeline from")
     parser.add_argument("--debug", "-d", help="Output verbose debugging info", action="store_true")
     parser.add_argument("--trace-config",
@@ -178,20 +223,58 @@ if __name__ == "__main__":
     parser.add_argument("--benchmark-doc-map", "--bdm", action="store_true",
                         help="Keep track of execution times when running a doc map module for the purposes "
                              "of benchmarking. Stats are output to the terminal at the end of execution.")
-    subparsers = parser.add_subparsers(help="Select a sub-command")
-
-    # Add all subcommands that have been defined using the class interface
-    for subcommand_cls in SUBCOMMANDS:
-        # Instantiate the class
-        subcommand = subcommand_cls()
-        # Use it to add a subcommand to the arg parser
-        subparser = subparsers.add_parser(subcommand.command_name, help=subcommand.command_help)
-        subparser.set_defaults(func=subcommand.run_command)
-        # Add subparser arguments as defined by the individual subcommand class
-        subcommand.add_arguments(subparser)
+    subparsers = parser.add_subparsers(help="Select a sub-command", dest="command_name")
+
+    subcommands = dict((subcommand_cls.command_name, subcommand_cls) for subcommand_cls in subcommands)
+    for command_name, __ in SUBCOMMANDS:
+        if command_name in subcommands:
+            # Instantiate the class
+            subcommand = subcommands[command_name]()
+            # Use it to add a subcommand to the arg parser
+            subparser = subparsers.add_parser(command_name, help=subcommand.command_help)
+            subparser.set_defaults(func=subcommand.run_command)
+            # Add subparser arguments as defined by the individual subcommand class
+            subcommand.add_arguments(subparser)
+        else:
+            # Not loaded: the command can be selected, but its arguments are not known
+            subparsers.add_parser(command_name, add_help=False)
+    return parser
+
+
+def get_subcommand_name(args=None):
+    """
+    Work out which subcommand has been selected on the command line, without loading any of the subcommands.
+
+    :return: subcommand name, or None if no subcommand could be found, for example if the
+        arguments are not valid
+    """
+    parser = make_arg_parser([], parser_class=_SubcommandNameParser, add_help=False)
+    try:
+        opts, __ = parser.parse_known_args(args)
+    except _SubcommandNotFound:
+        return None
+    return opts.command_name
 
-    opts = parser.parse_args()
 
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "setup":
+        # Special case that doesn't require loading a pipeline
+        # Don't complain about missing arguments, but just exit
+        # If we've got this far, we've already been through the core dependency checks/installation, so they've
+        #  already reported any problems or actions
+        # This allows you to run Pimlico once after installation and perform basic setup without doing anything else
+        sys.exit(0)
+
+    # Only load the selected subcommand
+    # If we can't tell which one it is (e.g. to show the main help), load them all
+    command_name = get_subcommand_name()
+    if command_name is not None:
+        parser = make_arg_parser([load_subcommand(command_name)])
+    else:
+        parser = make_arg_parser(load_all_subcommands())
+    opts = parser.parse_args()
+    if opts.command_name is None:
+        parser.error("no sub-command given")
     if opts.override_local_config is not None:
         override_local = dict(
             itemgetter(0, 2)(param.partition("=")) for param in opts.override_local_config
@@ -6,6 +6,7 @@ from __future__ import print_function
 from builtins import str
 
 import sys
+from multiprocessing import cpu_count
 from traceback import print_exc, format_exception_only
 
 from pimlico import cfg
@@ -63,6 +64,28 @@ class RunCmd(PimlicoCLISubcommand):
                                  "fails and a summary at the end of everything), 'end' "
                                  "(send only the final summary). Email sending must be configured: "
                                  "see 'email' command to test")
+        parser.add_argument("--shared-scan", action="store_true",
+                            help="Where several of the modules to be run are ready and read the same input corpus, "
+                                 "execute them at the same time, sharing a single pass over the input between them, "
+                                 "instead of each reading it in turn")
+        parser.add_argument("--parallel", type=int, metavar="CPUS",
+                            help="Execute modules that don't depend on each other at the same time, as soon as "
+                                 "the modules they depend on have been run. At most CPUS processes will be used "
+                                 "by the modules running at once, assuming each uses as many as it's allowed (see "
+                                 "--processes). Use 0 to use the number of CPUs available")
+        parser.add_argument("--follow", action="store_true",
+                            help="Allow modules to read input corpora that are still being written by a module that "
+                                 "is currently being executed (e.g. in another run command), processing the "
+                                 "documents as they are written. With --parallel, a module is started as soon as the "
+                                 "modules it depends on have started writing the outputs it reads, so that they "
+                                 "run at the same time")
+        parser.add_argument("--incremental", action="store_true",
+                            help="For modules that have already been run to completion, update their output for any "
+                                 "input documents that are new or have changed since, instead of skipping them. "
+                                 "Output for unchanged documents is copied from the existing output. Only supported "
+                                 "by document map modules. Modules run with this option record the hashes of their "
+                                 "input documents that are needed to update their output later, so use it the "
+                                 "first time they're run too")
         parser.add_argument("--last-error", "-e", action="store_true",
                             help="Don't execute, just output the error log from the last execution of the given "
                                  "module(s)")
@@ -172,13 +195,18 @@ class RunCmd(PimlicoCLISubcommand):
                 print("Please fix in local config file to use email reports", file=sys.stderr)
                 sys.exit(1)
 
+        parallel = opts.parallel
+        if parallel is not None and parallel < 1:
+            parallel = cpu_count()
+
         exit_status = 0
         try:
             # If this completes, there might have been an error, in which case the appropriate exit status is returned
             exit_status = check_and_execute_modules(
                 pipeline, module_specs, force_rerun=opts.force_rerun, debug=debug, log=log,
                 all_deps=opts.all_deps, check_only=dry_run, exit_on_error=opts.exit_on_error,
-                preliminary=preliminary, email=opts.email
+                preliminary=preliminary, email=opts.email, shared_scan=opts.shared_scan,
+                parallel=parallel, follow=opts.follow, incremental=opts.incremental
             )
         except (ModuleInfoLoadError, ModuleNotReadyError) as e:
             exit_status = 1
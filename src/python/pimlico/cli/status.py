@@ -271,6 +271,8 @@ def print_module_status(module_name, bullet, pipeline, aliases=None):
     ]))
     if module.is_locked():
         print("       locked: ongoing execution")
+    if module.module_executable and module.is_changed():
+        print("       changed: options or inputs changed since execution, will be run again")
     if aliases is not None and module_name in aliases:
         # Show the alias as well
         for alias in aliases[module_name]:
@@ -27,6 +27,7 @@ import os
 import re
 import sys
 import textwrap
+import threading
 import warnings
 import io
 
@@ -36,6 +37,7 @@ from operator import itemgetter
 from socket import gethostname
 
 from pimlico import PIMLICO_ROOT, PROJECT_ROOT, OUTPUT_DIR, TEST_DATA_DIR
+from pimlico.core.config_cache import PipelineConfigCache, module_spec
 from pimlico.core.dependencies.base import check_and_install
 from pimlico.datatypes.base import DatatypeLoadError
 from pimlico.datatypes import load_datatype
@@ -81,6 +83,8 @@ class PipelineConfig(object):
         self.module_infos = {}
         self.module_order = []
         self.expanded_modules = {}
+        # Modules loaded from the config cache whose module infos haven't been created yet
+        self._lazy_modules = {}
 
         # Certain standard system-wide settings, loaded from the local config
         self.storage_locations = []
@@ -105,6 +109,7 @@ class PipelineConfig(object):
 
         # Get paths to add to the python path for the pipeline
         # Used so that a project can specify custom module types and other python code outside the pimlico source tree
+        self.python_path = []
         if "python_path" in self.pipeline_config:
             # Paths should all be specified relative to the config file's directory
             additional_paths = [self.path_relative_to_config(path) for path in
@@ -116,6 +121,7 @@ class PipelineConfig(object):
                                   "anyway, but no code will be found there".format(path))
             # Add these paths for the python path, so later code will be able to import things from them
             sys.path.extend(additional_paths)
+            self.python_path = additional_paths
 
         if section_headings is None:
             section_headings = SectionHeadings("root", [], self.module_order, [])
@@ -132,6 +138,9 @@ class PipelineConfig(object):
         self._dependency_cache = None
         self._dependent_cache = None
 
+        # Set to stop modules being executed in background threads: see pimlico.core.modules.execute
+        self.execution_stopped = threading.Event()
+
     def __repr__(self):
         return u"<PipelineConfig '%s'%s>" % (
             self.name,
@@ -146,11 +155,12 @@ class PipelineConfig(object):
     def __getitem__(self, item):
         if item in self.module_aliases:
             return self[self.module_aliases[item]]
-        else:
-            return self.module_infos[item]
+        elif item not in self.module_infos and item in self._lazy_modules:
+            self._instantiate_lazy_module(self._lazy_modules[item])
+        return self.module_infos[item]
 
     def __contains__(self, item):
-        return item in self.module_infos or item in self.module_aliases
+        return item in self.module_infos or item in self.module_aliases or item in self._lazy_modules
 
     def __iter__(self):
         for module_name in self.module_order:
@@ -237,6 +247,43 @@ class PipelineConfig(object):
         if module_info.alt_expanded_from is not None:
             self.expanded_modules.setdefault(module_info.alt_expanded_from, []).append(module_info.module_name)
 
+    def add_lazy_module(self, spec):
+        """
+        Add a module that will only be loaded when it's first used. This is used when loading a pipeline
+        from the config cache (see :mod:`~pimlico.core.config_cache`), where the module order is already
+        known. The module info is created from the specification the first time the module is looked up.
+
+        :param spec: specification of how to create the module info, including a list `provides` of the names
+            of the module and any internal modules it has
+        """
+        for module_name in spec["provides"]:
+            self._lazy_modules[module_name] = spec
+
+    def _instantiate_lazy_module(self, spec):
+        from pimlico.core.config_cache import instantiate_module
+        from pimlico.core.modules.multistage import MultistageModuleInfo
+
+        module_info = instantiate_module(self, spec)
+        # Multistage modules make their internal modules available as well
+        new_module_infos = [module_info]
+        if isinstance(module_info, MultistageModuleInfo):
+            new_module_infos.extend(module_info.internal_modules)
+        for new_module_info in new_module_infos:
+            new_module_info.pipeline = self
+            self.module_infos[new_module_info.module_name] = new_module_info
+            self._lazy_modules.pop(new_module_info.module_name, None)
+
+    def load_all_modules(self):
+        """
+        Make sure that the module infos of all modules have been created, for code that works through
+        `module_infos` directly. This only makes a difference if the pipeline was loaded from the config
+        cache.
+
+        """
+        for module_name in list(self._lazy_modules.keys()):
+            if module_name in self._lazy_modules:
+                self[module_name]
+
     def get_module_schedule(self):
         """
         Work out the order in which modules should be executed. This is an ordering that respects
@@ -351,6 +398,15 @@ class PipelineConfig(object):
             "test_data_dir": TEST_DATA_DIR,
         }
 
+        # If the pipeline's been loaded before and nothing has changed since, skip all the loading and checks
+        config_cache = PipelineConfigCache.from_local_config(local_config_data, filename, variant, special_vars)
+        if config_cache is not None:
+            pipeline = config_cache.load(local_config_data, local_config_sources=used_config_sources)
+            if pipeline is not None:
+                return pipeline
+        # Keep a record of how each module info was created, to store in the cache
+        module_specs = []
+
         # Perform pre-processing of config file to replace includes, etc
         config_sections, available_variants, vars, all_filenames, section_docstrings, raw_section_headings = \
             preprocess_config_file(os.path.abspath(filename), variant=variant, initial_vars=special_vars)
@@ -499,6 +555,7 @@ class PipelineConfig(object):
                         del module_config[key]
                 except DatatypeLoadError:
                     # Not a datatype
+                    datatype_options = None
                     try:
                         module_info_class = load_module_info(module_type_name)
                     except ModuleInfoLoadError as e:
@@ -1072,6 +1129,7 @@ class PipelineConfig(object):
 
                     # We're now ready to do the main parameter processing, which is dependent on the module
                     options = module_info_class.process_module_options(options_dict)
+                    docstring = section_docstrings.get(module_name, "")
 
                     # Get additional outputs to be included on the basis of the options, according to module
                     # type's own logic
@@ -1081,7 +1139,7 @@ class PipelineConfig(object):
                     # Instantiate the module info
                     module_info = module_info_class(
                         expanded_module_name, pipeline, inputs=inputs, options=options,
-                        optional_outputs=optional_outputs, docstring=section_docstrings.get(module_name, ""),
+                        optional_outputs=optional_outputs, docstring=docstring,
                         # Make sure that the module info includes any optional outputs that are used by other modules
                         include_outputs=used_outputs.get(module_name, []),
                         # Store the name of the module this was expanded from
@@ -1103,6 +1161,17 @@ class PipelineConfig(object):
                     # Add to the end of the pipeline
                     pipeline.append_module(module_info)
 
+                    spec = module_spec(
+                        expanded_module_name, module_type_name, datatype_options, filter_type, inputs, options_dict,
+                        optional_outputs, docstring, used_outputs.get(module_name, []),
+                        expanded_sections[expanded_module_name], expanded_param_settings[expanded_module_name],
+                        module_variables,
+                    )
+                    spec["provides"] = [expanded_module_name] + [
+                        int_mod.module_name for int_mod in getattr(module_info, "internal_modules", [])
+                    ]
+                    module_specs.append(spec)
+
                     module_infos[expanded_module_name] = module_info
                     loaded_modules.append(module_name)
             except ModuleInfoLoadError as e:
@@ -1114,6 +1183,8 @@ class PipelineConfig(object):
         except PipelineCheckError as e:
             raise PipelineConfigParseError("failed checks: %s" % e, cause=e, explanation=e.explanation)
 
+        if config_cache is not None:
+            config_cache.store(pipeline, module_specs)
         return pipeline
 
     @staticmethod
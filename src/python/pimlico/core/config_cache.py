@@ -0,0 +1,292 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Caching of the structure of a loaded pipeline, so that it doesn't need to be worked out from
+the config files every time Pimlico is run.
+
+Loading a pipeline involves preprocessing the config files, expanding alternative parameter
+values and module variables, importing the module type of every module and type-checking all
+the connections between them. For big pipelines, this can take a long time, even for commands
+that only look at one module. Once a pipeline has been loaded, the result of all this is stored:
+the pipeline-level config and, for each module, the arguments that its module info is created
+from. Next time the same pipeline (and variant) is loaded, these are read from the cache and
+each module's module info is only created (and its module type imported) when the module is
+first used.
+
+The cache is only used if nothing it was produced from has changed: the config files (including
+any that were included from the main one), the Pimlico version, the Python code that had been
+loaded from Pimlico and from the pipeline's `python_path`, and a few other things that can
+affect the loading, such as the special variables available in the config files. The config
+files are compared by their modification time and size and, if those have changed, the hash of
+their contents.
+
+Cached pipelines are stored in a directory `.config_cache` in the default storage location.
+Use the `config_cache` local config setting to turn off the cache. See :doc:`/core/local_config`.
+
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from builtins import object
+
+import hashlib
+import io
+import json
+import os
+import sys
+from collections import OrderedDict
+
+CACHE_FORMAT_VERSION = 1
+
+
+class PipelineConfigCache(object):
+    """
+    Cache file for a particular pipeline config file and variant.
+
+    :param cache_dir: directory containing the pipeline caches
+    :param filename: the pipeline's main config file
+    :param variant: pipeline variant
+    :param special_vars: special variables available for substitution in the config files
+    """
+    def __init__(self, cache_dir, filename, variant, special_vars):
+        self.filename = filename
+        self.variant = variant
+        self.special_vars = special_vars
+        cache_name = hashlib.sha1(json.dumps([os.path.abspath(filename), variant]).encode("utf-8")).hexdigest()
+        self.path = os.path.join(cache_dir, "%s.json" % cache_name)
+
+    @staticmethod
+    def from_local_config(local_config, filename, variant, special_vars):
+        """
+        Get the cache for the given config file, stored in the default storage location. Returns None
+        if the cache has been disabled in the local config, or there's no storage location.
+
+        """
+        from pimlico.core.modules.options import str_to_bool
+
+        if not str_to_bool(local_config.get("config_cache", "true")):
+            return None
+        # Use the same storage location that the pipeline outputs to by default
+        store = local_config.get("store", None)
+        if store is None:
+            store = next((val for (key, val) in local_config.items() if key.startswith("store_")), None)
+            if store is None:
+                return None
+        return PipelineConfigCache(os.path.join(store, ".config_cache"), filename, variant, special_vars)
+
+    def _key(self):
+        from pimlico import __version__
+        return {
+            "format": CACHE_FORMAT_VERSION,
+            "pimlico_version": __version__,
+            "python_version": list(sys.version_info[:2]),
+            "filename": os.path.abspath(self.filename),
+            "variant": self.variant,
+            "special_vars": self.special_vars,
+        }
+
+    def load(self, local_config, local_config_sources=None):
+        """
+        Load the pipeline from the cache, if it's there and still valid.
+
+        :return: PipelineConfig whose modules are loaded when they're first used, or None if the
+            cache can't be used
+        """
+        from pimlico.core.config import PipelineConfig, SectionHeadings, check_release
+
+        try:
+            with io.open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            # No cached pipeline, or the file is unreadable
+            return None
+
+        if data.get("key") != self._key() or \
+                not all(_config_file_unchanged(*config_file) for config_file in data["config_files"]) or \
+                not all(_code_file_unchanged(*code_file) for code_file in data["code_files"]):
+            return None
+
+        pipeline_config = data["pipeline_config"]
+        check_release(pipeline_config["release"])
+
+        pipeline = PipelineConfig(
+            data["name"], pipeline_config, local_config,
+            filename=self.filename, variant=self.variant, available_variants=data["available_variants"],
+            all_filenames=data["all_filenames"], module_aliases=data["module_aliases"],
+            local_config_sources=local_config_sources,
+            section_headings=_section_headings_from_json(data["section_headings"], SectionHeadings),
+        )
+        pipeline.module_order.extend(data["module_order"])
+        pipeline.expanded_modules.update(data["expanded_modules"])
+        for spec in data["modules"]:
+            pipeline.add_lazy_module(spec)
+        return pipeline
+
+    def store(self, pipeline, module_specs):
+        """
+        Store a loaded pipeline in the cache. It should have passed all the checks, since they're not
+        performed again when it's loaded from the cache.
+
+        A problem writing the cache is not an error: the pipeline will just be loaded without it
+        next time.
+
+        :param module_specs: list of specifications of how to create each module info, as
+            given to :meth:`~pimlico.core.config.PipelineConfig.add_lazy_module`
+        """
+        data = {
+            "key": self._key(),
+            "config_files": [_config_file_state(path) for path in pipeline.all_filenames],
+            "code_files": _loaded_code_files(pipeline),
+            "name": pipeline.name,
+            "pipeline_config": pipeline.pipeline_config,
+            "available_variants": pipeline.available_variants,
+            "all_filenames": pipeline.all_filenames,
+            "module_aliases": pipeline.module_aliases,
+            "section_headings": _section_headings_to_json(pipeline.section_headings),
+            "module_order": pipeline.module_order,
+            "expanded_modules": pipeline.expanded_modules,
+            "modules": module_specs,
+        }
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with io.open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(data))
+            # Replace any old version in one step, so another process never reads a partial file
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            pipeline.log.debug("Could not store pipeline config cache in {}: {}".format(self.path, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def module_spec(module_name, module_type_name, datatype_options, filter_type, inputs, options, optional_outputs,
+                docstring, include_outputs, alt_expanded_from, alt_param_settings, module_variables):
+    """
+    Store the arguments used to create a module info while loading a pipeline, so that it can be
+    created in the same way when the pipeline is loaded from the cache (:func:`instantiate_module`).
+    Everything is copied, so that later changes to the values don't affect the specification.
+
+    :param datatype_options: options given to the datatype, if the module type is an input datatype, otherwise None
+    :param filter_type: True if the module is run as a filter
+    :param options: unprocessed module options
+    """
+    return json.loads(json.dumps({
+        "name": module_name,
+        "type": module_type_name,
+        "datatype_options": list(datatype_options.items()) if datatype_options is not None else None,
+        "filter": filter_type,
+        "inputs": inputs,
+        "options": options,
+        "optional_outputs": sorted(optional_outputs),
+        "docstring": docstring,
+        "include_outputs": list(include_outputs),
+        "alt_expanded_from": alt_expanded_from,
+        "alt_param_settings": alt_param_settings,
+        "module_variables": module_variables,
+    }))
+
+
+def instantiate_module(pipeline, spec):
+    """
+    Create a module info from a specification produced by :func:`module_spec`.
+
+    """
+    from pimlico.core.modules.base import load_module_info
+    from pimlico.core.modules.inputs import input_module_factory
+    from pimlico.core.modules.map.filter import wrap_module_info_as_filter
+    from pimlico.datatypes import load_datatype
+
+    if spec["datatype_options"] is not None:
+        module_info_class = input_module_factory(
+            load_datatype(spec["type"], options=OrderedDict(spec["datatype_options"])))
+    else:
+        module_info_class = load_module_info(spec["type"])
+
+    module_info = module_info_class(
+        spec["name"], pipeline,
+        inputs=dict(
+            (input_name, [tuple(input_spec) for input_spec in input_specs])
+            for (input_name, input_specs) in spec["inputs"].items()
+        ),
+        options=module_info_class.process_module_options(spec["options"]),
+        optional_outputs=set(spec["optional_outputs"]), docstring=spec["docstring"],
+        include_outputs=spec["include_outputs"], alt_expanded_from=spec["alt_expanded_from"],
+        alt_param_settings=[(key, tuple(val)) for (key, val) in spec["alt_param_settings"]],
+        module_variables=spec["module_variables"],
+    )
+    if spec["filter"]:
+        module_info = wrap_module_info_as_filter(module_info)
+    return module_info
+
+
+def _config_file_state(path):
+    stat = os.stat(path)
+    return [path, stat.st_mtime, stat.st_size, _file_hash(path)]
+
+
+def _config_file_unchanged(path, mtime, size, file_hash):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if stat.st_size != size:
+        return False
+    # If the file's been touched, check whether its contents have actually changed
+    return stat.st_mtime == mtime or _file_hash(path) == file_hash
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _loaded_code_files(pipeline):
+    """
+    Source files of the Pimlico and pipeline-specific Python modules that have been imported. The
+    loading of a pipeline might depend on any of these.
+
+    """
+    import pimlico
+    code_dirs = [os.path.dirname(os.path.abspath(pimlico.__file__))] + \
+        [os.path.abspath(path) for path in pipeline.python_path]
+    code_dirs = [os.path.join(code_dir, "") for code_dir in code_dirs]
+
+    code_files = []
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path is None:
+            continue
+        path = os.path.abspath(path)
+        if path.endswith(".pyc"):
+            path = path[:-1]
+        if any(path.startswith(code_dir) for code_dir in code_dirs) and os.path.exists(path):
+            stat = os.stat(path)
+            code_files.append([path, stat.st_mtime, stat.st_size])
+    return sorted(code_files)
+
+
+def _code_file_unchanged(path, mtime, size):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_mtime == mtime and stat.st_size == size
+
+
+def _section_headings_to_json(section_headings):
+    return [
+        section_headings.name, list(section_headings.number), list(section_headings.modules),
+        [_section_headings_to_json(subsection) for subsection in section_headings.subsections],
+    ]
+
+
+def _section_headings_from_json(data, section_headings_cls):
+    name, number, modules, subsections = data
+    return section_headings_cls(
+        name, number, modules, [_section_headings_from_json(subsection, section_headings_cls)
+                                for subsection in subsections]
+    )
@@ -15,9 +15,6 @@ from pkgutil import find_loader
 
 from pimlico.core.dependencies.licenses import GNU_LGPL_V2, BSD, APACHE_V2, MIT
 
-import pkg_resources
-from pkg_resources import parse_version, parse_requirements
-
 from pimlico.core.dependencies.base import SoftwareDependency
 
 
@@ -167,6 +164,8 @@ class PythonPackageOnPip(PythonPackageDependency):
     def problems(self, local_config):
         problems = super(PythonPackageOnPip, self).problems(local_config)
         if not problems and self.min_version is not None:
+            # pkg_resources is slow to import, so we only load it when it's needed
+            from pkg_resources import parse_version
             # Also check that it's a sufficient version
             inst_version = self.get_installed_version(local_config)
             if parse_version(self.min_version) > parse_version(inst_version):
@@ -179,6 +178,9 @@ class PythonPackageOnPip(PythonPackageDependency):
         return "PythonPackageOnPip<%s%s>" % (self.name, (" (%s)" % self.package) if self.package != self.name else "")
 
     def get_installed_version(self, local_config):
+        import pkg_resources
+        from pkg_resources import parse_requirements
+
         reqs = list(parse_requirements(self.package))
         if len(reqs) != 1:
             raise ValueError("pip_package='{}', which could not be parsed as a requirement".format(self.package))
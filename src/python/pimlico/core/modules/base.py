@@ -31,6 +31,7 @@ from future.utils import raise_from
 from past.builtins import basestring
 from builtins import object
 
+import hashlib
 import json
 import os
 import shutil
@@ -45,6 +46,7 @@ from pimlico.core.modules.options import process_module_options
 from pimlico.datatypes.base import PimlicoDatatype, DynamicOutputDatatype, DynamicInputDatatypeRequirement, \
     MultipleInputs, DataNotReadyError
 from pimlico.utils.core import remove_duplicates
+from pimlico.utils.filesystem import write_file_atomically
 
 
 class BaseModuleInfo(object):
@@ -86,6 +88,19 @@ class BaseModuleInfo(object):
     """
     Usually None. In the case of stages of a multi-stage module, stores a pointer to the main module.
 
+    """
+    module_version = None
+    """
+    Version of the module's implementation, included in its fingerprint (see :meth:`get_fingerprint`).
+    Change this when a change to the module's code means that its output should be recomputed, so that
+    complete modules of this type will be rerun.
+
+    """
+    module_supports_incremental = False
+    """
+    Whether the module's executor can update its output once it's complete, processing only the parts of
+    the input that have changed (see :meth:`will_update_incrementally`). True for document map modules.
+
     """
     module_supports_python2 = False
     """
@@ -140,7 +155,17 @@ class BaseModuleInfo(object):
 
         self._metadata = None
         self._history = None
+        self._fingerprint = None
         self.__module_output_dir = None
+        # Inputs read from a scan shared with other modules, if being executed with a shared scan
+        # Maps input name to a pimlico.core.modules.shared_scan.ScanConsumer
+        self.shared_scan_consumers = {}
+        # If True, inputs that are still being written by a module currently being executed are
+        # read as they're written, instead of being considered not ready. Set by the run command's --follow
+        self.follow_inputs = False
+        # If True and the module supports it, complete output is updated for changed input, instead of the
+        # module being skipped. Set by the run command's --incremental
+        self.incremental = False
 
     def __repr__(self):
         return "%s(%s)" % (self.module_type_name, self.module_name)
@@ -187,8 +212,14 @@ class BaseModuleInfo(object):
     def metadata_filename(self):
         return os.path.join(self.pipeline.find_data_path(self.get_module_output_dir(), default="output"), "metadata")
 
-    def get_metadata(self):
-        if self._metadata is None:
+    def get_metadata(self, reload=False):
+        """
+        Get the module's metadata, which includes its execution status. It's read from disk the first
+        time and kept in memory after that.
+
+        :param reload: read the metadata from disk again, in case it's been updated by another process
+        """
+        if self._metadata is None or reload:
             # Try loading metadata
             self._metadata = {}
             if os.path.exists(self.metadata_filename):
@@ -218,8 +249,8 @@ class BaseModuleInfo(object):
         # Add our new values to it
         metadata.update(val_dict)
         # Write the whole thing out to the file
-        with open(os.path.join(output_dir, "metadata"), "w") as f:
-            json.dump(metadata, f)
+        # Replace the file atomically, so that it's never left half-written if we get killed
+        write_file_atomically(os.path.join(output_dir, "metadata"), json.dumps(metadata))
 
     def __get_status(self):
         # Check the metadata for current module status
@@ -230,6 +261,70 @@ class BaseModuleInfo(object):
 
     status = property(__get_status, __set_status)
 
+    def get_fingerprint(self):
+        """
+        A fingerprint of the module's configuration, computed from its type, :attr:`module_version`,
+        options and the fingerprints of the modules whose outputs it takes as inputs (and the names of
+        those outputs). If any of these change, so does the fingerprint. Options left at their default
+        values are not included, so adding a new option to a module type doesn't change the fingerprint.
+
+        The fingerprint is stored in the module's metadata once it has been successfully executed, so that
+        we can tell whether its output is out of date: see :meth:`is_changed`.
+
+        :return: hex digest string
+        """
+        if self._fingerprint is None:
+            module_options = dict(self.module_options)
+            options = dict(
+                (name, value) for (name, value) in self.options.items()
+                if name not in module_options or "default" not in module_options[name] or
+                value != module_options[name]["default"]
+            )
+            inputs = [
+                (input_name, [(self.pipeline[module_name].get_fingerprint(), output_name)
+                              for (module_name, output_name) in connections])
+                for (input_name, connections) in sorted(self.inputs.items())
+            ]
+            data = json.dumps([self.module_type_name, self.module_version, options, inputs],
+                              sort_keys=True, default=str)
+            self._fingerprint = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def is_changed(self):
+        """
+        Check whether the module has been executed, but its configuration has changed since then, according
+        to the fingerprint (see :meth:`get_fingerprint`) stored when it was executed. The module then needs
+        to be run again. Modules executed before fingerprints were stored are assumed not to have changed.
+
+        :return: True if the module is complete, but out of date
+        """
+        stored_fingerprint = self.get_metadata().get("fingerprint", None)
+        return self.status == "COMPLETE" and stored_fingerprint is not None and \
+            stored_fingerprint != self.get_fingerprint()
+
+    def will_update_incrementally(self):
+        """
+        Check whether executing the module will update its complete output, processing only the input
+        that has changed since it was executed. This is done if :attr:`incremental` is set, the module
+        type supports it (:attr:`module_supports_incremental`) and the module's configuration hasn't
+        changed (see :meth:`is_changed`), in which case all the input needs to be processed again.
+
+        """
+        return self.incremental and self.module_supports_incremental and self.status == "COMPLETE" and \
+            not self.is_changed()
+
+    def restore_interrupted_update(self):
+        """
+        Check whether an update of the module's complete output (see :meth:`will_update_incrementally`)
+        was killed before it could clean up and, if so, put the module's output and status back as
+        they should be. Called before deciding which modules to execute, when the module isn't locked.
+
+        Module types that support incremental updates should override this: by default, does nothing.
+
+        :return: True if the output of an interrupted update was cleaned up
+        """
+        return False
+
     @property
     def execution_history_path(self):
         return os.path.join(self.pipeline.find_data_path(self.get_module_output_dir(), default="output"), "history")
@@ -749,10 +844,13 @@ class BaseModuleInfo(object):
         if input_name is not None and input_name in dict(self.module_optional_inputs) and input_name not in self.inputs:
             return None
 
-        inputs = [
-            previous_module.get_output_reader_setup(output_name)
-            for previous_module, output_name in self.get_input_module_connection(input_name, always_list=True)
-        ]
+        inputs = []
+        for previous_module, output_name in self.get_input_module_connection(input_name, always_list=True):
+            reader_setup = previous_module.get_output_reader_setup(output_name)
+            if self.can_follow(previous_module, reader_setup):
+                # Read the data as it's written
+                reader_setup.follow(previous_module)
+            inputs.append(reader_setup)
         return inputs if always_list or self.is_multiple_input(input_name) else inputs[0]
 
     def get_input(self, input_name=None, always_list=False):
@@ -789,7 +887,24 @@ class BaseModuleInfo(object):
             else:
                 return readers
         else:
-            return input_setups.get_reader(self.pipeline, self.module_name)
+            reader = input_setups.get_reader(self.pipeline, self.module_name)
+            if input_name is None and len(self.module_inputs):
+                input_name = self.module_inputs[0][0]
+            if input_name in self.shared_scan_consumers:
+                # Iterate over the documents from a scan of the corpus shared with other modules
+                self.shared_scan_consumers[input_name].attach(reader)
+            return reader
+
+    def can_follow(self, previous_module, reader_setup):
+        """
+        Check whether one of this module's inputs, coming from the given previous module, is still being
+        written by the previous module and should be read as it's written. This is only done if
+        :attr:`follow_inputs` is set.
+
+        :param previous_module: module that the input comes from
+        :param reader_setup: setup for the output of the previous module that the input comes from
+        """
+        return self.follow_inputs and previous_module.is_locked() and reader_setup.being_written()
 
     def input_ready(self, input_name=None):
         """
@@ -904,6 +1019,9 @@ class BaseModuleInfo(object):
                     # Check whether we can get the output reader for the output corresponding to this input
                     reader_setup = previous_module.get_output_reader_setup(output_name)
                     if not reader_setup.ready_to_read():
+                        if self.can_follow(previous_module, reader_setup):
+                            # Not ready yet, but we can read it as it's being written
+                            continue
                         # If the previous module is a filter, it's more helpful to say exactly what data it's missing
                         if previous_module.is_filter():
                             missing_for_input.extend(previous_module.missing_data(assume_executed=assume_executed))
@@ -1260,7 +1378,8 @@ def collect_unexecuted_dependencies(modules):
     """
     Given a list of modules, checks through all the modules that they depend on to put together a list of
     modules that need to be executed so that the given list will be left in an executed state. The list
-    includes the modules themselves, if they're not fully executed, and unexecuted dependencies of any
+    includes the modules themselves, if they're not fully executed or have changed since they were
+    executed (see :meth:`BaseModuleInfo.is_changed`), and unexecuted dependencies of any
     unexecuted modules (recursively).
 
     :param modules: list of ModuleInfo instances
@@ -1276,7 +1395,7 @@ def collect_unexecuted_dependencies(modules):
         def _get_deps(mod):
             # If it's not executable, don't add it, but do recurse
             # If it's not completed, recurse and add
-            if not mod.module_executable or mod.status != "COMPLETE":
+            if not mod.module_executable or mod.status != "COMPLETE" or mod.is_changed():
                 unex_mods = []
                 # Add all of this module's unexecuted deps to the list first
                 for dep_name in mod.dependencies:
@@ -1322,8 +1441,8 @@ def collect_runnable_modules(pipeline, preliminary=False):
     # Go through the modules in order: modules can't depend on modules later in the pipeline
     for module_name in pipeline.modules:
         module = pipeline[module_name]
-        if module.module_executable and module.status != "COMPLETE":
-            # Executable module that's not been completed yet
+        if module.module_executable and (module.status != "COMPLETE" or module.is_changed()):
+            # Executable module that's not been completed yet, or needs to be run again
             # See whether it's ready to run
             if not module.missing_data(assume_executed=runnable_modules, allow_preliminary=preliminary):
                 # This module's ready, or will be by the time we get here
@@ -1400,9 +1519,11 @@ class BaseModuleExecutor(object):
     do the work of executing the module on given inputs, writing to given output locations.
 
     """
-    def __init__(self, module_instance_info, stage=None, debug=False, force_rerun=False):
+    def __init__(self, module_instance_info, stage=None, debug=False, force_rerun=False, incremental=False):
         self.debug = debug
         self.force_rerun = force_rerun
+        # Update the complete output for changed input only: see BaseModuleInfo.will_update_incrementally()
+        self.incremental = incremental
         self.stage = stage
         self.info = module_instance_info
         self.log = module_instance_info.pipeline.log.getChild(module_instance_info.module_name)
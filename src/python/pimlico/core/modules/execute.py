@@ -21,6 +21,8 @@ from builtins import str
 import os
 import socket
 import sys
+import threading
+from queue import Queue, Empty
 
 from io import StringIO
 from tarfile import TarFile
@@ -38,7 +40,8 @@ from pimlico.utils.logging import get_console_logger
 
 
 def check_and_execute_modules(pipeline, module_names, force_rerun=False, debug=False, log=None, all_deps=False,
-                              check_only=False, exit_on_error=False, preliminary=False, email=None):
+                              check_only=False, exit_on_error=False, preliminary=False, email=None,
+                              shared_scan=False, parallel=None, follow=False, incremental=False):
     """
     Main method called by the `run` command that first checks a pipeline, checks all pre-execution requirements
     of the modules to be executed and then executes each of them. The most common case is to execute just one
@@ -53,6 +56,15 @@ def check_and_execute_modules(pipeline, module_names, force_rerun=False, debug=F
     :param log: logger, if you have one you want to reuse
     :param all_deps: also include unexecuted dependencies of the given modules
     :param check_only: run all checks, but stop before executing. Used for `check` command
+    :param shared_scan: execute modules that read the same input together, sharing a single scan of the input.
+        See :mod:`pimlico.core.modules.shared_scan`
+    :param parallel: execute independent modules at the same time, using up to this many processes in total.
+        See :func:`execute_modules`
+    :param follow: allow modules to read inputs that are still being written by modules currently being
+        executed, as the data is written. See :func:`execute_modules`
+    :param incremental: instead of skipping modules that are already complete, update their output for any input
+        that has changed, where the module type supports it. See
+        :meth:`~pimlico.core.modules.base.BaseModuleInfo.will_update_incrementally`
     :return:
     """
     if log is None:
@@ -102,12 +114,33 @@ def check_and_execute_modules(pipeline, module_names, force_rerun=False, debug=F
                 m.module_name for m in modules if m.module_name not in requested_modules
             ))
 
+    for module in modules:
+        # If an incremental update was killed, its outputs need cleaning up before we check the module's status
+        if not check_only and not module.is_locked() and module.restore_interrupted_update():
+            log.warning("Update of module '%s' was killed before it finished: cleaned up its output and set its "
+                        "status back to complete" % module.module_name)
+
+    if incremental:
+        for module in modules:
+            module.incremental = True
+        updated_modules = [module.module_name for module in modules if module.will_update_incrementally()]
+        if updated_modules:
+            log.info("Complete modules whose output will be updated for new or changed input: %s" %
+                     ", ".join(updated_modules))
+
     if not force_rerun:
         # Check the status of the module, so as not to rerun already complete modules
         # By checking this now (even though there's also a check for it in execute_modules), we can remove it
         # from the list at this stage, saving on verbose output later on
+        # Complete modules whose config has changed since they were executed are run again
+        changed_modules = [module.module_name for module in modules if module.is_changed()]
+        if changed_modules:
+            log.info("Modules changed since they were run (options or inputs), which will be run again: %s" %
+                     ", ".join(changed_modules))
         complete_modules = [
-            module.module_name for module in modules if module.status == "COMPLETE"
+            module.module_name for module in modules
+            if module.status == "COMPLETE" and module.module_name not in changed_modules and
+            not module.will_update_incrementally()
         ]
         if complete_modules:
             log.warning("Removing modules already run to completion: %s" % ", ".join(complete_modules))
@@ -119,6 +152,10 @@ def check_and_execute_modules(pipeline, module_names, force_rerun=False, debug=F
                 log.warning("No modules left to run!")
                 return
 
+    if follow:
+        for module in modules:
+            module.follow_inputs = True
+
     # Check that the module is ready to run
     # If anything fails, an exception is raised
     preliminary_ignored_problems = check_modules_ready(pipeline, modules, log, preliminary=preliminary)
@@ -132,7 +169,8 @@ def check_and_execute_modules(pipeline, module_names, force_rerun=False, debug=F
         # Checks passed: run the module
         # Returns the exit status the should be used (i.e. 1 if there was an error)
         return execute_modules(pipeline, modules, log, force_rerun=force_rerun, debug=debug, exit_on_error=exit_on_error,
-                               preliminary=execute_preliminary, email=email)
+                               preliminary=execute_preliminary, email=email, shared_scan=shared_scan,
+                               parallel=parallel, follow=follow)
 
 
 def check_modules_ready(pipeline, modules, log, preliminary=False):
@@ -200,7 +238,26 @@ def check_modules_ready(pipeline, modules, log, preliminary=False):
 
 
 def execute_modules(pipeline, modules, log, force_rerun=False, debug=False, exit_on_error=False, preliminary=False,
-                    email=None):
+                    email=None, shared_scan=False, parallel=None, follow=False):
+    """
+    Execute a list of modules, once the checks in :func:`check_modules_ready` have been passed.
+
+    Normally, the modules are executed one after another, in the order given. If `parallel` is given,
+    modules are instead started as soon as all the modules in the list that they depend on have been
+    executed, so that independent modules are executed at the same time, as long as the total number of
+    processes used by the running modules stays within the given budget.
+
+    :param shared_scan: execute modules that read the same input together, sharing a single scan of the input.
+        See :mod:`pimlico.core.modules.shared_scan`
+    :param parallel: number of CPUs that may be in use by modules being executed at the same time. Each
+        module is assumed to use as many as the number of processes it's allowed (the `processes` local
+        config setting)
+    :param follow: when executing in parallel, a module may also be started while modules it depends
+        on are being executed, as soon as the outputs it reads from them have started being written. It
+        then reads its inputs as they're written. The modules must have `follow_inputs` set (see
+        :meth:`~pimlico.core.modules.base.BaseModuleInfo.can_follow`)
+    :return: exit status: 1 if there was an error, 0 otherwise
+    """
     # We assume that all checks have been run and that the modules are ready to be executed
     if len(modules) > 1:
         log.info("Executing a sequence of modules: %s" % ", ".join(mod.module_name for mod in modules))
@@ -210,187 +267,106 @@ def execute_modules(pipeline, modules, log, force_rerun=False, debug=False, exit
     success_modules = []
     skipped_modules = []
 
-    for module in modules:
-        module_name = module.module_name
-        module_error = False
-
-        if error_modules:
-            # Check (again) whether the module's ready
-            # If a previous module failed, we might be unable to run this one, even though it passed the checks
-            # when we assumed the previous one had been run
-            missing_inputs = module.missing_data(assume_failed=error_modules)
-            if missing_inputs:
-                log.warning("Cannot execute module '%s', since its inputs are not all ready (%s), "
-                            "after previous modules failed: %s" %
-                            (module_name, ", ".join(missing_inputs), "; ".join(error_modules)))
-                error_modules.append(module_name)
-                continue
-
-        # Check the status of the module, so we don't accidentally overwrite module output that's already complete
-        if module.status == "COMPLETE" and not force_rerun:
-            # Don't allow rerunning an already run module, unless --force-rerun was given
-            log.warning("module '%s' has already been run to completion. Use --force-rerun if you want to run "
-                        "it again and overwrite the output. Rerun not forced, so skipping module" % module_name)
-            skipped_modules.append(module_name)
-            continue
-
-        # Give some information to the stepper if we're in step mode
+    # Groups of modules to be executed together, sharing a scan of their input, keyed by each member's name
+    scan_groups = {}
+    if shared_scan:
         if pipeline.step:
-            pipeline._stepper.executing = True
-
-        try:
-            # If running multiple modules, output something between them so it's clear where they start and end
-            if len(modules) > 1:
-                mess = "Executing %s" % module_name
-                log.info("=" * (len(mess) + 4))
-                log.info("| %s |" % mess)
-                log.info("=" * (len(mess) + 4))
-
-            log.info("Executing module tree:")
-            execution_tree = module.get_execution_dependency_tree()
-            for line in format_execution_dependency_tree(execution_tree):
-                log.info("  %s" % line)
+            log.warning("Not sharing input scans between modules in step mode")
+        else:
+            from pimlico.core.modules.shared_scan import find_shared_scans
+            for source, readers in find_shared_scans(modules).items():
+                log.info("Modules %s will share a single scan of %s.%s" %
+                         (", ".join(module.module_name for (module, __) in readers), source[0], source[1]))
+                for module, __ in readers:
+                    scan_groups[module.module_name] = (source, readers)
+
+    # Each job is a single module, or a group sharing a scan: (shared input, list of (module, input name))
+    jobs = []
+    grouped = set()
+    for module in modules:
+        if module.module_name not in grouped:
+            source, group = scan_groups.get(module.module_name, (None, [(module, None)]))
+            grouped.update(group_module.module_name for (group_module, __) in group)
+            jobs.append((source, group))
+
+    if parallel is not None and pipeline.step:
+        log.warning("Not executing modules in parallel in step mode")
+        parallel = None
+    show_banner = len(modules) > 1
+
+    def _modules_to_execute(group):
+        # Check the modules of a job are still ready to run and return those that should be run
+        to_execute = []
+        for group_module, input_name in group:
+            module_name = group_module.module_name
+
+            if error_modules:
+                # Check (again) whether the module's ready
+                # If a previous module failed, we might be unable to run this one, even though it passed the checks
+                # when we assumed the previous one had been run
+                missing_inputs = group_module.missing_data(assume_failed=error_modules)
+                if missing_inputs:
+                    log.warning("Cannot execute module '%s', since its inputs are not all ready (%s), "
+                                "after previous modules failed: %s" %
+                                (module_name, ", ".join(missing_inputs), "; ".join(error_modules)))
+                    error_modules.append(module_name)
+                    continue
 
             # Check the status of the module, so we don't accidentally overwrite module output that's already complete
-            if module.status == "COMPLETE":
-                # Should only get here in the case of force rerun
-                assert force_rerun
-                log.info("module '%s' already fully run, but forcing rerun. If you want to be sure of clearing old "
-                         "data, use the 'reset' command" % module_name)
-                # We're rerunning, but don't delete old data (i.e. reset module), as there may be something there
-                # that the user wants to keep, e.g. caches. They can, of course, reset the module manually if they want
-                module.status = "STARTED"
-            elif module.status == "UNEXECUTED":
-                # Not done anything on this yet
-                module.status = "STARTED"
-                module.add_execution_history_record("Starting execution from the beginning")
-            else:
-                log.warn("module '%s' has been partially completed before and left with status '%s'. Starting executor" %
-                         (module_name, module.status))
-                module.add_execution_history_record("Starting executor with status '%s'" % module.status)
-
-            # Tell the user where we put the output
-            for output_name in module.output_names:
-                output_dir = module.get_absolute_output_dir(output_name)
-                log.info("Outputting '%s' in %s" % (output_name, output_dir))
-
-            # Store a copy of all the config files from which the pipeline was loaded, so we can see exactly
-            # what we did later
-            config_store_path = os.path.join(module.get_module_output_dir(absolute=True), "pipeline_config.tar")
-            run_num = 1
-            while os.path.exists(config_store_path):
-                config_store_path = os.path.join(module.get_module_output_dir(absolute=True),
-                                                 "pipeline_config.%d.tar" % run_num)
-                run_num += 1
-            with TarFile(config_store_path, "w") as config_store_tar:
-                # There may be multiple config files due to includes: store them all
-                # To be able to recreate the pipeline easily, we should store the directory structure relative to the
-                # main config, but since this is mainly just for looking at, we just chuck all the files in
-                for config_filename in pipeline.all_filenames:
-                    config_store_tar.add(config_filename, recursive=False, arcname=os.path.basename(config_filename))
-            module.add_execution_history_record("Storing full pipeline config used to execute %s in %s" %
-                                                (module_name, config_store_path))
-
-            try:
-                module.lock()
-
-                try:
-                    # Get hold of an executor for this module
-                    executor = module.load_executor()
-                    try:
-                        # Give the module an initial in-progress status
-                        end_status = executor(module, debug=debug, force_rerun=force_rerun).execute()
-                    except Exception as e:
-                        # Catch all exceptions that occur within the executor and wrap them in a ModuleExecutionError
-                        # so they can be nicely handled by the error reporting below
-                        # Ideally, most expected exceptions will be one of these two types anyway, but of course
-                        # unexpected things can go wrong!
-                        #
-                        # Get traceback for the exception currently being handled
-                        # Include the formatted traceback as debugging info for the reraised exception
-                        debugging_info = "Uncaught exception in executor. Traceback from original exception: \n%s" % \
-                                         "".join(format_tb(sys.exc_info()[2]))
-                        raise_from(
-                            ModuleExecutionError(str(e), debugging_info=debugging_info),
-                            e
-                        )
-                except (ModuleInfoLoadError, ModuleExecutionError) as e:
-                    if type(e) is ModuleExecutionError:
-                        # If there's any error, note in the history that execution didn't complete
-                        module.add_execution_history_record("Error executing %s: %s" % (module_name, e))
-                        log.error("Error executing module '%s': %s" % (module_name, e))
-                        # Allow a different end status to be passed up in the exception
-                        # If the exception origin didn't specify anything, we just say the module failed
-                        end_status = e.end_status or "FAILED"
-                    else:
-                        module.add_execution_history_record("Error loading %s for execution: %s" % (module_name, e))
-                        log.error("Error loading %s for execution: %s" % (module_name, e))
-                        # If the module didn't even load, use unstarted status
-                        end_status = "UNEXECUTED"
-
-                    debug_mess = StringIO()
-                    print("Top-level error", file=debug_mess)
-                    print("---------------", file=debug_mess)
-                    print(str(format_exc()), file=debug_mess)
-                    print(format_execution_error(e), file=debug_mess)
-                    debug_mess = debug_mess.getvalue()
-
-                    # Put the whole error info into a file so we can see what went wrong
-                    error_filename = module.get_new_log_filename()
-                    with open(error_filename, "w") as error_file:
-                        error_file.write(debug_mess)
-
-                    if debug or exit_on_error:
-                        # In debug mode, also output the full info to the terminal
-                        # Do this also if we're dropping out after encountering an error
-                        print(debug_mess, file=sys.stderr)
-                    else:
-                        log.error("Full debug info output to %s" % error_filename)
-                        log.error("Append '-e' to run command to view the full log")
-
-                    # Only send email error report if this was an execution error, not a load error
-                    if type(e) is ModuleExecutionError and email == "modend":
-                        # Finer-grained email notifications have been requested
-                        # Send an error report now
-                        send_module_report_email(pipeline, module, str(e), debug_mess)
-
-                    module.add_execution_history_record("Debugging output in %s" % error_filename)
-                    module_error = True
-                except KeyboardInterrupt:
-                    module.add_execution_history_record("Execution of %s halted by user" % module_name)
-                    raise
-            finally:
-                # Always remove the lock at the end, even if something goes wrong
-                module.unlock()
+            if group_module.status == "COMPLETE" and not force_rerun and not group_module.is_changed() and \
+                    not group_module.will_update_incrementally():
+                # Don't allow rerunning an already run module, unless --force-rerun was given
+                log.warning("module '%s' has already been run to completion. Use --force-rerun if you want to run "
+                            "it again and overwrite the output. Rerun not forced, so skipping module" % module_name)
+                skipped_modules.append(module_name)
+                continue
 
-            if end_status is None or end_status == "COMPLETE":
-                # Update the module status so we know it's been completed
-                if preliminary:
-                    # Don't set status to COMPLETE if we were just doing a preliminary run, to avoid confusion
-                    module.status = "COMPLETE_PRELIMINARY"
-                    module.add_execution_history_record("Preliminary exectuion complete")
-                else:
-                    module.status = "COMPLETE"
-                    module.add_execution_history_record("Execution completed successfully")
+            if group_module.is_locked():
+                # Something else has started executing the module since we checked
+                log.error("Cannot execute module '%s', since it is locked: is it currently being executed?" %
+                          module_name)
+                error_modules.append(module_name)
+                continue
+            to_execute.append((group_module, input_name))
+        return to_execute
+
+    def _execute_job(source, to_execute):
+        # Returns a list of (module name, error) pairs
+        if len(to_execute) > 1:
+            return execute_modules_with_shared_scan(
+                pipeline, to_execute, source, log, force_rerun=force_rerun, debug=debug, exit_on_error=exit_on_error,
+                preliminary=preliminary, email=email
+            )
+        else:
+            module = to_execute[0][0]
+            # When modules are running at the same time, make it clear which each log message comes from
+            module_log = log.getChild(module.module_name) if parallel is not None else log
+            return [(module.module_name, execute_module(
+                pipeline, module, module_log, force_rerun=force_rerun, debug=debug, exit_on_error=exit_on_error,
+                preliminary=preliminary, email=email, show_banner=show_banner
+            ))]
+
+    def _record_results(results):
+        # Returns True if any module failed
+        for module_name, module_error in results:
+            if module_error:
+                # Module failed in one way or another
+                error_modules.append(module_name)
             else:
-                # Custom status was given
-                module.status = end_status
-                module.add_execution_history_record("Execution completed with status %s" % end_status)
-        except Exception as e:
-            # Intercept all exceptions to add the name of the module that they came from
-            e.module_name = module_name
-            module.add_execution_history_record("Execution interruption by %s exception" % type(e).__name__)
-            # Reraise the exception to be caught higher up
-            raise
+                success_modules.append(module_name)
+        return any(module_error for (__, module_error) in results)
 
-        if module_error:
-            # Module failed in one way or another
-            error_modules.append(module_name)
-            if exit_on_error:
+    if parallel is not None and len(jobs) > 1:
+        execute_jobs_in_parallel(pipeline, jobs, parallel, _modules_to_execute, _execute_job, _record_results, log,
+                                 exit_on_error=exit_on_error, follow=follow)
+    else:
+        for source, group in jobs:
+            to_execute = _modules_to_execute(group)
+            if len(to_execute) == 0:
+                continue
+            if _record_results(_execute_job(source, to_execute)) and exit_on_error:
                 # Don't carry on to the next module
                 break
-        else:
-            success_modules.append(module_name)
 
     # Notify the stepper (if we're debugging) that we're not executing any more
     if pipeline.step:
@@ -424,6 +400,415 @@ def execute_modules(pipeline, modules, log, force_rerun=False, debug=False, exit
         return 0
 
 
+def execute_jobs_in_parallel(pipeline, jobs, cpus, modules_to_execute, execute_job, record_results, log,
+                             exit_on_error=False, follow=False):
+    """
+    Scheduler used by :func:`execute_modules` to execute modules in parallel.
+
+    Jobs are started, in the order given, as soon as none of the modules they depend on are still waiting
+    to be executed or being executed. Each job is executed in its own thread. A job may only be started if
+    the total number of processes used by the running jobs, including it, is no more than `cpus`, unless
+    nothing else is running. Jobs are not started out of turn to fill up the budget, so that a job needing
+    many processes isn't held back indefinitely by smaller ones.
+
+    If `exit_on_error` is given, no more jobs are started once any module has failed, but those already
+    running are allowed to finish.
+
+    If `follow` is given, a job may also be started while modules it depends on are still being executed,
+    once all of its modules' inputs are ready to be read as they're written.
+
+    If the scheduler is interrupted (e.g. by Ctrl-C), the running jobs are stopped
+    (see :func:`stop_background_execution`) before the interruption is passed on.
+
+    :param jobs: list of `(shared input, list of (module, input name))`
+    :param cpus: budget of processes that may be in use at once
+    :param modules_to_execute: function called on the modules of a job just before it's started,
+        returning those that should be executed
+    :param execute_job: function to execute the modules of a job, returning a list of
+        `(module name, error)` pairs
+    :param record_results: function called (from the main thread) with the results of a job once it's
+        finished, returning True if any module failed
+    """
+    log.info("Executing modules in parallel, using up to %d processes at once" % cpus)
+    pending = list(jobs)
+    # Thread -> (module names, processes used)
+    running = {}
+    finished_queue = Queue()
+    stopping = False
+    exception = None
+
+    def _job_names(job):
+        return set(module.module_name for (module, __) in job[1])
+
+    def _run(thread_job, to_execute):
+        try:
+            results = execute_job(thread_job[0], to_execute)
+        except BaseException as e:
+            finished_queue.put((threading.current_thread(), None, e))
+        else:
+            finished_queue.put((threading.current_thread(), results, None))
+
+    try:
+        while pending or running:
+            if not stopping:
+                # Start any jobs that are now ready
+                waiting_names = set().union(*[_job_names(job) for job in pending]) if pending else set()
+                running_names = set().union(*[names for (names, __) in running.values()]) if running else set()
+                for job in list(pending):
+                    names = _job_names(job)
+                    dependencies = set(
+                        dep for (module, __) in job[1] for dep in module.get_transitive_dependencies()
+                    )
+                    if dependencies & (waiting_names - names):
+                        # Must wait for modules it depends on
+                        continue
+                    if dependencies & running_names and \
+                            not (follow and all(len(module.missing_data()) == 0 for (module, __) in job[1])):
+                        # Must wait for modules it depends on to finish, or at least start writing their output
+                        continue
+                    processes = min(cpus, sum(get_module_processes(module) for (module, __) in job[1]))
+                    if running and sum(used for (__, used) in running.values()) + processes > cpus:
+                        # Wait for enough other jobs to finish
+                        break
+                    pending.remove(job)
+                    waiting_names -= names
+
+                    to_execute = modules_to_execute(job[1])
+                    if len(to_execute) == 0:
+                        continue
+                    log.info("Starting execution of %s" % ", ".join(module.module_name for (module, __) in to_execute))
+                    thread = threading.Thread(target=_run, args=(job, to_execute),
+                                              name="execute-%s" % "-".join(sorted(names)))
+                    running[thread] = (names, processes)
+                    running_names |= names
+                    thread.start()
+
+            if not running:
+                if stopping or not pending:
+                    break
+                # Nothing could be started, which should only happen if the jobs depend on each other in a cycle
+                raise ModuleExecutionError("could not schedule modules for execution: %s" %
+                                           ", ".join(sorted(set().union(*[_job_names(job) for job in pending]))))
+
+            # Wait for a job to finish, with a timeout so that we can still be interrupted
+            try:
+                thread, results, error = finished_queue.get(timeout=0.5)
+            except Empty:
+                continue
+            thread.join()
+            del running[thread]
+            if error is not None:
+                # Unexpected error: don't start anything else and pass it up once the others are done
+                stopping = True
+                if exception is None:
+                    exception = error
+            elif record_results(results) and exit_on_error:
+                # Don't carry on to the next modules
+                stopping = True
+    except BaseException:
+        # Probably interrupted by the user: let the running modules stop cleanly before passing on the interruption
+        stop_background_execution(pipeline, list(running), log)
+        raise
+
+    if exception is not None:
+        raise exception
+
+
+def get_module_processes(module):
+    """
+    Number of processes a module will use when it's executed: see
+    :attr:`~pimlico.core.modules.base.BaseModuleExecutor.processes`.
+
+    """
+    return module.pipeline.processes if not module.is_filter() else 1
+
+
+def execute_module(pipeline, module, log, force_rerun=False, debug=False, exit_on_error=False, preliminary=False,
+                   email=None, show_banner=False):
+    """
+    Execute a single module, once it has been checked that it's ready to run, recording its status and
+    execution history and reporting any errors. Used by :func:`execute_modules` for each module it runs.
+
+    :param show_banner: output a banner before execution to mark where the module's output begins
+    :return: True if the module's execution failed
+    """
+    module_name = module.module_name
+    module_error = False
+
+    # Give some information to the stepper if we're in step mode
+    if pipeline.step:
+        pipeline._stepper.executing = True
+
+    try:
+        # If running multiple modules, output something between them so it's clear where they start and end
+        if show_banner:
+            mess = "Executing %s" % module_name
+            log.info("=" * (len(mess) + 4))
+            log.info("| %s |" % mess)
+            log.info("=" * (len(mess) + 4))
+
+        log.info("Executing module tree:")
+        execution_tree = module.get_execution_dependency_tree()
+        for line in format_execution_dependency_tree(execution_tree):
+            log.info("  %s" % line)
+
+        # Check the status of the module, so we don't accidentally overwrite module output that's already complete
+        # This has to be checked before the status is changed
+        incremental = module.will_update_incrementally()
+        if module.status == "COMPLETE":
+            # Should only get here in the case of force rerun, incremental update, or if the module's changed since
+            # it was run
+            if incremental:
+                log.info("module '%s' already fully run: updating its output for new or changed input" % module_name)
+                module.add_execution_history_record("Updating output for new or changed input")
+            elif module.is_changed():
+                log.info("module '%s' already fully run, but its options or inputs have changed since, so running "
+                         "it again" % module_name)
+                module.add_execution_history_record("Rerunning, since module's config has changed since last run")
+            else:
+                assert force_rerun
+                log.info("module '%s' already fully run, but forcing rerun. If you want to be sure of clearing old "
+                         "data, use the 'reset' command" % module_name)
+            # We're rerunning, but don't delete old data (i.e. reset module), as there may be something there
+            # that the user wants to keep, e.g. caches. They can, of course, reset the module manually if they want
+            module.status = "STARTED"
+        elif module.status == "UNEXECUTED":
+            # Not done anything on this yet
+            module.status = "STARTED"
+            module.add_execution_history_record("Starting execution from the beginning")
+        else:
+            log.warn("module '%s' has been partially completed before and left with status '%s'. Starting executor" %
+                     (module_name, module.status))
+            module.add_execution_history_record("Starting executor with status '%s'" % module.status)
+
+        # Tell the user where we put the output
+        for output_name in module.output_names:
+            output_dir = module.get_absolute_output_dir(output_name)
+            log.info("Outputting '%s' in %s" % (output_name, output_dir))
+
+        # Store a copy of all the config files from which the pipeline was loaded, so we can see exactly
+        # what we did later
+        config_store_path = os.path.join(module.get_module_output_dir(absolute=True), "pipeline_config.tar")
+        run_num = 1
+        while os.path.exists(config_store_path):
+            config_store_path = os.path.join(module.get_module_output_dir(absolute=True),
+                                             "pipeline_config.%d.tar" % run_num)
+            run_num += 1
+        with TarFile(config_store_path, "w") as config_store_tar:
+            # There may be multiple config files due to includes: store them all
+            # To be able to recreate the pipeline easily, we should store the directory structure relative to the
+            # main config, but since this is mainly just for looking at, we just chuck all the files in
+            for config_filename in pipeline.all_filenames:
+                config_store_tar.add(config_filename, recursive=False, arcname=os.path.basename(config_filename))
+        module.add_execution_history_record("Storing full pipeline config used to execute %s in %s" %
+                                            (module_name, config_store_path))
+
+        try:
+            module.lock()
+
+            try:
+                # Get hold of an executor for this module
+                executor = module.load_executor()
+                try:
+                    # Give the module an initial in-progress status
+                    end_status = executor(module, debug=debug, force_rerun=force_rerun,
+                                          incremental=incremental).execute()
+                except Exception as e:
+                    # Catch all exceptions that occur within the executor and wrap them in a ModuleExecutionError
+                    # so they can be nicely handled by the error reporting below
+                    # Ideally, most expected exceptions will be one of these two types anyway, but of course
+                    # unexpected things can go wrong!
+                    #
+                    # Get traceback for the exception currently being handled
+                    # Include the formatted traceback as debugging info for the reraised exception
+                    debugging_info = "Uncaught exception in executor. Traceback from original exception: \n%s" % \
+                                     "".join(format_tb(sys.exc_info()[2]))
+                    # Keep any end status given by the executor
+                    raise_from(
+                        ModuleExecutionError(str(e), debugging_info=debugging_info,
+                                             end_status=getattr(e, "end_status", None)),
+                        e
+                    )
+            except (ModuleInfoLoadError, ModuleExecutionError) as e:
+                if type(e) is ModuleExecutionError:
+                    # If there's any error, note in the history that execution didn't complete
+                    module.add_execution_history_record("Error executing %s: %s" % (module_name, e))
+                    log.error("Error executing module '%s': %s" % (module_name, e))
+                    # Allow a different end status to be passed up in the exception
+                    # If the exception origin didn't specify anything, we just say the module failed
+                    end_status = e.end_status or "FAILED"
+                else:
+                    module.add_execution_history_record("Error loading %s for execution: %s" % (module_name, e))
+                    log.error("Error loading %s for execution: %s" % (module_name, e))
+                    # If the module didn't even load, use unstarted status
+                    end_status = "UNEXECUTED"
+
+                debug_mess = StringIO()
+                print("Top-level error", file=debug_mess)
+                print("---------------", file=debug_mess)
+                print(str(format_exc()), file=debug_mess)
+                print(format_execution_error(e), file=debug_mess)
+                debug_mess = debug_mess.getvalue()
+
+                # Put the whole error info into a file so we can see what went wrong
+                error_filename = module.get_new_log_filename()
+                with open(error_filename, "w") as error_file:
+                    error_file.write(debug_mess)
+
+                if debug or exit_on_error:
+                    # In debug mode, also output the full info to the terminal
+                    # Do this also if we're dropping out after encountering an error
+                    print(debug_mess, file=sys.stderr)
+                else:
+                    log.error("Full debug info output to %s" % error_filename)
+                    log.error("Append '-e' to run command to view the full log")
+
+                # Only send email error report if this was an execution error, not a load error
+                if type(e) is ModuleExecutionError and email == "modend":
+                    # Finer-grained email notifications have been requested
+                    # Send an error report now
+                    send_module_report_email(pipeline, module, str(e), debug_mess)
+
+                module.add_execution_history_record("Debugging output in %s" % error_filename)
+                module_error = True
+            except KeyboardInterrupt as e:
+                module.add_execution_history_record("Execution of %s halted by user" % module_name)
+                if getattr(e, "end_status", None) == "COMPLETE":
+                    # The executor put back the complete output that was there before (keeping its fingerprint)
+                    module.status = "COMPLETE"
+                    module.add_execution_history_record("Previous complete output kept")
+                raise
+
+            if end_status is None or end_status == "COMPLETE":
+                # Update the module status so we know it's been completed
+                if preliminary:
+                    # Don't set status to COMPLETE if we were just doing a preliminary run, to avoid confusion
+                    module.status = "COMPLETE_PRELIMINARY"
+                    module.add_execution_history_record("Preliminary exectuion complete")
+                else:
+                    module.status = "COMPLETE"
+                    # Record the config that produced the output, so we know if it needs to be run again
+                    module.set_metadata_value("fingerprint", module.get_fingerprint())
+                    if module_error:
+                        # The executor failed, but put back the complete output that was there before
+                        module.add_execution_history_record("Execution failed, previous complete output kept")
+                    else:
+                        module.add_execution_history_record("Execution completed successfully")
+            else:
+                # Custom status was given
+                module.status = end_status
+                module.add_execution_history_record("Execution completed with status %s" % end_status)
+        finally:
+            # Always remove the lock at the end, even if something goes wrong
+            # This is done once the status has been set, so that modules following the output can check it
+            module.unlock()
+    except Exception as e:
+        # Intercept all exceptions to add the name of the module that they came from
+        e.module_name = module_name
+        module.add_execution_history_record("Execution interruption by %s exception" % type(e).__name__)
+        # Reraise the exception to be caught higher up
+        raise
+
+    return module_error
+
+
+def execute_modules_with_shared_scan(pipeline, modules, source, log, **kwargs):
+    """
+    Execute several modules at once, each in its own thread, while they share a single scan
+    of an input that they all read. See :mod:`pimlico.core.modules.shared_scan`.
+
+    :param modules: list of `(module, input name)` pairs, giving the input of each module that reads the source
+    :param source: `(module name, output name)` of the shared input
+    :param kwargs: passed through to :func:`execute_module`
+    :return: list of `(module name, error)` pairs, where `error` is True if the module's execution failed
+    """
+    from pimlico.core.modules.shared_scan import SharedScan, get_shared_scan_buffer
+
+    scan = SharedScan("%s.%s" % source, pipeline, buffer_size=get_shared_scan_buffer(pipeline))
+    for module, input_name in modules:
+        module.shared_scan_consumers[input_name] = scan.add_consumer(module.module_name)
+
+    module_errors = {}
+    exceptions = []
+    # Each thread puts its module's name here when it's finished
+    finished_queue = Queue()
+
+    def _execute(module):
+        try:
+            module_errors[module.module_name] = execute_module(
+                pipeline, module, log.getChild(module.module_name), show_banner=True, **kwargs
+            )
+        except BaseException as e:
+            module_errors[module.module_name] = True
+            exceptions.append(e)
+        finally:
+            # Don't let the scan wait for a module that's stopped
+            for consumer in module.shared_scan_consumers.values():
+                consumer.detach()
+            module.shared_scan_consumers = {}
+            finished_queue.put(module.module_name)
+
+    threads = [
+        threading.Thread(target=_execute, args=(module,), name="execute-%s" % module.module_name)
+        for (module, __) in modules
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for __ in threads:
+            while True:
+                # Wait with a timeout, so that we can still be interrupted
+                try:
+                    finished_queue.get(timeout=0.5)
+                except Empty:
+                    continue
+                else:
+                    break
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        # Probably interrupted by the user: let the modules stop cleanly before passing on the interruption
+        stop_background_execution(pipeline, threads, log)
+        raise
+
+    if exceptions:
+        # Pass up the first unexpected error, as if the modules had been executed one after another
+        raise exceptions[0]
+    return [(module.module_name, module_errors[module.module_name]) for (module, __) in modules]
+
+
+def stop_background_execution(pipeline, threads, log):
+    """
+    Stop the execution of modules in background threads, when execution has been interrupted in
+    the main thread (e.g. by Ctrl-C), and wait for them to stop.
+
+    Long-running parts of module execution, such as document map processing, check now and again
+    whether execution has been stopped (:func:`check_execution_stopped`). The interruption is then
+    handled just as if the module had been executed in the main thread: for example, the progress
+    of document map modules is stored and the modules are unlocked. Modules that don't check are
+    left to finish executing.
+
+    :param threads: threads that modules are being executed in
+    """
+    pipeline.execution_stopped.set()
+    running = [thread for thread in threads if thread.is_alive()]
+    if running:
+        log.warning("Execution interrupted: waiting for %d running module(s) to stop" % len(running))
+    for thread in running:
+        thread.join()
+
+
+def check_execution_stopped(pipeline):
+    """
+    Called by long-running parts of module execution to check whether the execution of modules in
+    background threads has been stopped (see :func:`stop_background_execution`). If so, raises
+    :class:`ExecutionInterrupted`.
+
+    """
+    if pipeline.execution_stopped.is_set():
+        raise ExecutionInterrupted("execution stopped")
+
+
 def format_execution_dependency_tree(tree):
     """
     Takes a tree structure of modules and their inputs, tracing where
@@ -536,3 +921,12 @@ class ModuleAlreadyCompletedError(ModuleExecutionError):
 
 class StopProcessing(Exception):
     pass
+
+
+class ExecutionInterrupted(KeyboardInterrupt):
+    """
+    Raised in a module being executed in a background thread when execution has been interrupted
+    in the main thread. Like a KeyboardInterrupt, it's not treated as an error in the module.
+
+    """
+    pass
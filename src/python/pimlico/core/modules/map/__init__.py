@@ -6,6 +6,8 @@ standard_library.install_aliases()
 from builtins import zip
 from builtins import object
 
+import os
+import sys
 import threading
 import warnings
 
@@ -14,19 +16,24 @@ tblib.pickling_support.install()
 
 from queue import Queue, Empty, Full
 from threading import Thread
-from time import sleep
+from time import sleep, time
 from traceback import format_exc
 
 from pimlico.core.config import PipelineStructureError
 from pimlico.core.modules.base import BaseModuleInfo, BaseModuleExecutor, satisfies_typecheck
-from pimlico.core.modules.execute import ModuleExecutionError, StopProcessing
+from pimlico.core.modules.execute import ModuleExecutionError, StopProcessing, check_execution_stopped
+from pimlico.core.modules.options import str_to_bool
 from pimlico.datatypes.corpora import is_invalid_doc, invalid_document
-from pimlico.datatypes.corpora.data_points import RawDocumentType
-from pimlico.datatypes.corpora.grouped import GroupedCorpus, AlignedGroupedCorpora
+from pimlico.datatypes.corpora.data_points import RawDocumentType, DataPointType
+from pimlico.datatypes.corpora.grouped import GroupedCorpus, AlignedGroupedCorpora, RawDocumentRecord, \
+    supports_raw_records
 from pimlico.utils.core import multiwith, raise_from
+from pimlico.utils.filesystem import parse_file_size
 from pimlico.utils.pipes import qget
-from pimlico.utils.progress import get_progress_bar
+from pimlico.utils.progress import get_progress_bar, get_open_progress_bar
 from .benchmark import benchmarker
+from .incremental import IncrementalUpdate, InputHashRecorder, discard_input_hashes, get_input_hashes_path
+from .shards import OutputShards, ShardRecord, ShardedOutput
 
 
 class DocumentMapModuleInfo(BaseModuleInfo):
@@ -43,6 +50,8 @@ class DocumentMapModuleInfo(BaseModuleInfo):
     """
     # Most subclasses will want to override this to give a more specific datatype for the output
     module_outputs = [("documents", GroupedCorpus(RawDocumentType()))]
+    # Output can be updated for new or changed documents: see pimlico.core.modules.map.incremental
+    module_supports_incremental = True
 
     def __init__(self, module_name, pipeline, **kwargs):
         super(DocumentMapModuleInfo, self).__init__(module_name, pipeline, **kwargs)
@@ -68,19 +77,35 @@ class DocumentMapModuleInfo(BaseModuleInfo):
         return datasets
     input_corpora = property(_load_input_readers)
 
-    def get_writers(self, append=False):
+    def get_writers(self, append=False, truncate_to=None):
         if self._writers is None:
-            self._writers = tuple([writer for (nm, writer) in self.get_named_writers(append=append)])
+            self._writers = tuple([writer for (nm, writer) in self.get_named_writers(append=append,
+                                                                                     truncate_to=truncate_to)])
         return self._writers
 
-    def get_named_writers(self, append=False):
+    def get_named_writers(self, append=False, truncate_to=None):
+        """
+        :param truncate_to: when appending, number of documents to keep in each output's existing
+            archives, given as a dict mapping output names to counts. Any documents written after
+            these are removed. Outputs not included are not truncated
+        """
         if self._named_writers is None:
             # Only include the outputs that are tarred corpus types
             # This allows there to be other outputs aside from those mapped to
             outputs = self.get_grouped_corpus_output_names()
-            self._named_writers = tuple((name, self.get_output_writer(name, append=append)) for name in outputs)
+            named_writers = []
+            for name in outputs:
+                if append and truncate_to is not None and name in truncate_to:
+                    writer = self.get_output_writer(name, append=append, truncate_to=truncate_to[name])
+                else:
+                    writer = self.get_output_writer(name, append=append)
+                named_writers.append((name, writer))
+            self._named_writers = tuple(named_writers)
         return self._named_writers
 
+    def restore_interrupted_update(self):
+        return IncrementalUpdate.restore_previous_outputs(self)
+
     def get_grouped_corpus_output_names(self):
         """ Get a list of the names of outputs that are grouped corpora """
         return [name for name in self.output_names
@@ -120,13 +145,46 @@ class DocumentMapModuleExecutor(BaseModuleExecutor):
     case). However, sometimes parallelizing isn't so simple: in these cases, consider using the tools in
     :mod:.singleproc.
 
+    Progress through the corpus is stored in the module's metadata, so that processing can be resumed
+    if it is stopped part-way through. This is not done after every document, since rewriting the
+    metadata is slow, but every `checkpoint_docs` documents or `checkpoint_interval` seconds, whichever
+    comes first, and when processing stops. The output writers are flushed to disk at the same time,
+    so the stored progress never gets ahead of the written output. If the process is killed without
+    storing its progress, documents may have been written after the stored progress: when resuming,
+    these are removed from the outputs first.
+
+    Executors whose workers are separate processes may let the workers write the output documents
+    to disk themselves: see :meth:`use_worker_writes` and :mod:`.shards`.
+
+    When the `run` command's `--incremental` option is used, a hash of the input documents that each
+    output document was produced from is recorded, so that complete output can later be updated by
+    processing only new or changed input documents: see :mod:`.incremental`.
+
     """
     ALLOW_SKIP_OUTPUT = False
+    #: Set to True if the executor outputs every input document unchanged. Then, where possible, the
+    #: stored records are copied straight to the output, without processing: see :meth:`use_raw_passthrough`
+    RAW_PASSTHROUGH = False
+    #: Store processing progress after this many documents have been completed since the last time
+    checkpoint_docs = 1000
+    #: Store processing progress if it's been this many seconds since the last time
+    checkpoint_interval = 30.
 
     def __init__(self, module_instance_info, **kwargs):
         super(DocumentMapModuleExecutor, self).__init__(module_instance_info, **kwargs)
         self.input_corpora = self.info.input_corpora
         self.input_iterator = AlignedGroupedCorpora(self.input_corpora)
+        # Progress that hasn't yet been stored in the metadata: (docs completed, archive name, filename)
+        self._unsaved_status = None
+        self._last_checkpoint_docs = 0
+        self._last_checkpoint_time = time()
+        # Set during execution if workers are writing their output to shards
+        self.output_shards = None
+        # Set when the pool is created: None if processing is done without a pool
+        self.pool = None
+        # Set by a filter module if earlier filters' processing should be done by this executor's
+        #  workers before their own: see pimlico.core.modules.map.filter.FusedFilterStages
+        self.fused_stages = None
 
     def preprocess(self):
         """
@@ -189,12 +247,142 @@ class DocumentMapModuleExecutor(BaseModuleExecutor):
             start_after = None
         return docs_completed, start_after
 
-    def update_processing_status(self, docs_completed, archive_name, filename):
+    def update_processing_status(self, docs_completed, archive_name, filename, writers=()):
+        """
+        Record that processing has been completed up to the given document. The status is only
+        actually stored (see :meth:`checkpoint_processing_status`) if enough documents have
+        been processed or enough time has passed since it was last stored.
+
+        :param writers: output writers to flush before storing the status
+        """
+        self._unsaved_status = (docs_completed, archive_name, filename)
+        if docs_completed - self._last_checkpoint_docs >= self.checkpoint_docs or \
+                time() - self._last_checkpoint_time >= self.checkpoint_interval:
+            self.checkpoint_processing_status(writers)
+
+    def checkpoint_processing_status(self, writers=()):
+        """
+        Store the most recent processing status given to :meth:`update_processing_status` in
+        the module's metadata, if it's not been stored already. First, the writers are flushed,
+        so that everything recorded as completed has been written to disk.
+
+        The number of documents in each output at this point is also stored. Documents may be
+        written after this before processing is stopped, if it's killed without storing its
+        status: when resuming, the outputs are cut back to the stored number of documents.
+
+        """
+        if self._unsaved_status is None:
+            return
+        docs_completed, archive_name, filename = self._unsaved_status
+        for writer in writers:
+            # Not all writers need flushing
+            if hasattr(writer, "flush"):
+                writer.flush()
         self.info.set_metadata_values({
             "status": "PARTIALLY_PROCESSED",
             "last_doc_completed": u"%s/%s" % (archive_name, filename),
             "docs_completed": docs_completed,
+            "output_docs_written": dict(
+                (name, writer.doc_count) for (name, writer) in self.info.get_named_writers()
+                if hasattr(writer, "doc_count")
+            ),
         })
+        self._unsaved_status = None
+        self._last_checkpoint_docs = docs_completed
+        self._last_checkpoint_time = time()
+
+    def checkpoint_processing_status_on_error(self, writers=()):
+        """
+        Called when processing has failed, to store how far we got, so that processing can be
+        resumed. A problem doing this is logged, but not raised, so it doesn't hide the original error.
+
+        """
+        try:
+            self.checkpoint_processing_status(writers)
+        except Exception as e:
+            self.log.warn("Could not store processing progress after error: {}".format(e))
+
+    def supports_worker_reads(self):
+        """
+        Whether this executor's workers are able to read input documents themselves, given
+        :class:`InputSlice` s instead of documents. Subclasses that support this should override it.
+
+        """
+        return False
+
+    def use_worker_reads(self):
+        """
+        Check whether the workers should read the input documents themselves, instead of the main
+        process reading them and sending them to the workers. This is enabled by the
+        `map_worker_reads` local config setting and requires the executor's workers
+        and all the input corpora to support it.
+
+        """
+        return str_to_bool(self.info.pipeline.local_config.get("map_worker_reads", "false")) and \
+            self.supports_worker_reads() and self.input_iterator.supports_archive_slices()
+
+    def create_inline_worker(self, processes):
+        """
+        Provide a worker that can be used to process documents directly in the main thread, when
+        the given number of processes is requested. It must have the worker interface of
+        :class:`DocumentMapProcessMixin`, but is never started or given any queues. If None is
+        returned (the default), a pool is created in the normal way.
+
+        Executors that would run a single worker thread should provide one, so that documents
+        can be processed without the overhead of queues and threads.
+
+        """
+        return None
+
+    def supports_worker_writes(self):
+        """
+        Whether this executor's workers are able to write their output documents to shards,
+        using the executor's :attr:`output_shards`. Subclasses that support this should override it.
+
+        """
+        return False
+
+    def use_worker_writes(self, writers):
+        """
+        Check whether the workers should write the output documents to shards themselves, instead
+        of sending them to the main process to be written. This is enabled by the `map_worker_writes`
+        local config setting and requires the executor's workers and all of the output writers
+        to support it.
+
+        """
+        return str_to_bool(self.info.pipeline.local_config.get("map_worker_writes", "false")) and \
+            self.supports_worker_writes() and all(hasattr(writer, "encode_document") for writer in writers)
+
+    def use_raw_passthrough(self, writers):
+        """
+        Check whether the input documents can be passed through to the output as they're stored,
+        without being decoded, or even decompressed if the output uses the same compression. This
+        requires the executor to declare that it outputs its input documents unchanged
+        (:attr:`RAW_PASSTHROUGH`), a single input corpus that is stored, not produced on the
+        fly (e.g. by a filter module), and a single output.
+
+        """
+        return self.RAW_PASSTHROUGH and self.fused_stages is None and \
+            len(self.input_corpora) == 1 and supports_raw_records(self.input_corpora[0]) and \
+            len(writers) == 1 and hasattr(writers[0], "add_raw_record")
+
+    def pass_through_raw_records(self, input_iter, pbar=None):
+        """
+        Used in place of :meth:`DocumentMapper.map_documents` when :meth:`use_raw_passthrough` is True,
+        yielding each input document's stored record as its output.
+
+        """
+        complete = False
+        self.preprocess()
+        try:
+            for docs_done, (archive, doc_name, records) in enumerate(input_iter, start=1):
+                check_execution_stopped(self.info.pipeline)
+                yield (archive, doc_name), tuple(records)
+                if pbar is not None:
+                    pbar.update(docs_done)
+            complete = True
+        finally:
+            self.postprocess(error=not complete)
 
     def execute(self):
         # Call the set-up routine, if one's been defined
@@ -203,71 +391,235 @@ class DocumentMapModuleExecutor(BaseModuleExecutor):
         complete = False
         docs_completed_now = 0
 
-        docs_completed_before, start_after = self.retrieve_processing_status()
+        # If updating complete output, the existing output is moved out of the way before creating the writers
+        update = IncrementalUpdate.prepare(self) if self.incremental else None
+        if update is None:
+            # This is normally done before the modules to run are chosen (see restore_interrupted_update()), but
+            #  make sure nothing's left of a killed update before writing the outputs
+            if IncrementalUpdate.restore_previous_outputs(self.info):
+                self.log.info("Cleaned up the outputs of an incremental update that was killed before finishing")
+            docs_completed_before, start_after = self.retrieve_processing_status()
+        else:
+            self.log.info("Updating complete output: only new or changed input documents will be processed")
+            docs_completed_before, start_after = 0, None
+        # If an input is still being written, we don't know how many documents there will be
+        following = self.input_iterator.is_following()
         total_to_process = len(self.input_iterator) - docs_completed_before
+        # The workers can't read the inputs themselves if we need to check which documents have changed
+        input_slices = update is None and self.use_worker_reads()
+        hash_recorder = None
 
         # Note whether we're processing the first output, or have already output something
         first_output = True
 
         try:
             # Prepare a corpus writer for the output
-            with multiwith(*self.info.get_writers(append=start_after is not None)) as writers:
-                if total_to_process < 1:
+            if start_after is not None:
+                # Remove anything written after the stored progress, if we didn't get to store it before stopping
+                truncate_to = self.info.get_metadata().get("output_docs_written", None)
+            else:
+                truncate_to = None
+            with multiwith(*self.info.get_writers(append=start_after is not None, truncate_to=truncate_to)) \
+                    as writers:
+                raw_passthrough = self.use_raw_passthrough(writers)
+                if raw_passthrough:
+                    # Copying the stored records is quicker than having the workers read the documents
+                    input_slices = False
+
+                hashes_path = get_input_hashes_path(self.info)
+                if update is not None:
+                    hash_recorder = update.hash_recorder
+                elif input_slices or not (self.info.incremental or
+                                          (start_after is not None and os.path.exists(hashes_path))):
+                    # Hashes are only recorded if asked for (--incremental), or to continue recording them
+                    #  when resuming execution
+                    # If the workers read the input, the documents never get to this process, so we can't
+                    #  record their hashes
+                    discard_input_hashes(self.info)
+                else:
+                    hash_recorder = InputHashRecorder(hashes_path, append=start_after is not None)
+                # Flushed along with the writers whenever progress is stored
+                status_writers = tuple(writers) if hash_recorder is None else tuple(writers) + (hash_recorder,)
+
+                if total_to_process < 1 and not following:
                     # No input documents, don't go any further
                     # We've come in this far so that the writer gets created and finishing up is done:
                     #  might need to finish writing metadata or suchlike if we failed last time once all docs were done
                     self.log.info("No documents to process")
                 else:
-                    pbar = get_progress_bar(total_to_process, counter=True,
-                                            title="%s map" % self.info.module_type_name.replace("_", " ").capitalize())
-                    self.log.info("Starting execution on {:,} docs".format(total_to_process))
-                    # Inputs will be taken from this as they're needed
-                    input_iter = iter(self.input_iterator.archive_iter(start_after=start_after))
+                    pbar_title = "%s map" % self.info.module_type_name.replace("_", " ").capitalize()
+                    if following:
+                        pbar = get_open_progress_bar(title=pbar_title)
+                        self.log.info("Starting execution, reading the input documents as they are written")
+                    else:
+                        pbar = get_progress_bar(total_to_process, counter=True, title=pbar_title)
+                        self.log.info("Starting execution on {:,} docs".format(total_to_process))
+                    if raw_passthrough:
+                        self.log.info("Copying the stored input documents straight to the output")
+                    elif self.use_worker_writes(writers):
+                        # The workers will write the output documents to shards: we just copy them across
+                        self.log.info("Workers will write the output documents")
+                        self.output_shards = OutputShards(writers, self.get_output_data_point_types(),
+                                                          allow_skip_output=self.ALLOW_SKIP_OUTPUT)
+                    if input_slices:
+                        # Just send the workers the positions of the documents in the archives
+                        # The feeder joins the slices up into batches
+                        self.log.info("Workers will read the input documents")
+                        input_iter = iter(self.input_iterator.archive_slice_iter(1, start_after=start_after))
+                    else:
+                        if raw_passthrough:
+                            input_iter = (
+                                (archive, doc_name, [record]) for (archive, doc_name, record)
+                                in self.input_corpora[0].raw_archive_iter(start_after=start_after)
+                            )
+                        else:
+                            # Inputs will be taken from this as they're needed
+                            input_iter = iter(self.input_iterator.archive_iter(start_after=start_after))
+                        if update is not None:
+                            # Only pass on the documents that have changed
+                            input_iter = update.wrap_input(input_iter)
+                        elif hash_recorder is not None:
+                            input_iter = hash_recorder.wrap_input(input_iter)
 
                     # Set map processing going, using the generic function
-                    benchmarker.start()
-                    mapper = DocumentMapper(self, input_iter, processes=self.processes, pbar=pbar, benchmarker=benchmarker)
-                    for (archive, doc_name), next_output in mapper.map_documents():
-                        docs_completed_now += 1
-
-                        with benchmarker.write_output_timer:
-                            # Write the result to the output corpora
-                            for result, writer in zip(next_output, writers):
-                                # If allowing skipping outputs, we don't try to write the output if None is returned
-                                if result is not None or not self.ALLOW_SKIP_OUTPUT:
-                                    try:
-                                        writer.add_document(archive, doc_name, result)
-                                    except DuplicateFilename:
-                                        # If the first doc we try writing is already in the archive, don't worry,
-                                        #  just skip it. This can happen if we dropped out of processing after writing,
-                                        #  but before storing the name of the last processed file.
-                                        # However, if it happens after the first one, it's more worrying: maybe a
-                                        #  problem with the input data
-                                        if not first_output:
-                                            raise
-
-                            # Update the module's metadata to say that we've completed this document
-                            self.update_processing_status(docs_completed_before+docs_completed_now, archive, doc_name)
-                            if first_output:
-                                first_output = False
+                    if raw_passthrough:
+                        outputs = self.pass_through_raw_records(input_iter, pbar=pbar if update is None else None)
+                    else:
+                        benchmarker.start()
+                        mapper = DocumentMapper(self, input_iter, processes=self.processes,
+                                                pbar=pbar if update is None else None,
+                                                benchmarker=benchmarker, input_slices=input_slices)
+                        outputs = mapper.map_documents()
+                    try:
+                        for (archive, doc_name), next_output in outputs:
+                            docs_completed_now += 1
+
+                            with benchmarker.write_output_timer:
+                                if update is not None:
+                                    # First copy the output for any unchanged docs that come before this one
+                                    update.copy_unchanged(writers, until=(archive, doc_name))
+                                # Write the result to the output corpora
+                                for result, writer in zip(next_output, writers):
+                                    # If allowing skipping outputs, we don't try to write the output if None is returned
+                                    if result is not None or not self.ALLOW_SKIP_OUTPUT:
+                                        try:
+                                            if type(result) is ShardRecord:
+                                                self.output_shards.copy_record(writer, archive, doc_name, result)
+                                            elif type(result) is RawDocumentRecord:
+                                                writer.add_raw_record(archive, doc_name, result)
+                                            else:
+                                                writer.add_document(archive, doc_name, result)
+                                        except DuplicateFilename:
+                                            # If the first doc we try writing is already in the archive, don't worry,
+                                            #  just skip it. This can happen if we dropped out of processing after writing,
+                                            #  but before storing the name of the last processed file, if the number
+                                            #  of docs in each output wasn't stored with it (by older versions), so
+                                            #  the outputs couldn't be truncated.
+                                            # However, if it happens after the first one, it's more worrying: maybe a
+                                            #  problem with the input data
+                                            if not first_output:
+                                                raise
+                                if hash_recorder is not None:
+                                    hash_recorder.written(archive, doc_name)
+
+                                if update is None:
+                                    # Update the module's metadata to say that we've completed this document
+                                    self.update_processing_status(docs_completed_before+docs_completed_now, archive,
+                                                                  doc_name, writers=status_writers)
+                                else:
+                                    # Progress isn't stored while updating: the previous output is used if we fail
+                                    pbar.update(update.docs_copied + update.docs_processed)
+                                if first_output:
+                                    first_output = False
+                        if update is not None:
+                            # Copy the output for unchanged docs after the last processed one
+                            update.copy_unchanged(writers)
+                            pbar.update(update.docs_copied + update.docs_processed)
+                    except BaseException:
+                        # Store how far we got before failing, so we can pick up from there next time
+                        self.checkpoint_processing_status_on_error(status_writers)
+                        raise
+                    finally:
+                        if self.output_shards is not None:
+                            # The workers have finished, so the shards are no longer needed
+                            self.output_shards.close()
+                            self.output_shards = None
+                    # Make sure the status of the last documents is stored
+                    self.checkpoint_processing_status(status_writers)
 
                     pbar.finish()
+                    if update is not None:
+                        self.log.info("Processed {:,} new or changed docs, copied output for {:,} unchanged docs".format(
+                            update.docs_processed, update.docs_copied))
             complete = True
+        except KeyboardInterrupt as e:
+            if update is not None:
+                # The previous output is put back below, so the module's still complete
+                self.log.info("Keeping the previous output, since updating it was interrupted")
+                e.end_status = "COMPLETE"
+            raise
         except ModuleExecutionError as e:
-            if self.info.status == "PARTIALLY_PROCESSED":
+            if update is not None:
+                # The previous output is put back below, so the module's still complete
+                self.log.info("Keeping the previous output, since updating it failed")
+                e.end_status = "COMPLETE"
+            elif self.info.status == "PARTIALLY_PROCESSED":
                 self.log.info("Processed documents recorded: restart processing where you left off by calling run "
                               "again once you've fixed the problem (%d docs processed in this run, %d processed in "
                               "total)" % (docs_completed_now, docs_completed_before+docs_completed_now))
                 # Set the end status so that the top-level routine doesn't replace it with a generic failure status
                 e.end_status = self.info.status
             raise
+        except Exception as e:
+            if update is None:
+                raise
+            self.log.info("Keeping the previous output, since updating it failed")
+            raise_from(ModuleExecutionError("error updating output: %s" % e, cause=e, end_status="COMPLETE",
+                                            debugging_info=format_exc()), e)
         finally:
+            if update is not None:
+                # Replace the previous output with the new output, or put it back if something went wrong
+                update.finish(success=complete)
+            elif hash_recorder is not None:
+                hash_recorder.close()
             # Call the finishing-off routine, if one's been defined
             if complete:
                 self.log.info("Document mapping complete. Finishing off")
             else:
                 self.log.info("Document mapping failed. Finishing off")
 
+    def get_output_data_point_types(self):
+        """
+        Data point types of the outputs that documents are written to, in the order of the writers.
+
+        """
+        return [
+            self.info.get_output_datatype(name)[1].data_point_type
+            for name in self.info.get_grouped_corpus_output_names()
+        ]
+
+    def normalize_outputs(self, output, output_datatypes):
+        """
+        Turn the result of processing a document into a tuple containing a document for each output,
+        precisely as in the single-core case.
+
+        """
+        if is_invalid_doc(output):
+            # Just got a single invalid document out: write it out to every output
+            output = [output] * len(output_datatypes)
+        elif type(output) is not tuple:
+            # If the processor produces a single result and there's only one output, fine
+            output = [output]
+        if len(output) != len(output_datatypes):
+            raise ModuleExecutionError(
+                "%s executor's process_document() returned %d results for a document, but the "
+                "module has %d outputs" % (type(self).__name__, len(output), len(output_datatypes))
+            )
+
+        # Post-process the returned data to convert to the correct document type,
+        # if raw data or an internal data dict was given
+        return tuple([output_to_document(doc, dt) for (doc, dt) in zip(output, output_datatypes)])
+
 
 def output_to_document(output, datatype):
     """
@@ -292,16 +644,44 @@ def output_to_document(output, datatype):
 
 
 class DocumentMapper(object):
-    def __init__(self, executor, input_iter, processes=1, record_invalid=False, pbar=None, benchmarker=None):
+    """
+    Runs the main mapping process: see :meth:`map_documents`.
+
+    The amount of input data waiting to be processed and of results waiting to be output in the
+    right order is limited by a :class:`ProcessingWindow`, whose limits are taken from the
+    `map_input_buffer` and `map_reorder_buffer` local config settings.
+
+    The number of documents sent to the workers together is adjusted by a :class:`BatchSizer`,
+    aiming for each batch to take as long to process as the `map_batch_time` local config setting.
+
+    If the executor can provide a worker to run in the current thread (see
+    :meth:`DocumentMapModuleExecutor.create_inline_worker`), which is usually the case when only
+    one process is used, the documents are processed directly as they're read, without any
+    queues or background threads.
+
+    """
+    #: Number of documents passed to an inline worker's `process_documents()` at once, unless the
+    #: worker asks for bigger batches
+    inline_batch_size = 10
+
+    def __init__(self, executor, input_iter, processes=1, record_invalid=False, pbar=None, benchmarker=None,
+                 input_slices=False):
         # If pbar is given, it will be updated every time a document is received
         #  from worker processes
         self.pbar = pbar
+        # If input_slices=True, input_iter yields slices of the input corpora, which workers read themselves
+        self.input_slices = input_slices
         self.record_invalid = record_invalid
         self.processes = processes
         self.input_iter = input_iter
         self.executor = executor
         self.input_feeder = None
         self.benchmarker = benchmarker
+        # Invalid input docs seen when processing inline
+        self._invalid_inputs = set()
+        self.window = ProcessingWindow(*_get_map_buffer_sizes(executor.info.pipeline))
+        batch_time = _get_map_batch_time(executor.info.pipeline)
+        self.batch_sizer = BatchSizer(processes, batch_time) if batch_time > 0 else None
 
     def map_documents(self):
         """
@@ -320,6 +700,13 @@ class DocumentMapper(object):
         # Call the set-up routine, if one's been defined
         executor.preprocess()
 
+        inline_worker = None if self.input_slices else executor.create_inline_worker(self.processes)
+        if inline_worker is not None:
+            # No need for a pool: process the docs right here
+            for result in self._map_documents_inline(inline_worker):
+                yield result
+            return
+
         # Start up a pool
         try:
             executor.pool = executor.create_pool(self.processes)
@@ -330,18 +717,15 @@ class DocumentMapper(object):
         result_buffer = {}
 
         # Get the expected output datatypes, ready for any possible output type conversion when we get results
-        output_datatypes = [
-            executor.info.get_output_datatype(name)[1].data_point_type
-            for name in executor.info.get_grouped_corpus_output_names()
-        ]
-        num_outputs = len(output_datatypes)
+        output_datatypes = executor.get_output_data_point_types()
 
         try:
             # Inputs will be taken from the input_iter as they're needed
             # Set a thread going to feed things onto the input queue
             self.input_feeder = InputQueueFeeder(executor.pool.input_queue, self.input_iter,
                                                  complete_callback=executor.pool.notify_no_more_inputs,
-                                                 record_invalid=self.record_invalid)
+                                                 record_invalid=self.record_invalid, slices=self.input_slices,
+                                                 window=self.window, batch_sizer=self.batch_sizer)
 
             # Wait to make sure the input feeder's fed something into the input queue
             self.input_feeder.started.wait()
@@ -355,8 +739,11 @@ class DocumentMapper(object):
                     while True:
                         try:
                             # Wait a little bit to see if there's a result available
-                            result = qget(executor.pool.output_queue, timeout=0.2)
+                            # Workers send the results for a batch of documents together
+                            results = qget(executor.pool.output_queue, timeout=0.2)
                         except Empty:
+                            # Stop if execution has been interrupted
+                            check_execution_stopped(executor.info.pipeline)
                             # Timed out: check there's not been an error in one of the processes
                             try:
                                 error = executor.pool.exception_queue.get_nowait()
@@ -382,10 +769,14 @@ class DocumentMapper(object):
                             # Got a result from a process
                             break
 
-                # We've got some result, but it might not be the one we're looking for
-                # Add it to a buffer, so we can potentially keep it and only output it when its turn comes up
-                result_buffer[(result.archive, result.filename)] = result.data
-                num_docs_received += 1
+                # We've got some results, but they might not include the one we're looking for
+                # Add them to a buffer, so we can potentially keep them and only output them when their turn comes up
+                for result in results:
+                    result_buffer[(result.archive, result.filename)] = result.data
+                    self.window.received((result.archive, result.filename), estimate_data_size(result.data))
+                num_docs_received += len(results)
+                if self.batch_sizer is not None:
+                    self.batch_sizer.results_received(len(results))
                 if self.pbar is not None:
                     self.pbar.update(num_docs_received)
 
@@ -394,25 +785,15 @@ class DocumentMapper(object):
                 while next_document in result_buffer:
                     archive, filename = next_document
                     next_output = result_buffer.pop((archive, filename))
+                    # Make room for more input to be sent
+                    self.window.released(next_document)
 
-                    # Next document processed: output the result precisely as in the single-core case
-                    if is_invalid_doc(next_output):
-                        # Just got a single invalid document out: write it out to every output
-                        next_output = [next_output] * num_outputs
-                    elif type(next_output) is not tuple:
-                        # If the processor produces a single result and there's only one output, fine
-                        next_output = [next_output]
-                    if len(next_output) != num_outputs:
-                        raise ModuleExecutionError(
-                            "%s executor's process_document() returned %d results for a document, but the "
-                            "module has %d outputs" % (type(executor).__name__, len(next_output), num_outputs)
-                        )
-
-                    # Post-process the returned data to convert to the correct document type,
-                    # if raw data or an internal data dict was given
-                    next_output = tuple(
-                        [output_to_document(output, dt) for (output, dt) in zip(next_output, output_datatypes)]
-                    )
+                    if type(next_output) is ShardedOutput:
+                        # The worker has already written the output documents: just pass on where they are
+                        next_output = next_output.records
+                    else:
+                        # Next document processed: output the result precisely as in the single-core case
+                        next_output = executor.normalize_outputs(next_output, output_datatypes)
                     # Provide the result(s) for writing, or passing on to some other process
                     # Note that this will block until the result is taken by whatever is using the generator
                     #   In the meantime, the background processes may be processing and queueing results
@@ -435,6 +816,94 @@ class DocumentMapper(object):
             executor.wait_until_finished()
 
 
+    def _map_documents_inline(self, worker):
+        """
+        Run the mapping process in the current thread, using a worker provided by the executor.
+        Yields exactly what :meth:`map_documents` yields.
+
+        """
+        executor = self.executor
+        executor.pool = None
+        output_datatypes = executor.get_output_data_point_types()
+        batch_size = max(worker.docs_per_batch, self.inline_batch_size)
+        complete = False
+        stage_workers = None
+        try:
+            try:
+                worker.set_up()
+                if executor.fused_stages is not None:
+                    stage_workers = executor.fused_stages.start_workers()
+            except Exception as e:
+                raise_from(ModuleExecutionError("error starting up worker: %s" % e, cause=e), e)
+            try:
+                batch = []
+                num_docs_processed = 0
+                for archive, filename, docs in self.input_iter:
+                    if self.record_invalid and any(is_invalid_doc(doc) for doc in docs):
+                        self._invalid_inputs.add((archive, filename))
+                    batch.append(tuple([archive, filename] + docs))
+                    if len(batch) < batch_size:
+                        continue
+                    for result in self._process_inline(worker, batch, output_datatypes, stage_workers):
+                        yield result
+                    num_docs_processed += len(batch)
+                    if self.pbar is not None:
+                        self.pbar.update(num_docs_processed)
+                    batch = []
+                if len(batch):
+                    for result in self._process_inline(worker, batch, output_datatypes, stage_workers):
+                        yield result
+                    num_docs_processed += len(batch)
+                    if self.pbar is not None:
+                        self.pbar.update(num_docs_processed)
+            finally:
+                if stage_workers is not None:
+                    executor.fused_stages.stop_workers(stage_workers)
+                worker.tear_down()
+            complete = True
+        finally:
+            executor.postprocess(error=not complete)
+            if self.benchmarker is not None:
+                self.benchmarker.finish()
+
+    def _process_inline(self, worker, batch, output_datatypes, stage_workers=None):
+        # Stop if execution has been interrupted
+        check_execution_stopped(self.executor.info.pipeline)
+        with benchmarker.result_fetch_timer:
+            try:
+                if stage_workers is None:
+                    results = worker.process_documents(batch)
+                else:
+                    results = worker.process_documents(
+                        self.executor.fused_stages.process_documents(stage_workers, batch)
+                    )
+            except (ModuleExecutionError, StopProcessing):
+                raise
+            except Exception as e:
+                # Report the error in the same way as an error in a worker process
+                raise_from(ModuleExecutionError("error in worker process: %s" % e, cause=e,
+                                                debugging_info=format_exc()), e)
+        for input_tuple, result in zip(batch, results):
+            next_output = self.executor.normalize_outputs(result, output_datatypes)
+            with benchmarker.yield_result_timer:
+                yield (input_tuple[0], input_tuple[1]), next_output
+
+    def check_invalid(self, archive, filename):
+        """
+        Check whether a given document was invalid in the input. Only available if `record_invalid=True`.
+        As with :meth:`InputQueueFeeder.check_invalid`, call this only once per document.
+
+        """
+        if self.input_feeder is not None:
+            return self.input_feeder.check_invalid(archive, filename)
+        elif not self.record_invalid:
+            raise ValueError("called check_invalid() on a document mapper created with record_invalid=False")
+        elif (archive, filename) in self._invalid_inputs:
+            self._invalid_inputs.remove((archive, filename))
+            return True
+        return False
+
+
 def skip_invalid(fn):
     """
     Decorator to apply to document map executor process_document() methods where you want to skip doing any
@@ -516,6 +985,7 @@ def invalid_docs_on_error(fn):
 class ProcessOutput(object):
     """
     Wrapper for all result data coming out from a worker.
+    Workers put lists of these on the output queue, one for each document in a batch.
     """
     def __init__(self, archive, filename, data):
         self.data = data
@@ -523,6 +993,22 @@ class ProcessOutput(object):
         self.archive = archive
 
 
+class InputSlice(object):
+    """
+    Sent to workers in place of a batch of documents when they read their input documents
+    themselves. Identifies a run of `count` consecutive documents in an archive, giving
+    the start and end byte of the run in the archive of each input corpus.
+
+    The worker can read the documents using
+    :meth:`~pimlico.datatypes.corpora.grouped.AlignedGroupedCorpora.read_archive_slice`.
+
+    """
+    def __init__(self, archive, positions, count):
+        self.archive = archive
+        self.positions = positions
+        self.count = count
+
+
 class InputQueueFeeder(Thread):
     """
     Background thread to read input documents from an iterator and feed them onto an input queue for worker
@@ -532,8 +1018,22 @@ class InputQueueFeeder(Thread):
     If using this, check_invalid() should be called regularly during mapping. If it is not,
     the queue will just fill up.
 
+    If slices=True, the iterator should yield slices of the input corpora, as produced by
+    :meth:`~pimlico.datatypes.corpora.grouped.AlignedGroupedCorpora.archive_slice_iter`, instead
+    of documents. The feeder then just sends an :class:`InputSlice` to the workers, which read
+    the documents themselves. Consecutive slices are joined into batches, so the iterator
+    should produce small slices. record_invalid may not be used in this case, since the documents
+    are never seen by the feeder.
+
+    If a :class:`ProcessingWindow` is given, the feeder records in it the size of the documents it sends
+    and waits before sending more while it's full.
+
+    Documents (or slices) are sent to the workers in batches. If a :class:`BatchSizer` is given, it
+    decides how big the batches are. Otherwise, every batch has `feeder_batch_size` documents.
+
     """
-    def __init__(self, input_queue, iterator, complete_callback=None, record_invalid=False):
+    def __init__(self, input_queue, iterator, complete_callback=None, record_invalid=False, slices=False,
+                 window=None, batch_sizer=None):
         super(InputQueueFeeder, self).__init__()
         self.complete_callback = complete_callback
         self.daemon = True
@@ -547,7 +1047,12 @@ class InputQueueFeeder(Thread):
         self.exception_queue = Queue(1)
 
         self.feeder_batch_size = 10
+        self.batch_sizer = batch_sizer
 
+        self.window = window
+        self.slices = slices
+        if slices and record_invalid:
+            raise ValueError("invalid documents can't be recorded when feeding input slices")
         self.record_invalid = record_invalid
         if record_invalid:
             # Accumulate a list of invalid docs that have been fed, just for information
@@ -591,6 +1096,9 @@ class InputQueueFeeder(Thread):
                     sleep(0.05)
                     while not self.exception_queue.empty():
                         self.exception_queue.get(timeout=0.1)
+                    if isinstance(error, KeyboardInterrupt):
+                        # Execution was interrupted while reading the input: not an error
+                        raise error
                     # Sometimes, a traceback from within the process is included
                     if hasattr(error, "traceback"):
                         debugging = "Traceback from input feeder process:\n%s" % error.traceback
@@ -623,10 +1131,131 @@ class InputQueueFeeder(Thread):
             return True
         return False
 
+    def _put(self, item):
+        """
+        Put an item on the input queue. If the queue is full, this will block until there's room to
+        put the next one on. It also blocks if the queue is closed/destroyed/something similar, so we
+        need to check now and again that we've not been asked to give up.
+
+        :return: False if the feeder was cancelled before the item could be put on the queue
+        """
+        while True:
+            try:
+                self.input_queue.put(item, timeout=0.1)
+            except Full:
+                if self.cancelled.is_set():
+                    return False
+                # Otherwise try putting again
+            else:
+                return True
+
+    def _wait_for_window(self):
+        """
+        Wait until there's room in the window to send more documents.
+
+        :return: False if the feeder was cancelled while waiting
+        """
+        if self.window is not None:
+            while not self.window.wait_for_room(timeout=0.1):
+                if self.cancelled.is_set():
+                    return False
+        return True
+
+    def _batch_full(self, num_docs, num_bytes, started):
+        """
+        Whether a batch of documents that's being collected should be sent now.
+
+        """
+        if self.batch_sizer is None:
+            return num_docs >= self.feeder_batch_size
+        else:
+            return self.batch_sizer.batch_full(num_docs, num_bytes, started)
+
+    def _feed_slices(self):
+        # The iterator yields small slices: consecutive slices from the same archive are joined to make a batch
+        archive = None
+        doc_names = []
+        positions = None
+        sizes = []
+        started = None
+        for slice_archive, slice_doc_names, slice_positions in self.iterator:
+            if self.cancelled.is_set():
+                return False
+            if len(doc_names) and slice_archive != archive:
+                # Slices can't cross archives: send what we've got
+                if not self._send_slice(archive, doc_names, positions, sizes):
+                    return False
+                doc_names = []
+            if len(doc_names) == 0:
+                archive, positions, sizes, started = slice_archive, slice_positions, [], time()
+            else:
+                # Extend the batch's slice of each corpus to the end of this slice
+                positions = [(start, end) for ((start, __), (___, end)) in zip(positions, slice_positions)]
+            doc_names.extend(slice_doc_names)
+            # We don't know the sizes of the individual docs, so share out the size of the slice
+            doc_size = sum(end - start for (start, end) in slice_positions) // len(slice_doc_names)
+            sizes.extend([doc_size] * len(slice_doc_names))
+
+            if self._batch_full(len(doc_names), sum(sizes), started):
+                if not self._send_slice(archive, doc_names, positions, sizes):
+                    return False
+                doc_names = []
+        # Send the final batch
+        if len(doc_names) and not self._send_slice(archive, doc_names, positions, sizes):
+            return False
+        return True
+
+    def _send_slice(self, archive, doc_names, positions, sizes):
+        """
+        Send an :class:`InputSlice` covering the given documents, once there's room in the window.
+
+        :return: False if the feeder was cancelled before the slice could be sent
+        """
+        if not self._wait_for_window():
+            return False
+        if self.window is not None:
+            self.window.sent([((archive, doc_name), size) for (doc_name, size) in zip(doc_names, sizes)])
+        if not self._put(InputSlice(archive, positions, len(doc_names))):
+            return False
+        # Record the documents that are in the slice, so we can write the results out in the right order
+        for doc_name in doc_names:
+            self._docs_processing.put((archive, doc_name))
+        self.started.set()
+        return True
+
+    def _send_batch(self, batch, sizes):
+        """
+        Put a batch of documents on the input queue, once there's room in the window.
+
+        :return: False if the feeder was cancelled before the batch could be sent
+        """
+        if not self._wait_for_window():
+            return False
+        if self.window is not None:
+            self.window.sent([((archive, filename), size) for ((archive, filename, __), size) in zip(batch, sizes)])
+        if not self._put(batch):
+            return False
+        # Record that we've sent this one off, so we can write the results out in the right order
+        for archive, filename, __ in batch:
+            self._docs_processing.put((archive, filename))
+        # As soon as something's been fed, the output processor can get going
+        self.started.set()
+        return True
+
     def run(self):
         try:
+            if self.slices:
+                if self._feed_slices():
+                    self.feeding_complete.set()
+                    if self.complete_callback is not None:
+                        self.complete_callback()
+                return
+
             # Accumulate docs in a batch to send in one package to the processor
             batch = []
+            # Estimated size of each doc in the batch
+            sizes = []
+            started = None
             # Keep feeding inputs onto the queue as long as we've got more
             for i, (archive, filename, docs) in enumerate(self.iterator):
                 if self.cancelled.is_set():
@@ -636,49 +1265,30 @@ class InputQueueFeeder(Thread):
                     if any(is_invalid_doc(doc) for doc in docs):
                         self.invalid_docs.put((archive, filename))
 
+                if len(batch) == 0:
+                    started = time()
                 batch.append((archive, filename, docs))
-                if len(batch) < self.feeder_batch_size:
+                sizes.append(estimate_data_size(docs))
+                if not self._batch_full(len(batch), sum(sizes), started):
                     # Don't send this batch yet: get some more documents
                     continue
-                # If the queue is full, this will block until there's room to put the next one on
-                # It also blocks if the queue is closed/destroyed/something similar, so we need to check now and
-                #  again that we've not been asked to give up
-                while True:
-                    try:
-                        self.input_queue.put(batch, timeout=0.1)
-                    except Full:
-                        if self.cancelled.is_set():
-                            return
-                        # Otherwise try putting again
-                    else:
-                        break
-                # Record that we've sent this one off, so we can write the results out in the right order
-                for archive, filename, __ in batch:
-                    self._docs_processing.put((archive, filename))
-                # As soon as something's been fed, the output processor can get going
-                self.started.set()
+                if not self._send_batch(batch, sizes):
+                    return
                 # Start a new batch
                 batch = []
+                sizes = []
 
             # We may still need to send off the final batch
             if len(batch) > 0:
-                while True:
-                    try:
-                        self.input_queue.put(batch, timeout=0.1)
-                    except Full:
-                        if self.cancelled.is_set():
-                            return
-                    else:
-                        break
-                for archive, filename, __ in batch:
-                    self._docs_processing.put((archive, filename))
-                self.started.set()
+                if not self._send_batch(batch, sizes):
+                    return
 
             self.feeding_complete.set()
             if self.complete_callback is not None:
                 self.complete_callback()
-        except Exception as e:
+        except BaseException as e:
             # Error in iterating over the input data -- actually quite common, since it could involve filter modules
+            # Also catches the input being interrupted (ExecutionInterrupted)
             # Make it available to the main thread
             e.traceback = format_exc()
             self.exception_queue.put(e, block=True)
@@ -735,8 +1345,8 @@ class InputQueueFeeder(Thread):
                         q.get_nowait()
                     except Empty:
                         break
-                    except OSError:
-                        # Sometime get "handle is closed" on python 3
+                    except (OSError, ValueError):
+                        # Sometime get "handle is closed" on python 3, or "queue is closed" on 3.8+,
                         # but probably fine to ignore this, since there's nothing more left presumably
                         break
                 if hasattr(q, "task_done"):
@@ -756,6 +1366,183 @@ class InputQueueFeeder(Thread):
         return True
 
 
+class ProcessingWindow(object):
+    """
+    Keeps track of how much data is in the hands of the document map workers (sent, but not yet
+    processed) and how much is waiting in the reorder buffer (processed, but waiting for earlier documents
+    to be finished, so that the results can be output in order). Sizes are estimated in bytes
+    using :func:`estimate_data_size`.
+
+    The input feeder waits before sending any more documents while either amount is over its
+    limit. Since the next document to be output has always already been sent, processing can
+    always continue, so the window can't get stuck. It also means that a single document bigger
+    than the limit can still be processed.
+
+    :param max_input_bytes: limit on the amount of input data sent to the workers but not yet
+        processed. 0 means no limit
+    :param max_reorder_bytes: limit on the amount of result data waiting to be output. 0 means no limit
+    """
+    def __init__(self, max_input_bytes=0, max_reorder_bytes=0):
+        self.max_input_bytes = max_input_bytes
+        self.max_reorder_bytes = max_reorder_bytes
+        self.input_bytes = 0
+        self.reorder_bytes = 0
+        self._input_sizes = {}
+        self._reorder_sizes = {}
+        self._condition = threading.Condition()
+
+    def full(self):
+        return (self.max_input_bytes > 0 and self.input_bytes >= self.max_input_bytes) or \
+            (self.max_reorder_bytes > 0 and self.reorder_bytes >= self.max_reorder_bytes)
+
+    def wait_for_room(self, timeout=None):
+        """
+        Block until there's room for more documents to be sent.
+
+        :return: False if the timeout ran out first
+        """
+        with self._condition:
+            if self.full():
+                self._condition.wait(timeout)
+            return not self.full()
+
+    def sent(self, docs):
+        """
+        Record that some documents have been sent to be processed.
+
+        :param docs: list of `((archive, filename), size)`
+        """
+        with self._condition:
+            for key, size in docs:
+                self._input_sizes[key] = size
+                self.input_bytes += size
+
+    def received(self, key, size):
+        """
+        Record that the result of processing a document has been received and put in the reorder buffer.
+
+        """
+        with self._condition:
+            self.input_bytes -= self._input_sizes.pop(key, 0)
+            self._reorder_sizes[key] = size
+            self.reorder_bytes += size
+            self._condition.notify_all()
+
+    def released(self, key):
+        """
+        Record that the result of processing a document has been taken out of the reorder buffer.
+
+        """
+        with self._condition:
+            self.reorder_bytes -= self._reorder_sizes.pop(key, 0)
+            self._condition.notify_all()
+
+
+def estimate_data_size(value):
+    """
+    Rough estimate of how many bytes of memory a document takes up, or a result from processing
+    a document, or a list or tuple of them. Documents are measured by the length of their raw data,
+    where it's available, so that no conversion is needed.
+
+    """
+    if type(value) is bytes or type(value) is memoryview:
+        return len(value)
+    elif isinstance(value, DataPointType.Document):
+        raw_data = getattr(value, "_raw_data", None)
+        if raw_data is not None:
+            return len(raw_data)
+        return sys.getsizeof(getattr(value, "_internal_data", None))
+    elif type(value) is list or type(value) is tuple:
+        return sum(estimate_data_size(v) for v in value)
+    else:
+        return sys.getsizeof(value)
+
+
+class BatchSizer(object):
+    """
+    Decides how many documents the input feeder puts together in each message to the workers.
+    Sending small documents one at a time wastes a lot of time in queue overhead, but sending big
+    batches of large or slow documents is bad for load balancing, since one worker can end up with
+    a lot of work while others are idle.
+
+    The size is adjusted as processing goes on, aiming for each batch to take about `target_time`
+    seconds to process. The time taken to process each document is estimated from the rate at which
+    the results come back from the workers. A batch is also sent once it contains `max_bytes`
+    of data, or once the feeder has spent `target_time` collecting it, so that the workers
+    aren't kept waiting when the input is slow to read.
+
+    """
+    #: Size used until there's an estimate of the processing time
+    initial_size = 10
+    max_size = 1000
+    #: How often to update the estimate of the time taken per document, in seconds
+    update_interval = 0.5
+
+    def __init__(self, processes, target_time=0.05, max_bytes=4*1024**2):
+        self.processes = processes
+        self.target_time = target_time
+        self.max_bytes = max_bytes
+        self.size = self.initial_size
+        self.doc_time = None
+
+        self._docs_since_update = 0
+        self._last_update = None
+
+    def batch_full(self, num_docs, num_bytes, started):
+        """
+        Whether a batch being collected should be sent.
+
+        :param started: time at which collection of the batch began
+        """
+        return num_docs >= self.size or num_bytes >= self.max_bytes or time() - started >= self.target_time
+
+    def results_received(self, num_docs):
+        """
+        Called by the mapper every time results for some documents come back from the workers.
+
+        """
+        now = time()
+        if self._last_update is None:
+            # Don't count the time before the first results, which includes starting up
+            self._last_update = now
+            return
+        self._docs_since_update += num_docs
+        elapsed = now - self._last_update
+        if elapsed >= self.update_interval:
+            # The workers together got through this many docs in the time, so each doc took about this long
+            doc_time = elapsed * self.processes / self._docs_since_update
+            if self.doc_time is None:
+                self.doc_time = doc_time
+            else:
+                # Smooth out the estimate, so that a few slow documents don't change it too much
+                self.doc_time = 0.7 * self.doc_time + 0.3 * doc_time
+            self.size = max(1, min(self.max_size, int(self.target_time / self.doc_time)))
+            self._docs_since_update = 0
+            self._last_update = now
+
+
+def _get_map_batch_time(pipeline):
+    """
+    Amount of processing time in seconds to aim for in each batch of documents sent to the workers,
+    from the `map_batch_time` local config setting. 0 means always use batches of a fixed size.
+
+    """
+    return float(pipeline.local_config.get("map_batch_time", "0.05"))
+
+
+def _get_map_buffer_sizes(pipeline):
+    """
+    Limits on the amount of data to hold in memory for documents being processed and for
+    results waiting to be output, taken from the `map_input_buffer` and `map_reorder_buffer`
+    local config settings.
+
+    """
+    return (
+        parse_file_size(pipeline.local_config.get("map_input_buffer", "100M")),
+        parse_file_size(pipeline.local_config.get("map_reorder_buffer", "100M")),
+    )
+
+
 class DocumentProcessorPool(object):
     """
     Base class for pools that provide an easy implementation of parallelization for document map modules.
@@ -11,6 +11,17 @@ output to a corpus, this mode performs the document-level processing
 on the fly and yields the results in order, providing a new
 iterable (grouped) corpus for the next module, without storing anything.
 
+By default, the processing is done in a single process, as the documents are
+read. If a filter's processing is slow, it can be shared between a pool of
+worker processes by setting `filter_processes` in the local config. The results
+are still produced in the same order. See :doc:`/core/local_config`.
+
+When filter modules are chained, so that a filter's only input is the output of
+another filter, the processing of the whole chain is fused together (see
+:class:`FusedFilterStages`). Each document is passed through all the filters'
+processing in the same worker, one after the other, instead of every filter
+running its own mapping process and passing documents on to the next.
+
 """
 from builtins import object
 
@@ -55,6 +66,29 @@ class FilterModuleOutputReader(GroupedCorpus.Reader):
         for archive, doc_name, doc in self.archive_iter():
             yield archive, doc_name
 
+    def _get_fused_stages(self):
+        """
+        Find any filter modules that come directly before this one and can be run together
+        with it, in the same worker.
+
+        :return: :class:`FusedFilterStages`, or None if there are none, and the aligned input
+            corpora to read the input documents from
+        """
+        stages = []
+        reader = self
+        while len(reader.input_corpora) == 1 and isinstance(reader.input_corpora[0], FilterModuleOutputReader):
+            previous = reader.input_corpora[0]
+            module_info = previous.setup.wrapped_module_info
+            executor = module_info.load_executor()(module_info)
+            if executor.create_inline_worker(1) is None:
+                # This filter's documents can't be processed in another worker: let it run as normal
+                break
+            stages.insert(0, (executor, previous.setup.output_num))
+            reader = previous
+        if len(stages) == 0:
+            return None, self.input_iterator
+        return FusedFilterStages(stages), reader.input_iterator
+
     def archive_iter(self, start_after=None, skip=None, name_filter=None):
         # Get hold of the outputs from the previous modules to iterate over them
         output_num = self.setup.output_num
@@ -70,24 +104,37 @@ class FilterModuleOutputReader(GroupedCorpus.Reader):
         invalid_inputs = 0
         invalid_outputs = 0
 
+        fused_stages, input_iterator = self._get_fused_stages()
+        complete = False
         try:
+            if fused_stages is not None:
+                executor.log.info("Running filter modules {} together with {}".format(
+                    ", ".join(fused_stages.module_names), self.setup.wrapped_module_info.module_name
+                ))
+                # The workers will pass each doc through the earlier filters' processing first
+                fused_stages.prepare()
+                executor.fused_stages = fused_stages
+
             # Inputs will be taken from this as they're needed
             input_iter = iter(
-                self.input_iterator.archive_iter(start_after=start_after, skip=skip, name_filter=name_filter)
+                input_iterator.archive_iter(start_after=start_after, skip=skip, name_filter=name_filter)
             )
 
             # Set map processing going, using the generic function
-            mapper = DocumentMapper(executor, input_iter, record_invalid=True)
-            # Only ever use a single process for a filter module
+            # By default, only use a single process for a filter module, which means that the documents
+            #  are usually processed right here, as they're read, without a pool
+            mapper = DocumentMapper(executor, input_iter, processes=_get_filter_processes(self.pipeline),
+                                    record_invalid=True)
             for (archive, doc_name), next_output in mapper.map_documents():
                 # Accumulate counts of invalid documents
                 if any(is_invalid_doc(d) for d in next_output):
                     invalid_outputs += 1
-                if mapper.input_feeder.check_invalid(archive, doc_name):
+                if mapper.check_invalid(archive, doc_name):
                     invalid_inputs += 1
 
                 # We only take one of the outputs, if there are multiple, and yield this
                 yield archive, doc_name, next_output[output_num]
+            complete = True
         except Exception as e:
             # Any other uncaught exception should be passed up as a ModuleExecutionError, since we're actually
             #  executing a module here, even though we're pretending to iterate over data
@@ -104,6 +151,8 @@ class FilterModuleOutputReader(GroupedCorpus.Reader):
             raise ModuleExecutionError("error in filter {}: {}".format(self.setup.wrapped_module_info.module_name, e),
                                        cause=e, debugging_info=debugging)
         finally:
+            if fused_stages is not None:
+                fused_stages.finish(error=not complete)
             executor.log.info("Filter input contained {:,} invalid documents, output contained {:,}".format(
                 invalid_inputs, invalid_outputs
             ))
@@ -132,6 +181,95 @@ class FilterModuleOutputReader(GroupedCorpus.Reader):
         return
 
 
+class FusedFilterStages(object):
+    """
+    A chain of filter modules, each of which takes its input from the previous one, whose
+    processing is fused into the processing of a later filter module, which takes the output
+    of the last of them as its input.
+
+    Instead of each filter having its own mapping process, the later filter's workers pass each
+    batch of documents through the processing of every one of the stages in turn, in the same
+    thread, before processing the results themselves. The intermediate documents are passed
+    straight on in memory.
+
+    Each stage's executor must be able to provide an inline worker (see
+    :meth:`~pimlico.core.modules.map.DocumentMapModuleExecutor.create_inline_worker`), which the
+    later filter's workers use to process the documents.
+
+    :param stages: list of `(executor, output_num)` for each stage, earliest first, where `output_num`
+        identifies the output of the stage that's used as input to the next
+    """
+    def __init__(self, stages):
+        self.stages = stages
+
+    @property
+    def module_names(self):
+        return [executor.info.module_name for (executor, output_num) in self.stages]
+
+    def prepare(self):
+        """
+        Call from the main process before starting processing, to run each stage's preprocessing.
+
+        """
+        for executor, output_num in self.stages:
+            executor.preprocess()
+
+    def finish(self, error=False):
+        """
+        Call from the main process once processing is finished, to run each stage's postprocessing.
+
+        """
+        for executor, output_num in self.stages:
+            executor.postprocess(error=error)
+
+    def start_workers(self):
+        """
+        Create and set up a worker for each stage. Called in each worker (process, thread, or the
+        main thread) that will process documents.
+
+        :return: list of workers, to pass to :meth:`process_documents` and :meth:`stop_workers`
+        """
+        workers = []
+        try:
+            for executor, output_num in self.stages:
+                worker = executor.create_inline_worker(1)
+                worker.set_up()
+                workers.append(worker)
+        except:
+            self.stop_workers(workers)
+            raise
+        return workers
+
+    def stop_workers(self, workers):
+        for worker in workers:
+            worker.tear_down()
+
+    def process_documents(self, workers, doc_tuples):
+        """
+        Pass a batch of documents through all the stages.
+
+        :param doc_tuples: list of tuples `(archive, filename, doc)`, as given to
+            :meth:`~pimlico.core.modules.map.DocumentMapProcessMixin.process_documents`
+        :return: list of tuples of the same form, containing the documents output by the last stage
+        """
+        for worker, (executor, output_num) in zip(workers, self.stages):
+            output_datatypes = executor.get_output_data_point_types()
+            results = worker.process_documents(doc_tuples)
+            doc_tuples = [
+                (doc_tuple[0], doc_tuple[1], executor.normalize_outputs(result, output_datatypes)[output_num])
+                for (doc_tuple, result) in zip(doc_tuples, results)
+            ]
+        return doc_tuples
+
+
+def _get_filter_processes(pipeline):
+    """
+    Number of processes to use for each filter module, from the `filter_processes` local config setting.
+
+    """
+    return int(pipeline.local_config.get("filter_processes", 1))
+
+
 def wrap_module_info_as_filter(module_info_instance):
     """
     Create a filter module from a document map module so that it gets executed on the fly to provide its
@@ -0,0 +1,347 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Updating the complete output of a document map module when only some of its input documents
+have changed.
+
+When a document map module is executed using the `run` command's `--incremental` option,
+as it writes its output it records a hash of the data of the input document(s) that each
+output document was produced from. They are stored in a file `input_hashes` in the module's
+output directory, alongside the module's metadata. Hashing the input takes time, so they are
+not recorded otherwise: to be able to update a module's output later, use `--incremental`
+the first time it's run too.
+
+When a module that has already been run to completion is run again with the `run` command's
+`--incremental` option, the existing output is moved out of the way and read as the new output
+is written. Only the input documents that are new, or whose hash has changed, are processed. The
+output documents for all the others are copied from the existing output, without decoding them,
+in the same order as the input documents, so the output has the same archive structure as it
+would if everything had been processed again. Documents that are no longer in the input are
+left out.
+
+If the module's options or inputs have changed since it was run (see
+:meth:`~pimlico.core.modules.base.BaseModuleInfo.is_changed`), all of the documents are
+processed, since the existing output can't be reused. The same goes if no hashes were recorded
+when the module was run, because it was run without `--incremental`, or because the worker
+processes read the input documents themselves (the `map_worker_reads` local config setting).
+Either way, the hashes are recorded this time, so that the output can be updated next time.
+
+If the update fails or is interrupted, the previous output is put back and the module is
+left with its complete status. If the process is killed, so that it doesn't get the chance
+to do this, the previous output is put back the next time the module is run (see
+:meth:`IncrementalUpdate.restore_previous_outputs`).
+
+"""
+from __future__ import absolute_import
+
+from builtins import object
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+from collections import deque
+
+from pimlico.core.modules.execute import ModuleExecutionError
+from pimlico.datatypes.corpora.grouped import RawDocumentRecord
+
+
+INPUT_HASHES_FILENAME = "input_hashes"
+
+
+def input_hash(docs):
+    """
+    Compute a hash of the raw data of the input documents that an output document is produced from.
+
+    :param docs: input documents, one from each input corpus
+    :return: hex digest
+    """
+    hsh = hashlib.sha1()
+    for doc in docs:
+        if type(doc) is RawDocumentRecord:
+            # Stored record of a document passed straight through: hash the same data as the document's raw data
+            data = doc.decompress()
+        else:
+            data = getattr(doc, "raw_data", doc)
+        data = bytes(data) if data is not None else bytes()
+        # Include the length, so that the boundaries between the docs are part of the hash
+        hsh.update(struct.pack("<Q", len(data)))
+        hsh.update(data)
+    return hsh.hexdigest()
+
+
+def get_input_hashes_path(module):
+    """ Path to the file storing the given module's input hashes """
+    return os.path.join(module.get_module_output_dir(absolute=True), INPUT_HASHES_FILENAME)
+
+
+def load_input_hashes(module):
+    """
+    Read the input document hashes recorded the last time the module was executed.
+
+    :return: dict mapping `(archive name, doc name)` to the hash, or None if no hashes were recorded
+    """
+    path = get_input_hashes_path(module)
+    if not os.path.exists(path):
+        return None
+    hashes = {}
+    with io.open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    archive_name, doc_name, doc_hash = json.loads(line)
+                except ValueError:
+                    # Partly written line, if execution was killed: the doc will be processed again
+                    continue
+                # If a doc is recorded more than once (e.g. after resuming execution), the last one is right
+                hashes[(archive_name, doc_name)] = doc_hash
+    return hashes
+
+
+def discard_input_hashes(module):
+    """
+    Remove the stored input hashes, when the output is written without recording them.
+
+    """
+    path = get_input_hashes_path(module)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class InputHashRecorder(object):
+    """
+    Records the hash of the input documents for each output document, as the output is written.
+
+    The hash is computed as each input document is read, by wrapping the input iterator using
+    :meth:`wrap_input`, which may happen in a different thread from the writing. Once a document's
+    output has been written, call :meth:`written` to record its hash.
+
+    :param path: file to store the hashes in
+    :param append: add to the hashes already stored, instead of starting again
+    """
+    def __init__(self, path, append=False):
+        self.path = path
+        self._file = io.open(path, "a" if append else "w", encoding="utf-8")
+        if append and self._file.tell() > 0:
+            # If the last line was only partly written, start on a new line
+            self._file.write(u"\n")
+        # Hashes of documents that have been read, but whose output hasn't been written yet
+        self._pending = {}
+
+    def wrap_input(self, input_iter):
+        for archive_name, doc_name, docs in input_iter:
+            self.add(archive_name, doc_name, input_hash(docs))
+            yield archive_name, doc_name, docs
+
+    def add(self, archive_name, doc_name, doc_hash):
+        self._pending[(archive_name, doc_name)] = doc_hash
+
+    def written(self, archive_name, doc_name):
+        doc_hash = self._pending.pop((archive_name, doc_name), None)
+        if doc_hash is not None:
+            self._file.write(u"%s\n" % json.dumps([archive_name, doc_name, doc_hash]))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class IncrementalUpdate(object):
+    """
+    Takes care of updating a document map module's complete output incrementally: see the
+    module docstring for how it works. Create using :meth:`prepare`, which moves the existing
+    output out of the way, before getting the writers for the new output.
+
+    Then wrap the input iterator using :meth:`wrap_input`, so that only new or changed documents
+    are processed, and call :meth:`copy_unchanged` to copy the output of the unchanged documents
+    before writing each processed document's output. At the end, call :meth:`finish` with
+    `success=False` if something went wrong, to put the previous output back.
+
+    """
+    def __init__(self, executor, previous_hashes, output_dirs):
+        self.executor = executor
+        self.previous_hashes = previous_hashes
+        self.output_dirs = output_dirs
+        self.hashes_path = get_input_hashes_path(executor.info)
+        # New hashes are written to a separate file until the output is complete
+        self.hash_recorder = InputHashRecorder(_new_input_hashes_path(executor.info))
+        # Readers of the previous output, in the order of the writers
+        self.previous_readers = [
+            executor.info.get_output_datatype(output_name)[1]([previous_dir]).get_reader(
+                executor.info.pipeline, module=executor.info.module_name)
+            for (output_name, output_dir, previous_dir) in output_dirs
+        ]
+        # Input documents in the order they were read: (True, archive, doc) for docs to copy,
+        #  (False, archive, doc) for docs sent for processing. Appended by the input iterator, which
+        #  may be in another thread
+        self._doc_order = deque()
+        self.docs_copied = 0
+        self.docs_processed = 0
+
+    @staticmethod
+    def restore_previous_outputs(module):
+        """
+        Clean up after an incremental update that was killed before it finished, which leaves the
+        module's previous outputs alongside the new ones. If the update hadn't finished, the partly
+        written new outputs are removed and the previous outputs put back in their place. If it had
+        (the new input hashes had been stored), only the previous outputs are removed. Either way,
+        the module's status is set back to COMPLETE, as it was before the update.
+
+        Must not be called while the module is being executed.
+
+        :return: True if the outputs of an update were found and cleaned up
+        """
+        previous_dirs = []
+        for output_name in module.get_grouped_corpus_output_names():
+            output_dir = module.get_absolute_output_dir(output_name)
+            if os.path.exists(_previous_output_dir(output_dir)):
+                previous_dirs.append((output_dir, _previous_output_dir(output_dir)))
+        if len(previous_dirs) == 0:
+            return False
+
+        new_hashes_path = _new_input_hashes_path(module)
+        # Storing the new hashes is the last step of an update that's not yet cleaned up
+        finished = not os.path.exists(new_hashes_path)
+        for output_dir, previous_dir in previous_dirs:
+            if finished:
+                shutil.rmtree(previous_dir)
+            else:
+                if os.path.exists(output_dir):
+                    shutil.rmtree(output_dir)
+                os.rename(previous_dir, output_dir)
+        if finished:
+            module.add_execution_history_record("Incremental update was killed after finishing: keeping new output")
+        else:
+            os.remove(new_hashes_path)
+            module.add_execution_history_record("Incremental update was killed before finishing: "
+                                                "previous complete output restored")
+        module.status = "COMPLETE"
+        return True
+
+    @classmethod
+    def prepare(cls, executor):
+        """
+        Check whether the module's complete output can be updated incrementally and, if so, move
+        the existing output out of the way, ready for writing the new output.
+
+        :return: an IncrementalUpdate, or None if all the documents need to be processed
+        """
+        module = executor.info
+        log = executor.log
+        if executor.input_iterator.is_following():
+            log.info("Can't update output incrementally while inputs are still being written: "
+                     "processing all documents")
+            return None
+        previous_hashes = load_input_hashes(module)
+        if previous_hashes is None:
+            log.info("No input document hashes were recorded when the module was run: processing all documents")
+            return None
+
+        output_dirs = []
+        for output_name in module.get_grouped_corpus_output_names():
+            output_dir = module.get_absolute_output_dir(output_name)
+            if not module.get_output_datatype(output_name)[1]([output_dir]).ready_to_read():
+                log.info("Previous output '{}' not found in {}: processing all documents".format(
+                    output_name, output_dir))
+                return None
+            output_dirs.append((output_name, output_dir, _previous_output_dir(output_dir)))
+
+        # Create the file for the new hashes first: while it exists, the update's not finished, so the previous
+        #  output is put back if the update is killed (see restore_previous_outputs())
+        io.open(_new_input_hashes_path(module), "w").close()
+        for output_name, output_dir, previous_dir in output_dirs:
+            os.rename(output_dir, previous_dir)
+        return cls(executor, previous_hashes, output_dirs)
+
+    def wrap_input(self, input_iter):
+        """
+        Wrap the input iterator to record the hash of every input document and pass on only the
+        documents that need to be processed.
+
+        """
+        for archive_name, doc_name, docs in input_iter:
+            doc_hash = input_hash(docs)
+            self.hash_recorder.add(archive_name, doc_name, doc_hash)
+            if self.previous_hashes.get((archive_name, doc_name)) == doc_hash:
+                self._doc_order.append((True, archive_name, doc_name))
+            else:
+                self._doc_order.append((False, archive_name, doc_name))
+                yield archive_name, doc_name, docs
+
+    def copy_unchanged(self, writers, until=None):
+        """
+        Copy the previous output for the unchanged documents that come before the given processed
+        document in the input, or all remaining ones if `until` is None.
+
+        :param until: `(archive name, doc name)` of the next document whose output is to be written
+        :return: number of documents copied
+        """
+        copied = 0
+        while len(self._doc_order):
+            copy, archive_name, doc_name = self._doc_order.popleft()
+            if not copy:
+                if (archive_name, doc_name) != until:
+                    raise ModuleExecutionError("processed document {}/{} came out in the wrong order for "
+                                               "incremental update".format(archive_name, doc_name))
+                self.docs_processed += 1
+                return copied
+            for writer, reader in zip(writers, self.previous_readers):
+                self._copy_document(writer, reader, archive_name, doc_name)
+            self.hash_recorder.written(archive_name, doc_name)
+            self.docs_copied += 1
+            copied += 1
+        if until is not None:
+            raise ModuleExecutionError("processed document {}/{} was not read from the input".format(*until))
+        return copied
+
+    def _copy_document(self, writer, reader, archive_name, doc_name):
+        filename = writer._doc_filename(doc_name)
+        archive = reader.get_archive(archive_name) if archive_name in reader.archive_to_archive_filename else None
+        if archive is None or filename not in archive.index:
+            if self.executor.ALLOW_SKIP_OUTPUT:
+                # Nothing was output for this document
+                return
+            raise ModuleExecutionError("output for unchanged document {}/{} not found in previous output".format(
+                archive_name, doc_name))
+        metadata, data = archive[filename]
+        writer.add_raw_record(archive_name, doc_name,
+                              RawDocumentRecord(metadata, data, reader.get_archive_codec(archive_name)))
+
+    def finish(self, success=True):
+        """
+        Once the new output is complete, remove the previous output and store the new hashes. If the
+        update failed, the new output is removed and the previous output put back in its place.
+
+        """
+        self.hash_recorder.close()
+        for reader in self.previous_readers:
+            if reader._last_used_archive is not None:
+                reader._last_used_archive.close()
+        if success:
+            # Once the new hashes are stored, the update is complete, even if we're killed before cleaning up
+            os.rename(self.hash_recorder.path, self.hashes_path)
+        for output_name, output_dir, previous_dir in self.output_dirs:
+            if success:
+                shutil.rmtree(previous_dir)
+            else:
+                if os.path.exists(output_dir):
+                    shutil.rmtree(output_dir)
+                os.rename(previous_dir, output_dir)
+        if not success:
+            os.remove(self.hash_recorder.path)
+
+
+def _new_input_hashes_path(module):
+    """ Path to the file that the input hashes are written to during an update """
+    return "%s.new" % get_input_hashes_path(module)
+
+
+def _previous_output_dir(output_dir):
+    return "%s.previous" % output_dir.rstrip(os.sep)
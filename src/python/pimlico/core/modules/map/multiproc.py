@@ -9,9 +9,14 @@ implement a parallelized module, simply by defining what should be done on each
 
 In particular, use :fun:.multiprocessing_executor_factory wherever possible.
 
+Documents are normally sent to and from the worker processes by pickling them and sending them
+through multiprocessing queues. Optionally, shared memory can be used instead, to avoid a lot of
+copying and pickling when documents are processed quickly: see :mod:`.shared_memory`.
+
 """
 from __future__ import absolute_import
 
+import os
 import sys
 
 from future import standard_library
@@ -27,9 +32,12 @@ from queue import Empty
 import signal
 
 from pimlico.core.modules.map import ProcessOutput, DocumentProcessorPool, DocumentMapProcessMixin, \
-    DocumentMapModuleExecutor, WorkerStartupError, WorkerShutdownError, ExceptionWithTraceback
-from pimlico.core.modules.map.threaded import ThreadingMapThread
+    DocumentMapModuleExecutor, WorkerStartupError, WorkerShutdownError, ExceptionWithTraceback, InputSlice
+from pimlico.core.modules.map.shared_memory import SharedMemoryInputQueue, SharedMemoryOutputQueue
+from pimlico.core.modules.map.threaded import ThreadingMapThread, create_inline_worker
+from pimlico.utils.filesystem import parse_file_size
 from pimlico.utils.pipes import qget
+from pimlico.utils.shared_memory import SharedMemorySlots, shared_memory_available
 from .benchmark import benchmarker
 
 
@@ -39,6 +47,13 @@ class MultiprocessingMapProcess(multiprocessing.Process, DocumentMapProcessMixin
     map modules will want to use this: e.g. if you call a background service that provides parallelization
     itself (like the CoreNLP module) there's no need for multiprocessing in the Python code.
 
+    As well as batches of documents, the worker may be sent :class:`~pimlico.core.modules.map.InputSlice` s,
+    in which case it reads the input documents from the corpus itself.
+
+    If the executor has :attr:`~pimlico.core.modules.map.DocumentMapModuleExecutor.output_shards`,
+    the worker writes its output documents to its own shards and sends the main process their
+    positions, instead of the documents: see :mod:`~pimlico.core.modules.map.shards`.
+
     """
     def __init__(self, input_queue, output_queue, exception_queue, executor, docs_per_batch=1):
         multiprocessing.Process.__init__(self)
@@ -61,9 +76,18 @@ class MultiprocessingMapProcess(multiprocessing.Process, DocumentMapProcessMixin
         # Tell the worker process to ignore SIGINT (KeyboardInterrupt) and let the pool deal with stopping things
         signal.signal(signal.SIGINT, signal.SIG_IGN)
         bm, bm_callback = benchmarker.init_thread()
+        output_shards = self.executor.output_shards
+        fused_stages = self.executor.fused_stages
+        shard_writer = None
+        stage_workers = None
         try:
+            if output_shards is not None:
+                shard_writer = output_shards.worker_writer(str(os.getpid()))
             # Run any startup routine that the subclass has defined
             self.set_up()
+            if fused_stages is not None:
+                # Earlier filters' processing is done here too, before our own
+                stage_workers = fused_stages.start_workers()
             # Notify waiting processes that we've finished initialization
             self.initialized.set()
             input_buffer = []
@@ -74,23 +98,52 @@ class MultiprocessingMapProcess(multiprocessing.Process, DocumentMapProcessMixin
                         # The queue feeds us multiple documents at a time: we don't know how many it will be
                         with bm.wait_for_input_timer:
                             inputs = qget(self.input_queue, timeout=0.05)
+                            if isinstance(inputs, InputSlice):
+                                # We've been told where to find the documents: read them ourselves
+                                inputs = list(self.executor.input_iterator.read_archive_slice(
+                                    inputs.archive, inputs.positions, inputs.count))
                     except Empty:
                         # Don't worry if the queue is empty: just keep waiting for more until we're shut down
                         pass
                     else:
+                        outputs = []
                         for archive, filename, docs in inputs:
                             # Buffer input documents, so that we can process multiple at once if requested
                             input_buffer.append(tuple([archive, filename] + docs))
                             if len(input_buffer) >= self.docs_per_batch or self.no_more_inputs.is_set():
                                 with bm.process_doc_timer:
-                                    results = self.process_documents(input_buffer)
-
-                                with bm.queue_output_timer:
-                                    for input_tuple, result in zip(input_buffer, results):
-                                        self.output_queue.put(ProcessOutput(input_tuple[0], input_tuple[1], result))
+                                    if stage_workers is None:
+                                        results = self.process_documents(input_buffer)
+                                    else:
+                                        results = self.process_documents(
+                                            fused_stages.process_documents(stage_workers, input_buffer)
+                                        )
+                                outputs.extend(
+                                    ProcessOutput(input_tuple[0], input_tuple[1], result)
+                                    for input_tuple, result in zip(input_buffer, results)
+                                )
                                 input_buffer = []
+                        if len(outputs) and shard_writer is not None:
+                            # Write the output documents ourselves and just send where we've put them
+                            with bm.queue_output_timer:
+                                outputs = [
+                                    ProcessOutput(output.archive, output.filename, shard_writer.write(
+                                        output.archive, output.filename,
+                                        self.executor.normalize_outputs(output.data, output_shards.output_datatypes)
+                                    )) for output in outputs
+                                ]
+                                shard_writer.flush()
+                        if len(outputs):
+                            # Send all the results from this batch of inputs together
+                            with bm.queue_output_timer:
+                                self.output_queue.put(outputs)
             finally:
+                self.executor.input_iterator.close_archive_slices()
+                if shard_writer is not None:
+                    shard_writer.close()
                 try:
+                    if stage_workers is not None:
+                        fused_stages.stop_workers(stage_workers)
                     self.tear_down()
                 except Exception as e:
                     self.exception_queue.put(WorkerShutdownError("error in tear_down() call", cause=e), block=True)
@@ -115,9 +168,30 @@ class MultiprocessingMapPool(DocumentProcessorPool):
     # Can specify an alternative implementation of the process type when we only need a single process
     SINGLE_PROCESS_TYPE = None
 
+    #: Number of shared memory slots to create for each process, for each of the input and output,
+    #: when using shared memory to transfer documents
+    SHARED_MEMORY_SLOTS_PER_PROCESS = 4
+
     def __init__(self, executor, processes):
         super(MultiprocessingMapPool, self).__init__(processes)
         self.executor = executor
+
+        self.shared_memory = []
+        slot_size = _get_shared_memory_slot_size(executor.info.pipeline)
+        if slot_size > 0 and not self.uses_threads:
+            if shared_memory_available():
+                # Send documents to and from the workers using shared memory
+                num_slots = self.SHARED_MEMORY_SLOTS_PER_PROCESS * processes
+                input_slots = SharedMemorySlots(num_slots, slot_size)
+                output_slots = SharedMemorySlots(num_slots, slot_size)
+                self.shared_memory = [input_slots, output_slots]
+                self.input_queue = SharedMemoryInputQueue(self.input_queue, input_slots)
+                self.output_queue = SharedMemoryOutputQueue(self.output_queue, output_slots)
+                self._queues = [self.output_queue, self.input_queue, self.exception_queue]
+            else:
+                executor.log.warn("Shared memory is not available in this version of Python: "
+                                  "sending documents to worker processes over queues")
+
         if executor.SEQUENTIAL_START:
             self.workers = []
             for i in range(processes):
@@ -150,8 +224,18 @@ class MultiprocessingMapPool(DocumentProcessorPool):
                 e
             )
 
+    @property
+    def uses_threads(self):
+        """ True if the workers are threads, not processes, in which case documents are passed between them directly. """
+        return self.uses_threads_for(self.processes)
+
+    @classmethod
+    def uses_threads_for(cls, processes):
+        """ Whether the pool uses threads instead of processes when creating the given number of workers. """
+        return processes == 1 and cls.SINGLE_PROCESS_TYPE is not None
+
     def start_worker(self):
-        if self.processes == 1 and self.SINGLE_PROCESS_TYPE is not None:
+        if self.uses_threads:
             return self.SINGLE_PROCESS_TYPE(self.input_queue, self.output_queue, self.exception_queue, self.executor)
         else:
             return self.PROCESS_TYPE(self.input_queue, self.output_queue, self.exception_queue, self.executor)
@@ -194,15 +278,21 @@ class MultiprocessingMapPool(DocumentProcessorPool):
                 self.executor.log.warn("Multiprocessing document map worker process has taken a long time to shut "
                                        "down, even after being terminated: giving up waiting. "
                                        "You may need to forcibly kill the main process")
+        # Now nothing else is using the shared memory, it can be freed
+        for slots in self.shared_memory:
+            slots.close()
+            slots.unlink()
+        self.shared_memory = []
 
     def notify_no_more_inputs(self):
         for worker in self.workers:
             worker.notify_no_more_inputs()
 
     def empty_all_queues(self):
+        # Empty the queues before closing them: on Python 3.8+ we can't get from a closed queue
+        super(MultiprocessingMapPool, self).empty_all_queues()
         for q in self._queues:
             q.close()
-        super(MultiprocessingMapPool, self).empty_all_queues()
 
 
 class MultiprocessingMapModuleExecutor(DocumentMapModuleExecutor):
@@ -212,13 +302,39 @@ class MultiprocessingMapModuleExecutor(DocumentMapModuleExecutor):
     def create_pool(self, processes):
         return self.POOL_TYPE(self, processes)
 
+    def supports_worker_reads(self):
+        # Only worth doing if the workers are separate processes
+        return not self.POOL_TYPE.uses_threads_for(self.processes)
+
+    def supports_worker_writes(self):
+        # Likewise, there's nothing to be gained from a single worker thread writing the output
+        return not self.POOL_TYPE.uses_threads_for(self.processes)
+
+    def create_inline_worker(self, processes):
+        if self.POOL_TYPE.uses_threads_for(processes):
+            # The pool would create a single worker thread: no need for the thread
+            return create_inline_worker(self.POOL_TYPE.SINGLE_PROCESS_TYPE, self)
+        return None
+
     def postprocess(self, error=False):
-        self.pool.shutdown()
+        # There's no pool if the documents were processed inline
+        if self.pool is not None:
+            self.pool.shutdown()
 
     def wait_until_finished(self):
         self.pool.wait_until_finished()
 
 
+def _get_shared_memory_slot_size(pipeline):
+    """
+    Size of each slot of shared memory to use to send documents to and from worker processes,
+    taken from the `map_shared_memory` local config setting. 0 (don't use shared memory) if it's
+    not set.
+
+    """
+    return parse_file_size(pipeline.local_config.get("map_shared_memory", "0"))
+
+
 def multiprocessing_executor_factory(process_document_fn, preprocess_fn=None, postprocess_fn=None,
                                      worker_set_up_fn=None, worker_tear_down_fn=None, batch_docs=None,
                                      multiprocessing_single_process=False, allow_skip_output=False,
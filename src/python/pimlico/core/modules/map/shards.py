@@ -0,0 +1,207 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Writing the output of multiprocessing document map workers straight to disk.
+
+Normally, the worker processes send the documents they produce back to the main process, which
+encodes, compresses and writes them to the output corpora. When this is slow compared to the
+processing itself, the main process becomes a bottleneck. Instead, each worker can encode and
+compress its output documents itself and write them to its own temporary Pimarc archive, a
+*shard*, for each output archive. It then only needs to tell the main process where in the
+shard each document's record is. The main process copies the records byte-for-byte into the
+real output archives, in the order of the input documents, and rebuilds their indexes as it
+goes, so the output is exactly the same as it would otherwise be.
+
+Records are copied as soon as their turn comes, rather than in a final step once all the shards
+are complete, so that processing progress can be stored and processing resumed as normal.
+Once an archive is complete, its shards are deleted.
+
+Enabled by the `map_worker_writes` local config setting: see :doc:`/core/local_config`.
+
+"""
+import os
+import shutil
+
+from pimlico.utils.pimarc import PimarcWriter
+from pimlico.utils.pimarc.utils import _has_name_header
+
+
+class OutputShards(object):
+    """
+    Created by the main process before starting the workers, from the writers for the output
+    corpora. The workers each get a :class:`ShardWriter` to write their shards, using
+    :meth:`worker_writer`, and the main process uses :meth:`copy_record` to add the documents
+    from the shards to the outputs.
+
+    The shards for each output are stored in a `shards` directory alongside the output's data,
+    which is emptied when this is created and removed by :meth:`close`.
+
+    :param writers: grouped corpus writers for the outputs
+    :param output_datatypes: data point types of the outputs
+    :param allow_skip_output: if True, None may be given in place of an output document, in
+        which case nothing is written to that output
+    """
+    def __init__(self, writers, output_datatypes, allow_skip_output=False):
+        self.writers = writers
+        self.output_datatypes = output_datatypes
+        self.allow_skip_output = allow_skip_output
+        self.shard_dirs = [os.path.join(writer.base_dir, "shards") for writer in writers]
+
+        for shard_dir in self.shard_dirs:
+            # Get rid of any shards left behind by an earlier run that was killed
+            if os.path.exists(shard_dir):
+                shutil.rmtree(shard_dir)
+            os.makedirs(shard_dir)
+
+        # Shard files opened by the main process to copy from: path -> (file, name_header)
+        self._open_shards = {}
+        self._current_archive = None
+
+    def worker_writer(self, worker_name):
+        """
+        Get a writer for a worker process to write its shards with.
+
+        :param worker_name: name for the worker's shards, unique to the worker
+        """
+        return ShardWriter(self, worker_name)
+
+    def copy_record(self, writer, archive_name, doc_name, record):
+        """
+        Add a document from a worker's shard to an output corpus.
+
+        :param writer: the output's writer
+        :param record: :class:`ShardRecord` received from the worker
+        """
+        if archive_name != self._current_archive:
+            # All the documents from the previous archive have been copied
+            self._delete_open_shards()
+            self._current_archive = archive_name
+
+        try:
+            shard_file, name_header = self._open_shards[record.path]
+        except KeyError:
+            # Read without buffering: the worker may still be adding to the shard
+            shard_file = open(record.path, "rb", buffering=0)
+            name_header = _has_name_header(shard_file)
+            self._open_shards[record.path] = (shard_file, name_header)
+
+        writer.copy_record(archive_name, doc_name, shard_file, record.metadata_start, record.data_start, record.end,
+                           source_name_header=name_header)
+
+    def _delete_open_shards(self):
+        for path, (shard_file, name_header) in self._open_shards.items():
+            shard_file.close()
+            PimarcWriter.delete(path)
+        self._open_shards = {}
+
+    def close(self):
+        """
+        Delete all the shards. Call once the workers have finished.
+
+        """
+        for shard_file, name_header in self._open_shards.values():
+            shard_file.close()
+        self._open_shards = {}
+        for shard_dir in self.shard_dirs:
+            # If something went wrong, a worker might still be writing a shard: don't complain
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+class ShardWriter(object):
+    """
+    Used within a worker process to write its output documents to its shards. Each shard holds
+    the worker's documents for a single archive of an output, so a worker has one shard open for
+    each output at a time.
+
+    """
+    def __init__(self, output_shards, worker_name):
+        self.output_shards = output_shards
+        self.worker_name = worker_name
+        # The shard currently being written for each output
+        self._shards = [None] * len(output_shards.writers)
+        self._shard_archives = [None] * len(output_shards.writers)
+
+    def write(self, archive_name, doc_name, outputs):
+        """
+        Encode the output documents for an input document, as the output writers would, and write
+        them to this worker's shards.
+
+        :param outputs: one document for each output, as converted for the writer
+        :return: :class:`ShardedOutput` to send to the main process in place of the documents
+        """
+        records = []
+        for output_num, (writer, doc) in enumerate(zip(self.output_shards.writers, outputs)):
+            if doc is None and self.output_shards.allow_skip_output:
+                # Nothing to write to this output
+                records.append(None)
+                continue
+            filename, data, metadata = writer.encode_document(archive_name, doc_name, doc)
+            shard = self._get_shard(output_num, archive_name)
+            metadata_start, data_start, end = shard.write_file(data, name=filename, metadata=metadata)
+            records.append(ShardRecord(shard.archive_filename, metadata_start, data_start, end))
+        return ShardedOutput(records)
+
+    def _get_shard(self, output_num, archive_name):
+        if archive_name != self._shard_archives[output_num]:
+            if self._shards[output_num] is not None:
+                self._shards[output_num].close()
+            shard_filename = os.path.join(self.output_shards.shard_dirs[output_num],
+                                          "{}-{}.prc".format(archive_name, self.worker_name))
+            self._shards[output_num] = PimarcWriter(
+                shard_filename, name_header=self.output_shards.writers[output_num].name_header
+            )
+            self._shard_archives[output_num] = archive_name
+        return self._shards[output_num]
+
+    def flush(self):
+        """
+        Make everything written so far readable by the main process. Call before sending the
+        records to the main process.
+
+        There's no need to force the data to be written to disk here: that's done when the
+        records have been copied to the output and the output is flushed.
+
+        """
+        for shard in self._shards:
+            if shard is not None:
+                shard.archive_file.flush()
+
+    def close(self):
+        for shard in self._shards:
+            if shard is not None:
+                shard.close()
+        self._shards = [None] * len(self._shards)
+        self._shard_archives = [None] * len(self._shards)
+
+
+class ShardRecord(object):
+    """
+    Position of a document's record in a worker's shard.
+
+    """
+    __slots__ = ["path", "metadata_start", "data_start", "end"]
+
+    def __init__(self, path, metadata_start, data_start, end):
+        self.path = path
+        self.metadata_start = metadata_start
+        self.data_start = data_start
+        self.end = end
+
+    def __getstate__(self):
+        return self.path, self.metadata_start, self.data_start, self.end
+
+    def __setstate__(self, state):
+        self.path, self.metadata_start, self.data_start, self.end = state
+
+
+class ShardedOutput(object):
+    """
+    Sent by a worker that writes its output to shards, in place of the output documents for
+    an input document. Contains a :class:`ShardRecord` for each output, or None if nothing
+    was written to that output.
+
+    """
+    def __init__(self, records):
+        self.records = tuple(records)
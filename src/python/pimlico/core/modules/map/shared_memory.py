@@ -0,0 +1,202 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Shared-memory transport for passing documents between the main process and multiprocessing
+document map workers.
+
+Normally, every batch of input documents and every result is pickled and sent through a
+`multiprocessing.Queue`. For modules that do little work on each document, this copying
+can take more time than the processing itself. Instead, the queues defined here write the
+raw data of the documents once into shared memory (see
+:class:`~pimlico.utils.shared_memory.SharedMemorySlots`) and only send small control
+messages through the underlying queue, containing names, offsets and data point types.
+
+The queues have the same interface as the queues they wrap, so workers and the input
+feeder don't need to know which transport is being used.
+
+Enabled by the `map_shared_memory` local config setting: see :doc:`/core/local_config`.
+
+"""
+from __future__ import absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+
+from queue import Empty, Full
+from time import time
+
+from pimlico.datatypes.corpora.data_points import DataPointType, DataConversionError
+from pimlico.utils.shared_memory import SlotOverflow
+
+# Markers used in the encoded values
+_BYTES = 0
+_DOCUMENT = 1
+_OBJECT = 2
+_LIST = 3
+_TUPLE = 4
+
+
+class SharedMemoryDocumentQueue(object):
+    """
+    Wraps a multiprocessing queue that carries lists of documents, or results from processing
+    documents. Any bytes in the data, including the raw data of documents, are written into a
+    slot of the shared memory. Other objects are pickled and sent on the queue as normal.
+
+    If the data in a message doesn't fit in a single slot, the whole message is sent in the
+    normal way.
+
+    Subclasses define how the items of a message are split into archive name, document name
+    and the data itself.
+
+    """
+    def __init__(self, queue, slots):
+        self.queue = queue
+        self.slots = slots
+
+    def split_item(self, item):
+        """ Split an item from a message into `(archive, filename, data)`. """
+        raise NotImplementedError()
+
+    def join_item(self, archive, filename, data):
+        """ Inverse of :meth:`split_item`. """
+        raise NotImplementedError()
+
+    def put(self, items, block=True, timeout=None):
+        if type(items) is not list:
+            # Something other than a list of documents, e.g. an InputSlice: send it normally
+            self.queue.put((None, None, items), block, timeout)
+            return
+
+        chunks = []
+        types = []
+        encoded = [
+            (archive, filename, _encode_value(data, chunks, types))
+            for (archive, filename, data) in (self.split_item(item) for item in items)
+        ]
+        if len(chunks) == 0 or sum(len(chunk) for chunk in chunks) > self.slots.slot_size:
+            # No point in using the shared memory, or the data won't fit
+            self.queue.put((None, None, items), block, timeout)
+            return
+
+        start_time = time()
+        try:
+            slot = self.slots.acquire(block, timeout)
+        except Empty:
+            # No slot free in time: behave as if the queue were full
+            raise Full()
+        try:
+            positions = self.slots.write(slot, chunks)
+            if timeout is not None:
+                timeout = max(0., timeout - (time() - start_time))
+            self.queue.put((slot, types, (encoded, positions)), block, timeout)
+        except (Full, SlotOverflow):
+            self.slots.release(slot)
+            raise
+
+    def get(self, block=True, timeout=None):
+        slot, types, data = self.queue.get(block, timeout)
+        if slot is None:
+            # Sent without using the shared memory
+            return data
+        encoded, positions = data
+        try:
+            chunks = [self.slots.read(offset, length) for (offset, length) in positions]
+        finally:
+            self.slots.release(slot)
+        return [
+            self.join_item(archive, filename, _decode_value(value, chunks, types))
+            for (archive, filename, value) in encoded
+        ]
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def empty(self):
+        return self.queue.empty()
+
+    def close(self):
+        self.queue.close()
+
+    def cancel_join_thread(self):
+        self.queue.cancel_join_thread()
+
+
+class SharedMemoryInputQueue(SharedMemoryDocumentQueue):
+    """
+    Input queue, carrying lists of `(archive, filename, docs)`, where `docs` is a list of
+    documents, one from each input corpus.
+
+    """
+    def split_item(self, item):
+        return item
+
+    def join_item(self, archive, filename, data):
+        return archive, filename, data
+
+
+class SharedMemoryOutputQueue(SharedMemoryDocumentQueue):
+    """
+    Output queue, carrying lists of :class:`~pimlico.core.modules.map.ProcessOutput`s.
+
+    """
+    def split_item(self, item):
+        return item.archive, item.filename, item.data
+
+    def join_item(self, archive, filename, data):
+        # Avoid a circular import
+        from pimlico.core.modules.map import ProcessOutput
+        return ProcessOutput(archive, filename, data)
+
+
+def _encode_value(value, chunks, types):
+    """
+    Encode a value for sending, adding any raw data that can be put in shared memory to
+    `chunks` and any data point types of documents to `types`.
+
+    """
+    if type(value) is bytes:
+        chunks.append(value)
+        return _BYTES, len(chunks) - 1
+    elif isinstance(value, DataPointType.Document):
+        try:
+            # If the document only has internal data, this converts it to raw data in the
+            # sending process, which is where we want the work to be done
+            raw_data = value.raw_data
+        except DataConversionError:
+            # Let the receiving process deal with the problem, as it would normally
+            return _OBJECT, value
+        if type(raw_data) is not bytes:
+            return _OBJECT, value
+        chunks.append(raw_data)
+        # Generally all the documents will have only a couple of types
+        for type_num, dp_type in enumerate(types):
+            if dp_type is value.data_point_type:
+                break
+        else:
+            types.append(value.data_point_type)
+            type_num = len(types) - 1
+        return _DOCUMENT, (type_num, len(chunks) - 1)
+    elif type(value) is list:
+        return _LIST, [_encode_value(v, chunks, types) for v in value]
+    elif type(value) is tuple:
+        return _TUPLE, [_encode_value(v, chunks, types) for v in value]
+    else:
+        return _OBJECT, value
+
+
+def _decode_value(encoded, chunks, types):
+    marker, value = encoded
+    if marker == _BYTES:
+        return chunks[value]
+    elif marker == _DOCUMENT:
+        # Rebuilt in the same way as an unpickled document
+        type_num, chunk_num = value
+        return types[type_num](raw_data=chunks[chunk_num])
+    elif marker == _LIST:
+        return [_decode_value(v, chunks, types) for v in value]
+    elif marker == _TUPLE:
+        return tuple(_decode_value(v, chunks, types) for v in value)
+    else:
+        return value
@@ -15,6 +15,9 @@ class SingleThreadMapModuleExecutor(ThreadingMapModuleExecutor):
     def create_pool(self, processes):
         return super(SingleThreadMapModuleExecutor, self).create_pool(1)
 
+    def create_inline_worker(self, processes):
+        return super(SingleThreadMapModuleExecutor, self).create_inline_worker(1)
+
 
 def single_process_executor_factory(process_document_fn, preprocess_fn=None, postprocess_fn=None,
                                     worker_set_up_fn=None, worker_tear_down_fn=None, batch_docs=None,
@@ -44,9 +44,14 @@ class ThreadingMapThread(threading.Thread, DocumentMapProcessMixin):
         self.no_more_inputs.set()
 
     def run(self):
+        fused_stages = self.executor.fused_stages
+        stage_workers = None
         try:
             # Run any startup routine that the subclass has defined
             self.set_up()
+            if fused_stages is not None:
+                # Earlier filters' processing is done here too, before our own
+                stage_workers = fused_stages.start_workers()
             # Notify waiting processes that we've finished initialization
             self.initialized.set()
             input_buffer = []
@@ -69,11 +74,20 @@ class ThreadingMapThread(threading.Thread, DocumentMapProcessMixin):
                         for archive, filename, docs in inputs:
                             input_buffer.append(tuple([archive, filename] + docs))
                         if len(input_buffer) >= self.docs_per_batch or self.no_more_inputs.is_set():
-                            results = self.process_documents(input_buffer)
-                            for input_tuple, result in zip(input_buffer, results):
-                                self.output_queue.put(ProcessOutput(input_tuple[0], input_tuple[1], result))
+                            if stage_workers is None:
+                                results = self.process_documents(input_buffer)
+                            else:
+                                results = self.process_documents(
+                                    fused_stages.process_documents(stage_workers, input_buffer)
+                                )
+                            self.output_queue.put([
+                                ProcessOutput(input_tuple[0], input_tuple[1], result)
+                                for input_tuple, result in zip(input_buffer, results)
+                            ])
                             input_buffer = []
             finally:
+                if stage_workers is not None:
+                    fused_stages.stop_workers(stage_workers)
                 self.tear_down()
         except Exception as e:
             # If there's any uncaught exception, make it available to the main process
@@ -176,13 +190,37 @@ class ThreadingMapModuleExecutor(DocumentMapModuleExecutor):
     def create_pool(self, processes):
         return self.POOL_TYPE(self, processes)
 
+    def create_inline_worker(self, processes):
+        if processes == 1:
+            # A single thread would just be taking it in turns with the main thread
+            return create_inline_worker(self.POOL_TYPE.THREAD_TYPE, self)
+        return None
+
     def postprocess(self, error=False):
-        self.pool.shutdown()
+        # There's no pool if the documents were processed inline
+        if self.pool is not None:
+            self.pool.shutdown()
 
     def wait_until_finished(self):
         self.pool.wait_until_finished()
 
 
+def create_inline_worker(thread_type, executor):
+    """
+    Create an instance of a worker thread type that isn't run as a thread: instead, its
+    `process_documents()` is called directly from the main thread. See
+    :meth:`~pimlico.core.modules.map.DocumentMapModuleExecutor.create_inline_worker`.
+
+    """
+    class InlineWorker(thread_type):
+        def start(self):
+            # Don't start a thread
+            pass
+
+    InlineWorker.__name__ = "Inline{}".format(thread_type.__name__)
+    return InlineWorker(None, None, None, executor)
+
+
 def threading_executor_factory(process_document_fn, preprocess_fn=None, postprocess_fn=None,
                                worker_set_up_fn=None, worker_tear_down_fn=None, allow_skip_output=False,
                                sequential_start=False):
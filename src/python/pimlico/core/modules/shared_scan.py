@@ -0,0 +1,234 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Sharing a single scan of an input corpus between several modules executed at the same time.
+
+When several modules that are ready to run all read the same corpus, each of them normally
+reads and decodes all of its archives. Instead, they can be executed together, each in its
+own thread, while a single scanner thread iterates over the corpus once and passes each
+document out to all of them.
+
+Each consuming module has its own bounded buffer of documents waiting for it. When the
+buffer is full, the scanner waits for the module to catch up, so the scan only goes as
+fast as the slowest of the modules and the amount of data held in memory stays bounded.
+
+Only a module's first complete iteration over the corpus is served by the shared scan. If
+it iterates over the corpus again, or reads only part of it (e.g. when resuming execution
+part-way through), it reads the corpus itself, just as it would otherwise.
+
+Used by the `run` command's `--shared-scan` option. See :doc:`/core/local_config` for the
+`shared_scan_buffer` setting.
+
+"""
+from __future__ import absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+
+import threading
+from collections import OrderedDict
+from queue import Queue, Empty, Full
+
+from pimlico.core.modules.base import satisfies_typecheck
+from pimlico.core.modules.execute import ModuleExecutionError, check_execution_stopped
+from pimlico.datatypes.corpora import GroupedCorpus
+
+
+class SharedScan(object):
+    """
+    A single scan of a module output, whose documents are passed out to several consuming modules.
+
+    :param source: name of the module and output being read, for reporting
+    :param pipeline: pipeline whose modules are reading the scan
+    :param buffer_size: maximum number of documents waiting to be read by each consumer
+    """
+    #: Number of documents sent to the consumers together
+    batch_size = 50
+
+    def __init__(self, source, pipeline, buffer_size=1000):
+        self.source = source
+        self.pipeline = pipeline
+        self.queue_size = max(1, buffer_size // self.batch_size)
+        self.consumers = []
+        self._start_lock = threading.Lock()
+        self._scanner = None
+
+    def add_consumer(self, module_name):
+        consumer = ScanConsumer(self, module_name, Queue(maxsize=self.queue_size))
+        self.consumers.append(consumer)
+        return consumer
+
+    def _start(self, archive_iter):
+        with self._start_lock:
+            if self._scanner is None:
+                self._scanner = threading.Thread(target=self._scan, args=(archive_iter,),
+                                                 name="shared-scan-{}".format(self.source))
+                self._scanner.start()
+
+    def _scan(self, archive_iter):
+        docs = iter(archive_iter())
+        try:
+            batch = []
+            for item in docs:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    if not self._send(batch):
+                        # Nobody's reading any more
+                        return
+                    batch = []
+            if len(batch):
+                self._send(batch)
+            self._send(_END)
+        except Exception as e:
+            self._send(ModuleExecutionError("error reading shared input {}: {}".format(self.source, e), cause=e))
+        finally:
+            if hasattr(docs, "close"):
+                docs.close()
+
+    def _send(self, item):
+        """
+        Give an item to every consumer still reading, waiting until each has room for it.
+        Returns False if there are no consumers left to send to.
+
+        """
+        sent = False
+        for consumer in self.consumers:
+            while not consumer.detached:
+                try:
+                    consumer.queue.put(item, timeout=0.1)
+                except Full:
+                    # Go round again to check whether the consumer's stopped reading
+                    continue
+                else:
+                    sent = True
+                    break
+        return sent
+
+
+class ScanConsumer(object):
+    """
+    A module's subscription to a :class:`SharedScan`. Install on the module's readers for the
+    shared input using :meth:`attach`.
+
+    """
+    def __init__(self, scan, module_name, queue):
+        self.scan = scan
+        self.module_name = module_name
+        self.queue = queue
+        self.started = False
+        self.detached = False
+
+    def attach(self, reader):
+        """
+        Make the given reader's iteration over the corpus come from the shared scan. Later iterations,
+        or any that don't iterate over the whole corpus, use the reader's own iteration.
+
+        """
+        direct_archive_iter = reader.archive_iter
+
+        def archive_iter(start_after=None, skip=None, name_filter=None, **kwargs):
+            if not self.started and not self.detached and \
+                    start_after is None and skip is None and name_filter is None and len(kwargs) == 0:
+                self.started = True
+                return self._iter_shared(direct_archive_iter)
+            elif not self.started:
+                # Not reading the whole corpus: the scan shouldn't wait for us
+                self.detach()
+            return direct_archive_iter(start_after=start_after, skip=skip, name_filter=name_filter, **kwargs)
+
+        reader.archive_iter = archive_iter
+        # Modules should receive the documents from the scan, not read slices or stored records of the
+        #  corpus themselves
+        if hasattr(reader, "supports_archive_slices"):
+            reader.supports_archive_slices = lambda: False
+        if hasattr(reader, "supports_raw_records"):
+            reader.supports_raw_records = lambda: False
+
+    def _iter_shared(self, direct_archive_iter):
+        self.scan._start(direct_archive_iter)
+        try:
+            while True:
+                # Stop if execution has been interrupted
+                check_execution_stopped(self.scan.pipeline)
+                try:
+                    item = self.queue.get(timeout=0.1)
+                except Empty:
+                    continue
+                if item is _END:
+                    return
+                elif isinstance(item, Exception):
+                    raise item
+                for doc_item in item:
+                    yield doc_item
+        finally:
+            self.detach()
+
+    def detach(self):
+        """
+        Stop receiving documents from the scan. Called once the module has finished reading, or
+        has finished executing.
+
+        """
+        self.detached = True
+
+
+# Sent to the consumers once the scan is complete
+_END = object()
+
+
+def find_shared_scans(modules):
+    """
+    Find groups of modules that are ready to run and read the same input corpus, which can be executed
+    together sharing a single scan of the input.
+
+    Each module is only put in one group, for the input that the most modules share, so that no module
+    depends on more than one scan, which could leave the scans waiting for each other. A group never
+    contains a module that depends on another in the group. If a module has more than one input
+    connected to the same corpus, only the first reads it from the scan: the others read it as usual.
+
+    :param modules: loaded ModuleInfos, in the order they are to be executed
+    :return: ordered dict mapping `(module name, output name)` of each shared input to a list of
+        `(module, input name)` pairs that read it, in execution order
+    """
+    candidates = OrderedDict()
+    for module in modules:
+        if len(module.missing_data()):
+            # Not ready to run until other modules have been run
+            continue
+        for input_name in module.input_names:
+            if module.is_multiple_input(input_name) or \
+                    not satisfies_typecheck(module.get_input_datatype(input_name), GroupedCorpus()):
+                continue
+            previous_module, output_name = module.get_input_module_connection(input_name)
+            if output_name is None:
+                output_name = previous_module.default_output_name
+            candidates.setdefault((previous_module.module_name, output_name), []).append((module, input_name))
+
+    groups = OrderedDict()
+    grouped = set()
+    # Form the biggest groups first
+    for source, readers in sorted(candidates.items(),
+                                  key=lambda item: -len(set(module.module_name for (module, __) in item[1]))):
+        group = []
+        for module, input_name in readers:
+            if module.module_name in grouped or any(other is module for (other, __) in group) or \
+                    any(other.module_name in module.get_transitive_dependencies() or
+                        module.module_name in other.get_transitive_dependencies() for (other, __) in group):
+                continue
+            group.append((module, input_name))
+        if len(group) > 1:
+            groups[source] = group
+            grouped.update(module.module_name for (module, __) in group)
+    return groups
+
+
+def get_shared_scan_buffer(pipeline):
+    """
+    Number of documents that may be waiting for each module in a shared scan, from the
+    `shared_scan_buffer` local config setting.
+
+    """
+    return int(pipeline.local_config.get("shared_scan_buffer", "1000"))
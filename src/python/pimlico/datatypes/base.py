@@ -29,6 +29,7 @@ from collections import OrderedDict
 
 from pimlico.core.modules.options import process_module_options
 from pimlico.utils.core import cached_property
+from pimlico.utils.filesystem import write_file_atomically
 
 __all__ = [
     "PimlicoDatatype",
@@ -653,6 +654,17 @@ class PimlicoDatatype(with_metaclass(PimlicoDatatypeMeta, object)):
                 """
                 return any(self._paths_ready)
 
+            def being_written(self):
+                """
+                Check whether the data is currently being written, so is not yet ready to read. Datatypes
+                whose data can be read while it's still being written (see
+                :meth:`~pimlico.datatypes.corpora.grouped.GroupedCorpus.Reader.Setup.follow`) override this.
+
+                The base implementation always returns False.
+
+                """
+                return False
+
             def get_required_paths(self):
                 """
                 May be overridden by subclasses to provide a list of paths (absolute, or
@@ -910,13 +922,10 @@ class PimlicoDatatype(with_metaclass(PimlicoDatatypeMeta, object)):
 
         @staticmethod
         def _write_metadata(metadata_path, metadata):
-            with open(metadata_path, "w") as f:
-                # We used to pickle the metadata dictionary, but now we store it as JSON, so it's readable
-                json.dump(metadata, f)
-                # Make sure that the file doesn't get buffered anywhere, but is fully written to disk now
-                # We need to be sure that the up-to-date metadata is available immediately
-                f.flush()
-                os.fsync(f.fileno())
+            # We used to pickle the metadata dictionary, but now we store it as JSON, so it's readable
+            # The metadata may be read while the corpus is still being written (e.g. by a module following
+            #  this one's output), so the file is replaced in one go, never left partially written
+            write_file_atomically(metadata_path, json.dumps(metadata))
 
         def __repr__(self):
             return "Writer({}: {})".format(self.datatype.full_datatype_name(), self.base_dir)
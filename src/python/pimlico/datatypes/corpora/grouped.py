@@ -7,8 +7,10 @@ from __future__ import print_function
 
 from future import standard_library
 
+from pimlico.utils.compression import get_codec, GzipCodec, CodecSpecError, CodecThreadPool, NoCompression
 from pimlico.utils.pimarc import PimarcReader, PimarcWriter
-from pimlico.utils.pimarc.reader import StartAfterFilenameNotFound
+from pimlico.utils.pimarc.reader import StartAfterFilenameNotFound, PimarcPrefetcher, PimarcTailReader
+from pimlico.utils.pimarc.index import truncate as truncate_pimarc
 from pimlico.utils.pimarc.tar import PimarcTarBackend
 
 standard_library.install_aliases()
@@ -17,18 +19,18 @@ from builtins import next
 from builtins import object
 from builtins import bytes
 
-import gzip
+import json
 import os
-import zlib
-from io import StringIO, BytesIO
+from time import sleep
 
-from pimlico.datatypes.base import DynamicOutputDatatype
+from pimlico.datatypes.base import DynamicOutputDatatype, DatatypeWriteError
 from pimlico.datatypes.corpora import IterableCorpus, DataPointType
 from pimlico.datatypes.corpora.data_points import is_invalid_doc
+from pimlico.utils.filesystem import parse_file_size
 
 __all__ = [
-    "GroupedCorpus", "AlignedGroupedCorpora",
-    "CorpusAlignmentError", "GroupedCorpusIterationError",
+    "GroupedCorpus", "AlignedGroupedCorpora", "RawDocumentRecord", "supports_raw_records", "supports_archive_slices",
+    "is_following", "CorpusAlignmentError", "GroupedCorpusIterationError",
     "GroupedCorpusWithTypeFromInput", "CorpusWithTypeFromInput"
 ]
 
@@ -40,6 +42,9 @@ class GroupedCorpus(IterableCorpus):
 
     class Reader(object):
         class Setup(object):
+            #: Module writing the corpus, if it's to be read while it's still being written: see :meth:`follow`
+            followed_module = None
+
             def data_ready(self, base_dir):
                 # Run the superclass check -- that the data dir exists
                 if not super(GroupedCorpus.Reader.Setup, self).data_ready(base_dir):
@@ -49,10 +54,34 @@ class GroupedCorpus(IterableCorpus):
                 if metadata["length"] > 0 and not self._has_archives(self._get_data_dir(base_dir)):
                     return False
                 # Check whether the corpus is marked as being currently written to
-                if "writing" in metadata and metadata["writing"]:
+                # If we're following the writing, that's fine
+                if "writing" in metadata and metadata["writing"] and self.followed_module is None:
                     return False
                 return True
 
+            def being_written(self):
+                for base_dir in self.data_paths:
+                    if super(GroupedCorpus.Reader.Setup, self).data_ready(base_dir) and \
+                            self.read_metadata(base_dir).get("writing", False):
+                        return True
+                return False
+
+            def follow(self, module):
+                """
+                Allow the corpus to be read while it's still being written by the given module, which
+                should be currently executing. The reader then reads the documents as they're written,
+                waiting for more to arrive until the module has finished writing the corpus. If the
+                module fails, or stops executing before it's finished writing, iterating over the corpus
+                raises a :class:`GroupedCorpusIterationError`.
+
+                Used when running modules with the `run` command's `--follow` option.
+
+                :param module: ModuleInfo of the module writing the corpus
+                """
+                self.followed_module = module
+                # Check again whether the data's ready, now that it doesn't need to have finished being written
+                self.__dict__.pop("_paths_ready", None)
+
             @classmethod
             def _get_archive_filenames(cls, data_dir):
                 return list(cls._iter_archive_filenames(data_dir))
@@ -94,20 +123,44 @@ class GroupedCorpus(IterableCorpus):
                 else:
                     return True
 
+        #: Module that's still writing the corpus, if we're following the writing: see :meth:`Setup.follow`
+        followed_module = None
+
         def __init__(self, *args, **kwargs):
             super(GroupedCorpus.Reader, self).__init__(*args, **kwargs)
             # Read in the archive filenames, which are stored as tar files
-            self.archive_filenames = self.setup._get_archive_filenames(self.data_dir)
-            self.archive_filenames.sort()
-            self.archives = [os.path.splitext(os.path.basename(f))[0] for f in self.archive_filenames]
-            self.archive_to_archive_filename = dict(zip(self.archives, self.archive_filenames))
+            self._list_archives()
             # Whether this corpus uses Pimarc (prc) files or tar
             self.uses_tar = not self.setup._uses_prc(self.data_dir)
+            # Once the corpus has been completely read, it's read in the normal way
+            self.followed_module = self.setup.followed_module if self.metadata.get("writing", False) else None
+            # Seconds to wait between checks for more data while following
+            self.follow_poll_interval = _get_follow_poll_interval(self.pipeline)
 
             # Cache the last-used archive
             self._last_used_archive = None
             self._last_used_archive_name = None
 
+            # Number of threads to use to decompress documents while iterating over a compressed corpus
+            # 0 means decompress on the iterating thread
+            # Set by default from the local config, but may be set on the reader or given to archive_iter()
+            self.io_threads = _get_io_threads(self.pipeline)
+            # Number of bytes to read ahead from the start of the next archive in the background while
+            # iterating over the corpus. 0 means don't open the next archive before we get to it
+            self.archive_read_ahead = _get_archive_read_ahead(self.pipeline)
+            # Whether to memory-map the archives instead of reading them through file objects
+            self.use_mmap = _get_pimarc_mmap(self.pipeline)
+            # Next archive being opened in the background while iterating: (archive name, prefetcher)
+            self._prefetched_archive = None
+            # Archive opened for reading slices of the corpus: (archive name, reader, codec)
+            self._slice_archive = None
+
+        def _list_archives(self):
+            self.archive_filenames = self.setup._get_archive_filenames(self.data_dir)
+            self.archive_filenames.sort()
+            self.archives = [os.path.splitext(os.path.basename(f))[0] for f in self.archive_filenames]
+            self.archive_to_archive_filename = dict(zip(self.archives, self.archive_filenames))
+
         def get_archive(self, archive_name):
             """
             Return a `PimarcReader` for the named archive, or, if using the tar backend, a
@@ -118,11 +171,18 @@ class GroupedCorpus(IterableCorpus):
                     self._last_used_archive.closed:
                 archive_filename = self.archive_to_archive_filename[archive_name]
                 archive_path = os.path.join(self.data_dir, archive_filename)
-                if archive_filename.endswith(".tar"):
-                    # Use the tar backend for backwards compatibility
-                    arc = PimarcTarBackend(archive_path)
-                else:
-                    arc = PimarcReader(archive_path)
+                arc = None
+                if self._prefetched_archive is not None and self._prefetched_archive[0] == archive_name:
+                    # This archive has already been opened in the background
+                    arc = self._prefetched_archive[1].get()
+                    self._prefetched_archive = None
+
+                if arc is None:
+                    if archive_filename.endswith(".tar"):
+                        # Use the tar backend for backwards compatibility
+                        arc = PimarcTarBackend(archive_path)
+                    else:
+                        arc = PimarcReader(archive_path, use_mmap=self.use_mmap)
 
                 # Close the cached archive
                 if self._last_used_archive is not None:
@@ -134,6 +194,33 @@ class GroupedCorpus(IterableCorpus):
             # Used the cached archive
             return self._last_used_archive
 
+        def prefetch_archive(self, archive_name):
+            """
+            Start opening the named archive in the background, so that it's ready when
+            `get_archive()` is called for it. Also reads ahead the first `archive_read_ahead`
+            bytes of the archive, so that they're in the OS's cache when we start reading.
+
+            Only one archive is prefetched at once: any previously prefetched archive that
+            hasn't been used is closed. Does nothing for tar archives.
+
+            """
+            self.cancel_prefetch()
+            archive_filename = self.archive_to_archive_filename[archive_name]
+            if archive_filename.endswith(".tar"):
+                return
+            archive_path = os.path.join(self.data_dir, archive_filename)
+            self._prefetched_archive = (archive_name, PimarcPrefetcher(archive_path, read_ahead=self.archive_read_ahead,
+                                                                       use_mmap=self.use_mmap))
+
+        def cancel_prefetch(self):
+            """
+            Close any archive that was prefetched, but hasn't been used.
+
+            """
+            if self._prefetched_archive is not None:
+                self._prefetched_archive[1].cancel()
+                self._prefetched_archive = None
+
         def extract_file(self, archive_name, filename):
             """
             Extract an individual file by archive name and filename.
@@ -152,7 +239,25 @@ class GroupedCorpus(IterableCorpus):
 
             """
             __, file_data = self.get_archive(archive_name)[filename]
-            return file_data
+            return self.get_archive_codec(archive_name).decompress(file_data)
+
+        def get_archive_codec(self, archive_name):
+            """
+            Get the compression codec (see :mod:`pimlico.utils.compression`) used to compress
+            the documents in the named archive.
+
+            The codec used for each archive is recorded in the corpus metadata. Corpora written
+            before compression codecs were introduced are either uncompressed, or gzipped
+            (with the `gzip` metadata option).
+
+            """
+            archive_compression = self.metadata.get("archive_compression", {})
+            if archive_name in archive_compression:
+                return get_codec(archive_compression[archive_name])
+            elif self.metadata.get("gzip", False):
+                return GzipCodec(9)
+            else:
+                return get_codec(self.metadata.get("compression", "none"))
 
         def __iter__(self):
             return self.doc_iter()
@@ -161,11 +266,16 @@ class GroupedCorpus(IterableCorpus):
             for __, doc_name, doc in self.archive_iter(start_after=start_after, skip=skip, name_filter=name_filter):
                 yield doc_name, doc
 
-        def archive_iter(self, start_after=None, skip=None, name_filter=None):
+        def archive_iter(self, start_after=None, skip=None, name_filter=None, io_threads=None):
             """
             Iterate over corpus archive by archive, yielding for each document the archive name,
             the document name and the document itself.
 
+            If the corpus is compressed, documents can be decompressed by a pool of threads,
+            while the main thread continues reading from the archive. The codecs release the
+            GIL, so this speeds up iteration over compressed corpora when multiple cores are
+            available. Documents are still yielded in the same order.
+
             :param name_filter: if given, should be a callable that takes two args, an archive name and
                 document name, and returns True if the document should be yielded and False if it should be skipped.
                 This can be preferable to filtering the yielded documents, as it skips all document pre-processing
@@ -175,7 +285,158 @@ class GroupedCorpus(IterableCorpus):
                 is reached. Should be specified as a pair (archive name, doc name)
             :param skip: skips over the first portion of the corpus, until this number of documents have
                 been seen
+            :param io_threads: number of threads to use to decompress documents. By default, uses the
+                reader's `io_threads` attribute, which is set from the `io_threads` local config setting.
+                0 means decompress the documents in the iterating thread
+
+            If the reader's `archive_read_ahead` attribute is set (from the `archive_read_ahead`
+            local config setting), each archive is opened in the background while the previous
+            one is being read, and its first `archive_read_ahead` bytes are prefetched.
+            """
+            if io_threads is None:
+                io_threads = self.io_threads
+            if io_threads and self.is_compressed():
+                decompress_pool = CodecThreadPool(io_threads)
+            else:
+                decompress_pool = None
+
+            try:
+                for archive_name, doc_name, document in self._archive_iter(
+                        start_after=start_after, skip=skip, name_filter=name_filter, decompress_pool=decompress_pool):
+                    yield archive_name, doc_name, document
+            finally:
+                if decompress_pool is not None:
+                    decompress_pool.close()
+                self.cancel_prefetch()
+
+        def supports_raw_records(self):
+            """
+            Check whether :meth:`raw_archive_iter` can be used to read the documents' stored data.
+            This is not the case for readers that produce their documents in some other way, for
+            example the output of filter modules, or corpora combined from others, which override
+            :meth:`archive_iter`.
+
+            """
+            return _unbound(type(self).archive_iter) is _unbound(GroupedCorpus.Reader.archive_iter)
+
+        def raw_archive_iter(self, start_after=None, skip=None, name_filter=None):
+            """
+            Like :meth:`archive_iter`, but yields the stored records, without decompressing the
+            documents or instantiating document objects. For each document, yields the archive name,
+            the document name and a :class:`RawDocumentRecord`.
+
+            This is much faster where documents are just being copied from one corpus to another,
+            as the records can be passed straight to the writer's
+            :meth:`~GroupedCorpus.Writer.add_raw_record`.
+
+            Check :meth:`supports_raw_records` before using this.
+
+            """
+            if not self.supports_raw_records():
+                raise GroupedCorpusIterationError("{} does not support iterating over raw records".format(
+                    type(self).__name__))
+            try:
+                for archive_name, doc_name, record in self._archive_iter(
+                        start_after=start_after, skip=skip, name_filter=name_filter, raw=True):
+                    yield archive_name, doc_name, record
+            finally:
+                self.cancel_prefetch()
+
+        def supports_archive_slices(self):
+            """
+            Check whether the corpus can be read in slices, using :meth:`archive_slice_iter` and
+            :meth:`read_archive_slice`. This requires the stored documents to be read directly
+            (see :meth:`supports_raw_records`) from Pimarc archives.
+
+            """
+            return self.supports_raw_records() and not self.uses_tar and self.followed_module is None
+
+        def archive_slice_iter(self, slice_size, start_after=None):
+            """
+            Divide the corpus into slices of up to `slice_size` consecutive documents from the same
+            archive. Only the archives' indexes are read, not the documents. For each slice, yields
+            the archive name, a list of the document names and the start and end byte of the slice's
+            records in the archive. These can be passed to :meth:`read_archive_slice`, possibly in
+            a different process, to read the documents.
+
+            Check :meth:`supports_archive_slices` before using this.
+
+            :param start_after: skip over the first portion of the corpus, until the given document
+                is reached. Should be specified as a pair (archive name, doc name), as for :meth:`archive_iter`
             """
+            gzipped = self.metadata.get("gzip", False)
+            started = start_after is None
+            for archive_name in self.archives:
+                start_after_in_archive = None
+                if not started:
+                    if start_after[0] != archive_name:
+                        # Skip archives until we get to the one we're starting in
+                        continue
+                    started = True
+                    if start_after[1] is None:
+                        # Asked to start after an archive, but not given specific filename: start at the next one
+                        continue
+                    start_after_in_archive = start_after[1]
+
+                with self.get_archive(archive_name) as archive:
+                    doc_names = [_archive_doc_name(filename, gzipped) for filename in archive.index.keys()]
+                    start_bytes = [metadata_start for (metadata_start, data_start) in archive.index.values()]
+                    # The last record ends at the end of the archive
+                    start_bytes.append(os.path.getsize(archive.archive_filename))
+
+                first = 0
+                if start_after_in_archive is not None:
+                    try:
+                        first = doc_names.index(start_after_in_archive) + 1
+                    except ValueError:
+                        raise GroupedCorpusIterationError(
+                            "tried to start iteration over grouped corpus at document (%s, %s), but filename %s "
+                            "wasn't found in archive %s" %
+                            (start_after[0], start_after[1], start_after[1], archive_name)
+                        )
+
+                for slice_start in range(first, len(doc_names), slice_size):
+                    slice_end = min(slice_start + slice_size, len(doc_names))
+                    yield archive_name, doc_names[slice_start:slice_end], \
+                        start_bytes[slice_start], start_bytes[slice_end]
+
+        def read_archive_slice(self, archive_name, start_byte, end_byte, count):
+            """
+            Read the documents in a slice of the corpus produced by :meth:`archive_slice_iter`,
+            yielding the document name and document for each of the `count` documents, just as
+            :meth:`archive_iter` does.
+
+            The archive is opened separately from those used for normal iteration, so this may be
+            used in a process forked from one that is also reading the corpus. It is kept open for
+            reading further slices from the same archive: call :meth:`close_archive_slices` once
+            you've finished.
+
+            """
+            if self._slice_archive is None or self._slice_archive[0] != archive_name:
+                self.close_archive_slices()
+                archive_path = os.path.join(self.data_dir, self.archive_to_archive_filename[archive_name])
+                self._slice_archive = (archive_name, PimarcReader(archive_path, use_mmap=self.use_mmap),
+                                       self.get_archive_codec(archive_name))
+            __, archive, codec = self._slice_archive
+            gzipped = self.metadata.get("gzip", False)
+
+            for metadata, raw_data in archive.iter_files_at(start_byte, count, end_byte=end_byte):
+                yield _archive_doc_name(metadata["name"], gzipped), self.data_to_document(codec.decompress(raw_data))
+
+        def close_archive_slices(self):
+            """ Close any archive left open by :meth:`read_archive_slice`. """
+            if self._slice_archive is not None:
+                self._slice_archive[1].close()
+                self._slice_archive = None
+
+        def _archive_iter(self, start_after=None, skip=None, name_filter=None, decompress_pool=None, raw=False):
+            if self.followed_module is not None:
+                # The corpus is still being written: read the documents as they arrive
+                for item in self._follow_archive_iter(start_after=start_after, skip=skip, name_filter=name_filter,
+                                                      raw=raw):
+                    yield item
+                return
+
             gzipped = self.metadata.get("gzip", False)
             if skip is not None and skip < 1:
                 skip = None
@@ -186,7 +447,7 @@ class GroupedCorpus(IterableCorpus):
             started = start_after is None
             start_after_req = start_after
 
-            for archive_name in self.archives:
+            for archive_num, archive_name in enumerate(self.archives):
                 if not started and start_after is not None:
                     if start_after[0] == archive_name and start_after[1] is None:
                         # Asked to start after an archive, but not given specific filename
@@ -199,6 +460,7 @@ class GroupedCorpus(IterableCorpus):
                         continue
 
                 # Now we're either reading the whole of this archive, or starting after a filename in it
+                codec = self.get_archive_codec(archive_name)
                 with self.get_archive(archive_name) as archive:
                     skip_in_archive = None
                     start_after_in_archive = None
@@ -206,6 +468,10 @@ class GroupedCorpus(IterableCorpus):
                     if start_after is not None:
                         # If we've got this far, we're in the right archive, but need to skip past the filename
                         start_after_in_archive = start_after[1]
+                        if gzipped and isinstance(archive, PimarcReader) and \
+                                "{}.gz".format(start_after_in_archive) in archive.index:
+                            # The filename in the archive has the .gz extension, which isn't in the doc name
+                            start_after_in_archive = "{}.gz".format(start_after_in_archive)
                         start_after = None
                         started = True
                     elif skipped != -1:
@@ -223,32 +489,34 @@ class GroupedCorpus(IterableCorpus):
                             # Don't skip at all in future archives
                             skipped = -1
 
+                    if self.archive_read_ahead and archive_num + 1 < len(self.archives):
+                        # Start opening the next archive while we read this one
+                        self.prefetch_archive(self.archives[archive_num + 1])
+
                     try:
                         # Iterate over the files in the archive
-                        for metadata, raw_data in archive.iter_files(
-                                skip=skip_in_archive, start_after=start_after_in_archive):
-                            filename = metadata["name"]
-                            # By default, doc name is just the same as filename
-                            doc_name = filename
-                            if gzipped and doc_name.endswith(".gz"):
-                                # If we used the .gz extension while writing the file, remove it to get the doc name
-                                doc_name = doc_name[:-3]
-
-                            # If subsampling or filtering, decide whether to extract this file
-                            if name_filter is not None and not name_filter(archive_name, doc_name):
-                                # Reject this file
-                                continue
+                        archive_docs = self._iter_archive_raw_docs(
+                            archive, archive_name, gzipped, name_filter,
+                            skip=skip_in_archive, start_after=start_after_in_archive
+                        )
+                        if raw:
+                            # Just pass on the stored data, along with the codec needed to decompress it
+                            for doc_name, (metadata, raw_data) in archive_docs:
+                                yield archive_name, doc_name, RawDocumentRecord(metadata, raw_data, codec)
+                            continue
 
-                            if gzipped:
-                                if doc_name.endswith(".gz"):
-                                    # Gzipped document
-                                    with gzip.GzipFile(fileobj=BytesIO(raw_data), mode="rb") as gzip_file:
-                                        raw_data = gzip_file.read()
-                                else:
-                                    # For backwards-compatibility, where gzip=True, but the gz extension wasn't used, we
-                                    #  just decompress with zlib, without trying to parse the gzip headers
-                                    raw_data = zlib.decompress(raw_data)
+                        # Decompress the document's data, if it was compressed
+                        # For backwards-compatibility, where gzip=True, but the gz extension wasn't used, the
+                        #  gzip codec also decompresses zlib data without gzip headers
+                        archive_docs = ((doc_name, raw_data) for (doc_name, (__, raw_data)) in archive_docs)
+                        if decompress_pool is not None and not isinstance(codec, NoCompression):
+                            # Decompress in other threads, reading ahead in the archive
+                            archive_docs = decompress_pool.imap(codec.decompress, archive_docs)
+                        else:
+                            archive_docs = ((doc_name, codec.decompress(raw_data))
+                                            for (doc_name, raw_data) in archive_docs)
 
+                        for doc_name, raw_data in archive_docs:
                             # Apply subclass-specific post-processing and produce a document instance
                             document = self.data_to_document(raw_data)
 
@@ -264,6 +532,149 @@ class GroupedCorpus(IterableCorpus):
                             (start_after_req[0], start_after_req[1], start_after_req[1], archive_name)
                         )
 
+        def _follow_archive_iter(self, start_after=None, skip=None, name_filter=None, raw=False):
+            """
+            Iterate over the corpus while it's still being written by the followed module, yielding
+            each document once its record has been written to disk, like :meth:`_archive_iter`. When
+            there's nothing more to read yet, waits for `follow_poll_interval` seconds before checking
+            again.
+
+            The archives are expected to be written one at a time, in the order of their names, as
+            they are by all the standard writers. An archive is read up to the end once a later one
+            has been started or the module has finished writing the corpus.
+
+            """
+            gzipped = self.metadata.get("gzip", False)
+            module = self.followed_module
+            # -1 means don't skip anything, otherwise we accumulate how many we've skipped
+            skipped = -1 if skip is None or skip < 1 else 0
+            started = start_after is None
+            # Archives that we've finished reading
+            archives_read = set()
+            # The archive being read: (archive name, tail reader)
+            current = None
+
+            while True:
+                # Check this before looking for new data, so we can be sure we've read everything once it's finished
+                finished = not self.metadata.get("writing", False)
+                if not finished and not module.is_locked():
+                    # The module's no longer executing: check it didn't finish writing in the meantime
+                    if self.metadata.get("writing", False):
+                        raise GroupedCorpusIterationError(
+                            "module '{}' stopped executing before it finished writing the corpus being read"
+                            .format(module.module_name))
+                    continue
+
+                self._list_archives()
+                unread = [archive_name for archive_name in self.archives if archive_name not in archives_read]
+                if current is not None and unread[0] != current[0]:
+                    raise GroupedCorpusIterationError(
+                        "archive {} was added to the corpus being read after archive {}: cannot read corpus while "
+                        "it's being written if the archives are not written in order".format(unread[0], current[0]))
+
+                for archive_num, archive_name in enumerate(unread):
+                    # The archive's been closed if a later one has been started, or the writing's finished
+                    closed = finished or archive_num < len(unread) - 1
+
+                    if not started:
+                        if start_after[0] != archive_name:
+                            # Skip archives until we get to the one we're starting in
+                            archives_read.add(archive_name)
+                            continue
+                        elif start_after[1] is None:
+                            # Start at the beginning of the next archive
+                            archives_read.add(archive_name)
+                            started = True
+                            continue
+
+                    if current is None:
+                        current = (archive_name, PimarcTailReader(self.archive_to_archive_filename[archive_name]))
+                    codec = self.get_archive_codec(archive_name)
+
+                    for metadata, raw_data in current[1].read_new_files():
+                        doc_name = _archive_doc_name(metadata["name"], gzipped)
+                        if not started:
+                            # Skip documents until we get to the one we're starting after
+                            if doc_name == start_after[1]:
+                                started = True
+                            continue
+                        if skipped != -1:
+                            if skipped < skip:
+                                skipped += 1
+                                continue
+                            skipped = -1
+                        if name_filter is not None and not name_filter(archive_name, doc_name):
+                            continue
+
+                        if raw:
+                            yield archive_name, doc_name, RawDocumentRecord(metadata, raw_data, codec)
+                        else:
+                            yield archive_name, doc_name, self.data_to_document(codec.decompress(raw_data))
+
+                    if not closed:
+                        # Wait for more to be written to this archive
+                        break
+                    if not started:
+                        raise GroupedCorpusIterationError(
+                            "tried to start iteration over grouped corpus at document (%s, %s), but filename %s "
+                            "wasn't found in archive %s" % (start_after[0], start_after[1], start_after[1], archive_name)
+                        )
+                    archives_read.add(archive_name)
+                    current = None
+
+                if finished:
+                    break
+                sleep(self.follow_poll_interval)
+
+            # Make sure the module completed successfully: otherwise the corpus might be incomplete
+            while module.is_locked():
+                sleep(self.follow_poll_interval)
+            status = module.get_metadata(reload=True).get("status", "UNEXECUTED")
+            if status not in ("COMPLETE", "COMPLETE_PRELIMINARY"):
+                raise GroupedCorpusIterationError(
+                    "module '{}' did not complete writing the corpus being read (status {})".format(
+                        module.module_name, status))
+            # The corpus is now complete, so can be read in the normal way from now on
+            self.followed_module = None
+
+        def _iter_archive_raw_docs(self, archive, archive_name, gzipped, name_filter, skip=None, start_after=None):
+            """
+            Iterate over the documents in an open archive, yielding the doc name and the
+            file's metadata and raw (possibly compressed) data for each document that passes
+            the name filter.
+
+            With Pimarc archives, the name filter is applied to the names in the archive's index
+            and only the documents that pass it are read.
+
+            """
+            def _doc_name(filename):
+                return _archive_doc_name(filename, gzipped)
+
+            if name_filter is not None and isinstance(archive, PimarcReader):
+                # If subsampling or filtering, decide which files to extract using the index
+                files = archive.iter_files(skip=skip, start_after=start_after,
+                                           filename_filter=lambda filename: name_filter(archive_name, _doc_name(filename)))
+                for metadata, raw_data in files:
+                    yield _doc_name(metadata["name"]), (metadata, raw_data)
+                return
+
+            for metadata, raw_data in archive.iter_files(skip=skip, start_after=start_after):
+                doc_name = _doc_name(metadata["name"])
+
+                # If subsampling or filtering, decide whether to extract this file
+                if name_filter is not None and not name_filter(archive_name, doc_name):
+                    # Reject this file
+                    continue
+                yield doc_name, (metadata, raw_data)
+
+        def is_compressed(self):
+            """
+            Check whether any of the corpus' archives store compressed documents.
+
+            """
+            return any(not isinstance(self.get_archive_codec(archive_name), NoCompression)
+                       for archive_name in self.archives)
+
         def list_archive_iter(self):
             gzipped = self.metadata.get("gzip", False)
             for archive_name in self.archives:
@@ -307,7 +718,22 @@ class GroupedCorpus(IterableCorpus):
                 False,
                 "Gzip each document before adding it to the archive. Not the same as creating a tarball, "
                 "since the docs are gzipped *before* adding them, not the whole archive together, but means "
-                "we can easily iterate over the documents, unzipping them as required"
+                "we can easily iterate over the documents, unzipping them as required. Equivalent to "
+                "compression='gzip:9', but also adds '.gz' to the filenames in the archives. "
+                "Kept for backwards compatibility: use 'compression' instead"
+            ),
+            "compression": (
+                "none",
+                "Compression codec to apply to each document before adding it to the archive, specified as "
+                "'name' or 'name:level'. One of 'none', 'zlib', 'gzip', 'lzma' or 'bz2', e.g. 'zlib:3'. "
+                "Lower levels are faster, but give larger files. The codec is recorded for each archive "
+                "(in 'archive_compression'), so appending with a different codec does not affect the "
+                "archives already written"
+            ),
+            "archive_compression": (
+                {},
+                "Codec used to compress the documents in each archive. Set by the writer: any value given "
+                "is ignored"
             ),
         }
         writer_param_defaults = {
@@ -317,6 +743,29 @@ class GroupedCorpus(IterableCorpus):
                 "just added to the end. This is useful where we want to restart processing that was "
                 "broken off in the middle"
             ),
+            "name_header": (
+                None,
+                "Write new archives using the Pimarc record layout that stores each document's name "
+                "in its record header, instead of in the JSON metadata. This means that reading the corpus "
+                "doesn't require decoding JSON for every document. The layout is detected when reading, "
+                "so corpora using either layout can be read, but not by Pimlico releases from before the "
+                "layout was introduced. By default, uses the pimarc_name_header local config setting, or "
+                "False if it's not set"
+            ),
+            "io_threads": (
+                None,
+                "Number of threads to use to compress documents, if the corpus is compressed. Documents are "
+                "compressed in the background after add_document() returns, and written to the archives in "
+                "the order they were added. 0 means compress in the calling thread. By default, uses the "
+                "io_threads local config setting, or 0 if it's not set"
+            ),
+            "truncate_to": (
+                None,
+                "When appending, first remove all documents after this number of documents (in archive order), "
+                "including any partly written ones, and any archives after them. This is used when resuming "
+                "processing that was broken off, where documents may have been written after the number that "
+                "was recorded as completed"
+            ),
         }
 
         def __init__(self, *args, **kwargs):
@@ -324,14 +773,47 @@ class GroupedCorpus(IterableCorpus):
 
             # Set "gzip" in the metadata, so we know to unzip when reading
             self.gzip = self.metadata["gzip"]
+            if self.gzip:
+                if self.metadata["compression"] not in (None, "none"):
+                    raise DatatypeWriteError("grouped corpus writer got both gzip=True and compression='{}': "
+                                             "use just compression".format(self.metadata["compression"]))
+                # Old-style gzipping: use maximum compression
+                self.codec = GzipCodec(9)
+            else:
+                try:
+                    self.codec = get_codec(self.metadata["compression"])
+                except CodecSpecError as e:
+                    raise DatatypeWriteError("invalid compression for grouped corpus: {}".format(e))
+            # Store the normalized codec specification
+            self.metadata["compression"] = "none" if self.gzip else self.codec.spec
+            # Record which codec was used for each archive
+            self.metadata["archive_compression"] = {}
             self.append = self.params["append"]
+            self.name_header = self.params["name_header"]
+            if self.name_header is None:
+                self.name_header = _get_pimarc_name_header(self.pipeline)
 
             self.current_archive_name = None
             self.current_archive = None
+            # Archive and codec of the last document added, which may not have been written yet
+            self.current_codec_archive_name = None
+            self.current_codec = None
+
+            io_threads = self.params["io_threads"]
+            if io_threads is None:
+                io_threads = _get_io_threads(self.pipeline)
+            if io_threads and not isinstance(self.codec, NoCompression):
+                self.compress_pool = CodecThreadPool(io_threads)
+            else:
+                self.compress_pool = None
 
             self.metadata["length"] = 0
 
             if self.append:
+                # Keep the record of the codecs used for the archives already written
+                self.metadata["archive_compression"] = self._read_written_archive_compression()
+                if self.params["truncate_to"] is not None:
+                    self.truncate_archives(self.params["truncate_to"])
                 # Shouldn't rely on the metadata: count up docs in archive to get initial length
                 # This can take a long time on a large corpus
                 self.metadata["length"] = self._count_written_docs()
@@ -355,7 +837,45 @@ class GroupedCorpus(IterableCorpus):
                 in the doc object's metadata. If doc is a bytes object, the metadata kwarg is used
             :param archive_name: archive name
             :param doc_name: name of document
-            :param doc: document instance or bytes object containing document's raw data
+            :param doc: document instance or bytes object containing document's raw data (or memoryview)
+            """
+            data, metadata = self._document_data(doc, metadata)
+
+            self._start_codec_archive(archive_name)
+            filename = self._doc_filename(doc_name)
+
+            # Add a new document to archive
+            # Compress the data using the codec for this archive (does nothing if not using compression)
+            if self.compress_pool is not None:
+                # Compress in the background and write out any docs that are ready, in order
+                self.compress_pool.submit(self.current_codec.compress, data, key=(archive_name, filename, metadata))
+                self._write_compressed(self.compress_pool.iter_ready())
+            else:
+                self._write_file(archive_name, filename, self.current_codec.compress(data), metadata)
+
+            # Keep a count of how many we've added so we can write metadata
+            self.doc_count += 1
+
+        def encode_document(self, archive_name, doc_name, doc, metadata=None):
+            """
+            Prepare a document for adding to the named archive in exactly the way that
+            :meth:`add_document` does, but return the result instead of writing it. This allows the
+            work of encoding and compressing documents to be done somewhere else, for example by
+            document map worker processes, which write the documents to their own archives. They can
+            then be added to this corpus using :meth:`copy_record`.
+
+            The document is not counted as having been added to the corpus.
+
+            :return: tuple `(filename, data, metadata)`, where `data` is the compressed data to store
+            """
+            data, metadata = self._document_data(doc, metadata)
+            self._start_codec_archive(archive_name)
+            return self._doc_filename(doc_name), self.current_codec.compress(data), metadata
+
+        def _document_data(self, doc, metadata):
+            """
+            Get the raw data and metadata to store for a document given to :meth:`add_document`.
+
             """
             # A document instance provides access to the raw data for a document as a bytes (Py3) or string (Py2)
             # If it's not directly available, it will be converted when we try to retrieve the raw data
@@ -368,7 +888,8 @@ class GroupedCorpus(IterableCorpus):
                 if type(doc) is dict:
                     data = self.datatype.data_point_type(**doc).raw_data
                 # If a bytes object is given, we assume that's the doc's raw data
-                elif type(doc) is bytes:
+                # A memoryview (e.g. read from an mmapped archive) is treated in the same way
+                elif type(doc) is bytes or type(doc) is memoryview:
                     data = doc
                 elif not isinstance(doc, DataPointType.Document):
                     # If not, we kick up a fuss, as we've presumably been given something that's not a valid document
@@ -404,38 +925,135 @@ class GroupedCorpus(IterableCorpus):
                                 "This is probably a result of the Python 2-3 conversion. (Error: {})".format(
                     self.datatype.data_point_type.name, type(data).__name__, e
                 ))
+            return data, metadata
 
-            if archive_name != self.current_archive_name:
-                # Starting a new archive
-                if self.current_archive is not None:
-                    # Close the old one
-                    self.current_archive.close()
-                self.current_archive_name = archive_name
-                arc_filename = os.path.join(self.data_dir, "{}.prc".format(archive_name))
-                # If we're appending a corpus and the archive already exists, append to it
-                self.current_archive = PimarcWriter(arc_filename,
-                                                    mode="a" if self.append and os.path.exists(arc_filename) else "w")
+        def add_raw_record(self, archive_name, doc_name, record):
+            """
+            Add a document given as a raw record, as read from another grouped corpus using
+            :meth:`GroupedCorpus.Reader.raw_archive_iter`. This is a fast path for modules that
+            copy documents from one corpus to another without changing them.
 
-            # Add a new document to archive
+            If the record's data is compressed with the same codec that this writer is using for
+            the archive (including if neither is compressed), the data is written unchanged,
+            without decompressing it or creating a document. Otherwise, the data is decompressed
+            and compressed again with this writer's codec. The record's metadata is also copied
+            without decoding it where possible.
+
+            :param archive_name: archive name
+            :param doc_name: name of document
+            :param record: :class:`RawDocumentRecord`
+            """
+            self._start_codec_archive(archive_name)
+            filename = self._doc_filename(doc_name)
+            codec = self.current_codec
+
+            if record.codec.spec == codec.spec:
+                # No need to recompress: just copy the data
+                if self.compress_pool is not None:
+                    # Any docs still being compressed need to be written before this one
+                    self._write_compressed(self.compress_pool.iter_all())
+                self._write_file(archive_name, filename, record.data, record.metadata)
+            else:
+                # Decompress with the codec the record was stored with, then compress with ours
+                record_codec = record.codec
+
+                def _transcode(data):
+                    return codec.compress(record_codec.decompress(data))
+
+                if self.compress_pool is not None:
+                    self.compress_pool.submit(_transcode, record.data, key=(archive_name, filename, record.metadata))
+                    self._write_compressed(self.compress_pool.iter_ready())
+                else:
+                    self._write_file(archive_name, filename, _transcode(record.data), record.metadata)
+
+            self.doc_count += 1
+
+        def copy_record(self, archive_name, doc_name, source_file, metadata_start, data_start, end,
+                        source_name_header=False):
+            """
+            Add a document by copying its record byte-for-byte from another Pimarc archive, given the
+            position of the record in the archive's file. The record must have been written using
+            the name and data returned by :meth:`encode_document`, so that it is compressed with
+            the codec this writer uses for the archive.
+
+            This is used to collect the documents that document map worker processes have written
+            to their own archives: see :mod:`pimlico.core.modules.map.shards`.
+
+            :param archive_name: archive name
+            :param doc_name: name of document
+            :param source_file: the other archive's file, opened for reading in binary mode
+            :param source_name_header: True if the other archive uses the name-header record layout
+            """
+            self._start_codec_archive(archive_name)
+            if self.compress_pool is not None:
+                # Any docs still being compressed need to be written before this one
+                self._write_compressed(self.compress_pool.iter_all())
+            self._open_archive(archive_name)
+            self.current_archive.copy_record(source_file, self._doc_filename(doc_name), metadata_start, data_start,
+                                             end, source_name_header=source_name_header)
+            self.doc_count += 1
+
+        def _start_codec_archive(self, archive_name):
+            if archive_name != self.current_codec_archive_name:
+                # Starting a new archive: choose the codec to compress its docs with
+                self.current_codec_archive_name = archive_name
+                self.current_codec = self._get_archive_codec(archive_name)
+
+        def _doc_filename(self, doc_name):
             if self.gzip:
-                # We used to just use zlib to compress, which works fine, but it's not easy to open the files manually
-                # Using gzip (i.e. writing gzip headers) makes it easier to use the data outside Pimlico
-                gzip_io = StringIO()
-                with gzip.GzipFile(mode="wb", compresslevel=9, fileobj=gzip_io) as gzip_file:
-                    gzip_file.write(data)
-                data = gzip_io.getvalue()
-                filename = "{}.gz".format(doc_name)
+                # Old-style gzipped corpora also mark the filenames as gzipped
+                return "{}.gz".format(doc_name)
             else:
-                filename = doc_name
+                return doc_name
+
+        def _get_archive_codec(self, archive_name):
+            """
+            Choose the codec to compress the docs in a new archive with and record it in the metadata.
+
+            """
+            arc_filename = os.path.join(self.data_dir, "{}.prc".format(archive_name))
+            archive_compression = self.metadata["archive_compression"]
+            if self.append and os.path.exists(arc_filename) and archive_name in archive_compression:
+                # Keep using the codec that the archive was written with
+                return get_codec(archive_compression[archive_name])
+            else:
+                archive_compression[archive_name] = self.codec.spec
+                return self.codec
+
+        def _write_compressed(self, compressed_docs):
+            for (archive_name, filename, metadata), data in compressed_docs:
+                self._write_file(archive_name, filename, data, metadata)
+
+        def _write_file(self, archive_name, filename, data, metadata):
+            """
+            Write a document's (compressed) data to the named archive, opening a new archive if necessary.
+
+            """
+            self._open_archive(archive_name)
 
             # Append this document's data to the Pimarc
+            # If the metadata was read from another archive, it's copied without decoding where possible
             self.current_archive.write_file(data, name=filename, metadata=metadata)
             # We used to flush after every write, but it's very slow
             # See note in flush() docstring
             #self.flush()
 
-            # Keep a count of how many we've added so we can write metadata
-            self.doc_count += 1
+        def _open_archive(self, archive_name):
+            """
+            Make the named archive the one being written to, closing the previous one if necessary.
+
+            """
+            if archive_name != self.current_archive_name:
+                # Starting a new archive
+                if self.current_archive is not None:
+                    # Close the old one
+                    self.current_archive.close()
+                self.current_archive_name = archive_name
+                arc_filename = os.path.join(self.data_dir, "{}.prc".format(archive_name))
+                # If we're appending a corpus and the archive already exists, append to it
+                self.current_archive = PimarcWriter(arc_filename,
+                                                    mode="a" if self.append and os.path.exists(arc_filename) else "w",
+                                                    name_header=self.name_header)
 
         def flush(self):
             """
@@ -447,11 +1065,27 @@ class GroupedCorpus(IterableCorpus):
             better now than they used to be at recovering from this situation when restarting,
             so I'm removing this flushing to speed things up.
 
+            Document map modules now call this periodically, just before storing how
+            far processing has got (see
+            :meth:`~pimlico.core.modules.map.DocumentMapModuleExecutor.checkpoint_processing_status`),
+            so the stored progress never refers to documents that are not yet on disk.
+
+            If compressing documents in the background, this first waits for all documents
+            added so far to be compressed and written.
+
             """
+            if self.compress_pool is not None:
+                self._write_compressed(self.compress_pool.iter_all())
             if self.current_archive is not None:
                 self.current_archive.flush()
 
         def __exit__(self, exc_type, exc_val, exc_tb):
+            if self.compress_pool is not None:
+                # Write out any documents that are still being compressed
+                try:
+                    self._write_compressed(self.compress_pool.iter_all())
+                finally:
+                    self.compress_pool.close()
             if self.current_archive is not None:
                 self.current_archive.close()
             self.metadata["length"] = self.doc_count
@@ -476,6 +1110,54 @@ class GroupedCorpus(IterableCorpus):
                     total_docs += len(arc)
             return total_docs
 
+        def _read_written_archive_compression(self):
+            """
+            When appending, read the record of which codec was used for each archive
+            from the metadata that was stored with the corpus before.
+
+            """
+            if os.path.exists(self._metadata_path):
+                with open(self._metadata_path, "r") as f:
+                    try:
+                        old_metadata = json.load(f)
+                    except ValueError:
+                        # Metadata file is empty or broken: nothing recorded
+                        return {}
+                return dict(old_metadata.get("archive_compression", {}))
+            return {}
+
+        def truncate_archives(self, num_docs):
+            """
+            Remove all documents from the already written archives after the first `num_docs`,
+            including any partly written documents at the end of an archive, and delete any
+            archives that are then empty.
+
+            """
+            archive_filenames = GroupedCorpus.Reader.Setup._get_archive_filenames(self.data_dir)
+            archive_filenames.sort()
+
+            remaining = num_docs
+            for archive_num, archive_filename in enumerate(archive_filenames):
+                if remaining == 0:
+                    # Nothing more to keep
+                    PimarcWriter.delete(archive_filename)
+                    archive_name = os.path.splitext(os.path.basename(archive_filename))[0]
+                    self.metadata["archive_compression"].pop(archive_name, None)
+                    continue
+                if archive_num < len(archive_filenames) - 1:
+                    # Archives before the last were closed when writing moved on, so their index is complete
+                    with PimarcReader(archive_filename) as arc:
+                        archive_docs = len(arc)
+                    if archive_docs <= remaining:
+                        # Keep the whole archive
+                        remaining -= archive_docs
+                        continue
+                # Read through the archive to find where to cut it off
+                remaining -= truncate_pimarc(archive_filename, remaining)
+            if remaining > 0:
+                raise DatatypeWriteError("could not truncate corpus to {:,} documents: only {:,} documents "
+                                         "found in its archives".format(num_docs, num_docs - remaining))
+
         def delete_all_archives(self):
             """
             Check for any already written archives and delete them all to make a fresh
@@ -489,6 +1171,126 @@ class GroupedCorpus(IterableCorpus):
                 PimarcWriter.delete(archive_filename)
 
 
+class RawDocumentRecord(object):
+    """
+    A document as it is stored in a grouped corpus' archive, yielded by
+    :meth:`GroupedCorpus.Reader.raw_archive_iter`.
+
+    :ivar metadata: the document's metadata, as read from the archive
+    :ivar data: the stored data, which may be compressed
+    :ivar codec: the :class:`~pimlico.utils.compression.Codec` needed to decompress the data
+    """
+    __slots__ = ["metadata", "data", "codec"]
+
+    def __init__(self, metadata, data, codec):
+        self.metadata = metadata
+        self.data = data
+        self.codec = codec
+
+    def decompress(self):
+        """ Get the document's raw data, decompressed if necessary. """
+        return self.codec.decompress(self.data)
+
+
+def supports_raw_records(reader):
+    """
+    Check whether the given corpus reader can provide the stored records for its documents, using
+    :meth:`GroupedCorpus.Reader.raw_archive_iter`. Readers of other types that satisfy the grouped
+    corpus type (e.g. readers that produce documents on the fly) can't.
+
+    """
+    return isinstance(reader, GroupedCorpus.Reader) and reader.supports_raw_records()
+
+
+def supports_archive_slices(reader):
+    """
+    Check whether a corpus reader can be read in slices, using
+    :meth:`~GroupedCorpus.Reader.archive_slice_iter` and :meth:`~GroupedCorpus.Reader.read_archive_slice`.
+
+    """
+    return isinstance(reader, GroupedCorpus.Reader) and reader.supports_archive_slices()
+
+
+def _archive_doc_name(filename, gzipped):
+    if gzipped and filename.endswith(".gz"):
+        # If we used the .gz extension while writing the file, remove it to get the doc name
+        return filename[:-3]
+    # By default, doc name is just the same as filename
+    return filename
+
+
+def _unbound(method):
+    # On Python 2, methods accessed on a class are unbound methods, wrapping the function
+    return getattr(method, "__func__", method)
+
+
+def _get_io_threads(pipeline):
+    """
+    Default number of threads to use for compressing and decompressing documents, taken from
+    the `io_threads` local config setting. 0 (not using threads) if it's not set.
+
+    """
+    if pipeline is None:
+        return 0
+    return int(pipeline.local_config.get("io_threads", 0))
+
+
+def _get_archive_read_ahead(pipeline):
+    """
+    Default number of bytes to read ahead from the next archive while iterating over a grouped
+    corpus, taken from the `archive_read_ahead` local config setting. This may be given in
+    bytes, or with a suffix K, M or G. 0 (no read-ahead) if it's not set.
+
+    """
+    if pipeline is None:
+        return 0
+    return parse_file_size(pipeline.local_config.get("archive_read_ahead", "0"))
+
+
+def _get_pimarc_mmap(pipeline):
+    """
+    Whether grouped corpus readers should memory-map the Pimarc archives they read, taken from the
+    `pimarc_mmap` local config setting. False if it's not set.
+
+    """
+    if pipeline is None:
+        return False
+    from pimlico.core.modules.options import str_to_bool
+    return str_to_bool(pipeline.local_config.get("pimarc_mmap", "false"))
+
+
+def _get_pimarc_name_header(pipeline):
+    """
+    Whether grouped corpus writers should use the name-header Pimarc record layout by default, taken
+    from the `pimarc_name_header` local config setting. False if it's not set.
+
+    """
+    if pipeline is None:
+        return False
+    from pimlico.core.modules.options import str_to_bool
+    return str_to_bool(pipeline.local_config.get("pimarc_name_header", "false"))
+
+
+def _get_follow_poll_interval(pipeline):
+    """
+    Number of seconds to wait between checks for more data while reading a grouped corpus as it's
+    being written, taken from the `follow_poll_interval` local config setting. 1 second if it's not set.
+
+    """
+    if pipeline is None:
+        return 1.
+    return float(pipeline.local_config.get("follow_poll_interval", "1"))
+
+
+def is_following(reader):
+    """
+    Check whether a corpus reader is reading the corpus while it's still being written, so that its
+    length is not yet known. See :meth:`GroupedCorpus.Reader.Setup.follow`.
+
+    """
+    return isinstance(reader, GroupedCorpus.Reader) and reader.followed_module is not None
+
+
 def exclude_invalid(doc_iter):
     """
     Generator that skips any invalid docs when iterating over a document dataset.
@@ -511,7 +1313,8 @@ class AlignedGroupedCorpora(object):
         self.readers = readers
         self.archives = self.readers[0].archives
         # Check that the corpora have the same archives in them
-        if not all(c.archives == self.archives for c in self.readers):
+        # This can't be checked yet for corpora that are still being written
+        if not self.is_following() and not all(c.archives == self.archives for c in self.readers):
             raise CorpusAlignmentError("not all corpora have the same archives in them, cannot align")
 
     def __iter__(self):
@@ -519,6 +1322,14 @@ class AlignedGroupedCorpora(object):
             yield filename, docs
 
     def archive_iter(self, start_after=None, skip=None, name_filter=None):
+        if len(self.readers) == 1:
+            # With just one corpus, the filter can be applied by the reader, which may be able to avoid
+            #  reading the filtered-out documents at all
+            for archive_name, doc_name, doc in self.readers[0].archive_iter(
+                    start_after=start_after, skip=skip, name_filter=name_filter):
+                yield archive_name, doc_name, [doc]
+            return
+
         # Iterate over all grouped corpora at once
         for corpus_items in zip(
                 *[corpus.archive_iter(start_after=start_after, skip=skip)
@@ -537,6 +1348,47 @@ class AlignedGroupedCorpora(object):
 
             yield corpus_items[0][0], corpus_items[0][1], [corpus_item[2] for corpus_item in corpus_items]
 
+    def is_following(self):
+        """ Check whether any of the corpora are being read while they're still being written: see :func:`is_following`. """
+        return any(is_following(reader) for reader in self.readers)
+
+    def supports_archive_slices(self):
+        """ Check whether all the corpora can be read in slices: see :meth:`archive_slice_iter`. """
+        return all(supports_archive_slices(reader) for reader in self.readers)
+
+    def archive_slice_iter(self, slice_size, start_after=None):
+        """
+        Divide the corpora into slices of up to `slice_size` consecutive documents, as
+        :meth:`GroupedCorpus.Reader.archive_slice_iter` does. For each slice, yields the
+        archive name, a list of the document names and a list containing a pair (start byte, end byte)
+        for each corpus. These can be passed to :meth:`read_archive_slice`.
+
+        """
+        for slices in zip(*[reader.archive_slice_iter(slice_size, start_after=start_after)
+                            for reader in self.readers]):
+            if not all(s[0] == slices[0][0] and s[1] == slices[0][1] for s in slices[1:]):
+                raise CorpusAlignmentError(
+                    "filenames within archives in grouped corpora do not correspond: %s" %
+                    ", ".join(["(%s/%s)" % (s[0], ",".join(s[1])) for s in slices])
+                )
+            yield slices[0][0], slices[0][1], [(s[2], s[3]) for s in slices]
+
+    def read_archive_slice(self, archive_name, positions, count):
+        """
+        Read the documents in a slice of the corpora produced by :meth:`archive_slice_iter`,
+        yielding the archive name, document name and a list of documents, one from each
+        corpus, just as :meth:`archive_iter` does.
+
+        """
+        for items in zip(*[reader.read_archive_slice(archive_name, start_byte, end_byte, count)
+                           for reader, (start_byte, end_byte) in zip(self.readers, positions)]):
+            yield archive_name, items[0][0], [doc for (doc_name, doc) in items]
+
+    def close_archive_slices(self):
+        for reader in self.readers:
+            if supports_archive_slices(reader):
+                reader.close_archive_slices()
+
     def __len__(self):
         return len(self.readers[0])
 
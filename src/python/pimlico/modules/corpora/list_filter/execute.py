@@ -3,6 +3,7 @@
 # Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
 
 from pimlico.core.modules.base import BaseModuleExecutor
+from pimlico.datatypes.corpora.grouped import supports_raw_records
 from pimlico.utils.progress import get_progress_bar
 
 
@@ -12,12 +13,18 @@ class ModuleExecutor(BaseModuleExecutor):
 
         pbar = get_progress_bar(len(input_corpus), title="Filtering")
         set1_list = self.info.get_input("list").get_list()
+        # If the input corpus is stored, copy the stored documents without decoding them
+        raw = supports_raw_records(input_corpus)
+        doc_iter = input_corpus.raw_archive_iter() if raw else input_corpus.archive_iter()
 
         with self.info.get_output_writer("set1", **input_corpus.metadata) as set1_writer:
             with self.info.get_output_writer("set2", **input_corpus.metadata) as set2_writer:
-                for archive_name, doc_name, doc_data in pbar(input_corpus.archive_iter()):
+                for archive_name, doc_name, doc_data in pbar(doc_iter):
                     if doc_name in set1_list:
                         put_in = set1_writer
                     else:
                         put_in = set2_writer
-                    put_in.add_document(archive_name, doc_name, doc_data)
+                    if raw:
+                        put_in.add_raw_record(archive_name, doc_name, doc_data)
+                    else:
+                        put_in.add_document(archive_name, doc_name, doc_data)
@@ -5,10 +5,11 @@
 from __future__ import division
 
 from future import standard_library
+from builtins import object
+from collections import OrderedDict
 
 from pimlico.datatypes import GroupedCorpus
 from pimlico.utils.pimarc import PimarcReader
-from pimlico.utils.pimarc.reader import read_doc_from_pimarc
 
 standard_library.install_aliases()
 
@@ -18,6 +19,9 @@ from pimlico.core.modules.base import BaseModuleExecutor
 from pimlico.modules.corpora.group.info import IterableCorpusGrouper
 from pimlico.utils.progress import get_progress_bar
 
+#: Maximum number of archives kept open at once while writing the shuffled corpus
+MAX_OPEN_ARCHIVES = 100
+
 
 class ModuleExecutor(BaseModuleExecutor):
     def execute(self):
@@ -44,10 +48,14 @@ class ModuleExecutor(BaseModuleExecutor):
         archive_filenames = input_corpus.archive_filenames
         # Read the index for each archive to check where each file's data starts
         self.log.info("Reading in document indices")
-        archive_doc_starts = [
-            (archive_num, metadata_start) for (archive_num, archive_filename) in enumerate(archive_filenames)
-            for (metadata_start, data_start) in PimarcReader(archive_filename).index.filenames.values()
-        ]
+        archive_doc_starts = []
+        max_archive_size = 0
+        for archive_num, archive_filename in enumerate(archive_filenames):
+            with PimarcReader(archive_filename) as archive:
+                archive_doc_starts.extend(
+                    (archive_num, metadata_start) for (metadata_start, data_start) in archive.index.values()
+                )
+                max_archive_size = max(max_archive_size, len(archive))
         self.log.info("Shuffling documents")
         # Seed the RNG
         random.seed(rng_seed)
@@ -55,15 +63,46 @@ class ModuleExecutor(BaseModuleExecutor):
         random.shuffle(archive_doc_starts)
 
         self.log.info("Writing randomly shuffled output corpus")
-        # Check the max length of an archive
-        max_archive_size = max(len(PimarcReader(archive_filename).index) for archive_filename in archive_filenames)
-        with self.info.get_output_writer("corpus") as writer:
-            grouper = IterableCorpusGrouper(max_archive_size, len(input_corpus), archive_basename=archive_basename)
-            # Iterate over each bin in turn
-            pbar = get_progress_bar(len(archive_doc_starts), title="Writing")
-            for archive_num, metadata_start in pbar(archive_doc_starts):
-                metadata, data = read_doc_from_pimarc(archive_filenames[archive_num], metadata_start)
-
-                archive_name = grouper.next_document()
-                # Add this document to the end of the output corpus
-                writer.add_document(archive_name, metadata["name"], data, metadata=metadata)
+        # Memory-map the archives, so we can jump around between them without reopening files
+        archives = OpenArchiveCache(archive_filenames, MAX_OPEN_ARCHIVES)
+        try:
+            with self.info.get_output_writer("corpus") as writer:
+                grouper = IterableCorpusGrouper(max_archive_size, len(input_corpus), archive_basename=archive_basename)
+                # Iterate over each bin in turn
+                pbar = get_progress_bar(len(archive_doc_starts), title="Writing")
+                for archive_num, metadata_start in pbar(archive_doc_starts):
+                    metadata, data = archives.get(archive_num).read_file_at(metadata_start)
+
+                    archive_name = grouper.next_document()
+                    # Add this document to the end of the output corpus
+                    writer.add_document(archive_name, metadata["name"], data, metadata=metadata)
+        finally:
+            archives.close()
+
+
+class OpenArchiveCache(object):
+    """
+    Keeps the most recently used archives open, memory-mapped, closing the least recently used
+    when more than `max_open` are open, so that corpora with very many archives don't run out
+    of file descriptors.
+
+    """
+    def __init__(self, archive_filenames, max_open):
+        self.archive_filenames = archive_filenames
+        self.max_open = max_open
+        self._open = OrderedDict()
+
+    def get(self, archive_num):
+        archive = self._open.pop(archive_num, None)
+        if archive is None:
+            if len(self._open) >= self.max_open:
+                # Close the least recently used archive
+                self._open.popitem(last=False)[1].close()
+            archive = PimarcReader(self.archive_filenames[archive_num], use_mmap=True)
+        # Put it at the end, as the most recently used
+        self._open[archive_num] = archive
+        return archive
+
+    def close(self):
+        while self._open:
+            self._open.popitem()[1].close()
@@ -18,6 +18,7 @@ from numpy import random
 import shutil
 
 from pimlico.core.modules.base import BaseModuleExecutor
+from pimlico.datatypes.corpora.grouped import RawDocumentRecord, supports_raw_records
 from pimlico.modules.corpora.group.info import IterableCorpusGrouper
 from pimlico.utils.progress import get_progress_bar
 
@@ -50,9 +51,20 @@ class ModuleExecutor(BaseModuleExecutor):
         # Prepare a formatter for archive numbers
         bin_name_format = "bin-{{:0{}d}}.prc".format(digits)
 
+        # If the input corpus is stored and all its archives use the same compression, we can
+        #  copy the stored documents to the bins and then the output without decoding them
+        raw_codec = None
+        if supports_raw_records(input_corpus):
+            codecs = dict((input_corpus.get_archive_codec(archive).spec, input_corpus.get_archive_codec(archive))
+                          for archive in input_corpus.archives)
+            if len(codecs) <= 1:
+                raw_codec = list(codecs.values())[0] if codecs else None
+        raw = raw_codec is not None
+        doc_iter = input_corpus.raw_archive_iter() if raw else input_corpus.archive_iter()
+
         # Open a pimarc for each bin to write documents out
         bin_filenames = [os.path.join(temp_dir, bin_name_format.format(i)) for i in range(num_bins)]
-        bin_writers = [PimarcWriter(fn) for fn in bin_filenames]
+        bin_writers = [PimarcWriter(fn, name_header=True) for fn in bin_filenames]
 
         # Iterate over all input documents, storing them in the bins
         self.log.info("Shuffling docs into temporary bins in {}".format(temp_dir))
@@ -62,7 +74,7 @@ class ModuleExecutor(BaseModuleExecutor):
         prev_archive = None
 
         pbar = get_progress_bar(len(input_corpus), title="Shuffling")
-        for archive, doc_name, doc in pbar(input_corpus.archive_iter()):
+        for archive, doc_name, doc in pbar(doc_iter):
             if archive != prev_archive:
                 archive_size = 1
                 prev_archive = archive
@@ -74,12 +86,16 @@ class ModuleExecutor(BaseModuleExecutor):
                 doc_name = "{}__{}".format(archive, doc_name)
             # Choose a bin at random
             bin = random.randint(0, num_bins)
-            # Get the document's raw data
-            data = doc.raw_data
-            metadata = doc.metadata
+            if raw:
+                # Append the stored record to a bin, as it is
+                bin_writers[bin].write_file(doc.data, doc_name, metadata=doc.metadata)
+            else:
+                # Get the document's raw data
+                data = doc.raw_data
+                metadata = doc.metadata
 
-            # Append the document to a bin
-            bin_writers[bin].write_file(data, doc_name, metadata=metadata)
+                # Append the document to a bin
+                bin_writers[bin].write_file(data, doc_name, metadata=metadata)
 
         max_archive_size = max(max_archive_size, archive_size)
 
@@ -94,14 +110,17 @@ class ModuleExecutor(BaseModuleExecutor):
                 bin_reader = PimarcReader(bin_fn)
                 # Shuffle randomly within the bin, as they're currently
                 # just in the order we read them from the input corpus
-                bin_doc_list = list(bin_reader.index.filenames.keys())
+                bin_doc_list = list(bin_reader.index.keys())
                 random.shuffle(bin_doc_list)
 
                 for doc_name in bin_doc_list:
                     archive_name = grouper.next_document()
                     metadata, raw_data = bin_reader[doc_name]
                     # Add this document to the end of the output corpus
-                    writer.add_document(archive_name, doc_name, raw_data, metadata=metadata)
+                    if raw:
+                        writer.add_raw_record(archive_name, doc_name, RawDocumentRecord(metadata, raw_data, raw_codec))
+                    else:
+                        writer.add_document(archive_name, doc_name, raw_data, metadata=metadata)
 
         # Remove the bins dir
         shutil.rmtree(temp_dir)
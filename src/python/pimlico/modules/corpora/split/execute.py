@@ -5,6 +5,7 @@
 import random
 
 from pimlico.core.modules.base import BaseModuleExecutor
+from pimlico.datatypes.corpora.grouped import supports_raw_records
 from pimlico.utils.progress import get_progress_bar
 
 
@@ -30,12 +31,16 @@ class ModuleExecutor(BaseModuleExecutor):
             set1_remaining = len(input_corpus) * self.info.options["set1_size"]
         set2_remaining = len(input_corpus) - set1_remaining
 
+        # If the input corpus is stored, copy the stored documents without decoding them
+        raw = supports_raw_records(input_corpus)
+        doc_iter = input_corpus.raw_archive_iter() if raw else input_corpus.archive_iter()
+
         pbar = get_progress_bar(len(input_corpus), title="Splitting")
         # Copy over the corpus metadata from the input to start with
         # The writer will replace some values, but anything specific to the datatype should be copied
         with self.info.get_output_writer("set1", **input_corpus.metadata) as set1_writer:
             with self.info.get_output_writer("set2", **input_corpus.metadata) as set2_writer:
-                for archive_name, doc_name, doc_data in pbar(input_corpus.archive_iter()):
+                for archive_name, doc_name, doc_data in pbar(doc_iter):
                     if set1_remaining == 0:
                         # Must be set 2
                         put_in, lst = set2_writer, set2_list
@@ -52,7 +57,10 @@ class ModuleExecutor(BaseModuleExecutor):
                         put_in, lst = (set1_writer, set1_list) if use_set1 else (set2_writer, set2_list)
                         output_list = use_set1 or output_set2_list
 
-                    put_in.add_document(archive_name, doc_name, doc_data)
+                    if raw:
+                        put_in.add_raw_record(archive_name, doc_name, doc_data)
+                    else:
+                        put_in.add_document(archive_name, doc_name, doc_data)
                     if output_list:
                         lst.append(doc_name)
 
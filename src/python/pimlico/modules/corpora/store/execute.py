@@ -10,4 +10,7 @@ def process_document(worker, archive_name, doc_name, doc):
     return doc
 
 
-ModuleExecutor = multiprocessing_executor_factory(process_document)
+class ModuleExecutor(multiprocessing_executor_factory(process_document)):
+    # Where the input corpus is stored, copy the stored records straight to the output, without
+    #  decoding the documents, or even decompressing them if the output uses the same compression
+    RAW_PASSTHROUGH = True
@@ -27,5 +27,6 @@ class ModuleInfo(DocumentMapModuleInfo):
 
     def get_output_writer(self, output_name=None, **kwargs):
         # Include metadata from the input in the writer kwargs
-        kwargs.update(self.get_input("corpus").metadata)
+        # If the input's still being written (see the run command's --follow), it's marked as such: leave that out
+        kwargs.update((key, val) for (key, val) in self.get_input("corpus").metadata.items() if key != "writing")
         return super(ModuleInfo, self).get_output_writer(output_name, **kwargs)
@@ -6,6 +6,8 @@ import random
 
 from pimlico.core.modules.base import BaseModuleExecutor
 from pimlico.datatypes.corpora import is_invalid_doc
+from pimlico.datatypes.corpora.data_points import is_invalid_doc_raw_data
+from pimlico.datatypes.corpora.grouped import supports_raw_records
 from pimlico.utils.progress import get_progress_bar
 
 
@@ -24,20 +26,46 @@ class ModuleExecutor(BaseModuleExecutor):
                               .format(target_size, prob, len(input_corpus)))
 
         rng = random.Random(self.info.options["seed"])
+        # If the input corpus is stored, copy the stored documents without decoding them
+        raw = supports_raw_records(input_corpus)
         selected = 0
-        total = 0
 
         with self.info.get_output_writer("corpus") as writer:
             self.log.info("Randomly sampling docs with a probability of {:.2f}% from corpus of {:,} docs"
                           .format(prob*100., len(input_corpus)))
             pbar = get_progress_bar(len(input_corpus), title="Sampling")
-            for archive_name, doc_name, doc in pbar(input_corpus.archive_iter()):
-                # If skipping invalid, check this now
-                if not skip_invalid or not is_invalid_doc(doc):
+            if skip_invalid:
+                # We need to look at every document to check whether it's invalid
+                doc_iter = input_corpus.raw_archive_iter() if raw else input_corpus.archive_iter()
+                total = 0
+                for archive_name, doc_name, doc in pbar(doc_iter):
+                    if is_invalid_doc_raw_data(doc.decompress()) if raw else is_invalid_doc(doc):
+                        continue
                     total += 1
                     if rng.random() < prob:
                         # Include this document
-                        writer.add_document(archive_name, doc_name, doc)
+                        if raw:
+                            writer.add_raw_record(archive_name, doc_name, doc)
+                        else:
+                            writer.add_document(archive_name, doc_name, doc)
                         selected += 1
+            else:
+                # The sample can be chosen using just the document names, so the reader only
+                #  needs to read the documents that are selected
+                def _sample(archive_name, doc_name):
+                    pbar.increment()
+                    return rng.random() < prob
+
+                doc_iter = input_corpus.raw_archive_iter(name_filter=_sample) if raw \
+                    else input_corpus.archive_iter(name_filter=_sample)
+                total = len(input_corpus)
+                for archive_name, doc_name, doc in doc_iter:
+                    # Include this document
+                    if raw:
+                        writer.add_raw_record(archive_name, doc_name, doc)
+                    else:
+                        writer.add_document(archive_name, doc_name, doc)
+                    selected += 1
+                pbar.finish()
 
         self.log.info("Included {:,}/{:,} docs in output corpus".format(selected, total))
@@ -0,0 +1,128 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Check how long it takes to import the code needed to start the main command-line interface
+for particular subcommands. Slow imports mean a slow start-up for every command, which is
+especially noticeable on shared clusters with slow filesystems.
+
+Uses Python's ``-X importtime`` option, so requires Python 3.7 or later. Each measurement is
+taken in a new interpreter, leaving out anything the interpreter imports at startup, and is
+repeated several times, taking the fastest. The check fails if any command takes longer than
+the budget. To see which modules take longest to import, use ``--verbose``.
+
+For example::
+
+    python -m pimlico.test.importtime --budget 250 status run
+
+"""
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+
+
+DEFAULT_COMMANDS = ["status", "run"]
+#: Default time budget, in milliseconds
+DEFAULT_BUDGET = 250
+
+
+def parse_import_times(output):
+    """
+    Parse the output from ``python -X importtime``.
+
+    :return: list of `(module name, self time, cumulative time, depth)`, with times in microseconds
+    """
+    import_times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative_time, name = line[len("import time:"):].split("|")
+        try:
+            self_time, cumulative_time = int(self_time), int(cumulative_time)
+        except ValueError:
+            # Header line
+            continue
+        # Nested imports are indented by two spaces for each level
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        import_times.append((name.strip(), self_time, cumulative_time, depth))
+    return import_times
+
+
+def measure_import_times(code):
+    """
+    Run the given Python code in a new interpreter and measure its imports.
+
+    :return: list of import times, as returned by :func:`parse_import_times`
+    """
+    process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", code],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    __, stderr = process.communicate()
+    if process.returncode != 0:
+        raise ImportTimeError("error running import time check: {}".format(stderr))
+    return parse_import_times(stderr)
+
+
+def subcommand_import_time(command_name, repeats=3):
+    """
+    Measure how long it takes to import the main command-line interface and the named subcommand.
+
+    :return: `(total time, import times)`, where the total is in microseconds and the import times are
+        those of the fastest run, as returned by :func:`parse_import_times`
+    """
+    # Modules imported by the interpreter itself don't count towards the time
+    startup_modules = set(name for (name, __, __, __) in measure_import_times("pass"))
+    code = "from pimlico.cli.main import load_subcommand; load_subcommand({!r})".format(command_name)
+
+    best = None
+    for __ in range(repeats):
+        import_times = [
+            times for times in measure_import_times(code) if times[0] not in startup_modules
+        ]
+        total = sum(cumulative_time for (__, __, cumulative_time, depth) in import_times if depth == 0)
+        if best is None or total < best[0]:
+            best = (total, import_times)
+    return best
+
+
+class ImportTimeError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the main command-line interface for the given "
+                                                 "subcommands can be imported within a time budget")
+    parser.add_argument("commands", nargs="*",
+                        help="Subcommands to check. Default: {}".format(", ".join(DEFAULT_COMMANDS)))
+    parser.add_argument("--budget", "-b", type=float, default=DEFAULT_BUDGET,
+                        help="Maximum time, in milliseconds, that importing for each command may take. "
+                             "Default: {}".format(DEFAULT_BUDGET))
+    parser.add_argument("--repeats", "-r", type=int, default=3,
+                        help="Number of times to measure each command, taking the fastest. Default: 3")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="Show the modules that take longest to import")
+    opts = parser.parse_args()
+
+    if sys.version_info < (3, 7):
+        print("Import time check requires Python 3.7 or later", file=sys.stderr)
+        sys.exit(1)
+
+    over_budget = []
+    for command_name in opts.commands or DEFAULT_COMMANDS:
+        total, import_times = subcommand_import_time(command_name, repeats=opts.repeats)
+        total_ms = total / 1000.
+        print("{}: {:.0f}ms{}".format(command_name, total_ms, " (over budget)" if total_ms > opts.budget else ""))
+        if opts.verbose:
+            for name, self_time, __, __ in sorted(import_times, key=lambda t: -t[1])[:10]:
+                print("    {:>7.1f}ms  {}".format(self_time / 1000., name))
+        if total_ms > opts.budget:
+            over_budget.append(command_name)
+
+    if over_budget:
+        print("Imports took longer than the budget of {:.0f}ms for: {}".format(opts.budget, ", ".join(over_budget)),
+              file=sys.stderr)
+        sys.exit(1)
+    else:
+        print("All commands within the budget of {:.0f}ms".format(opts.budget))
@@ -0,0 +1,197 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Round-trip test for the Pimarc archive format. Writes small archives, using both record
+layouts, reads them back in all the ways the reader supports and checks that the same files
+come out. The reads are repeated with the archive's file data memory-mapped, after converting
+the index to the binary format (v2) and after appending more files to the archive.
+
+Unlike the test pipelines, this doesn't need any test data or storage location: the archives
+are written to a temporary directory, which is removed afterwards.
+
+For example::
+
+    python -m pimlico.test.pimarc
+
+"""
+from __future__ import print_function
+
+import argparse
+import shutil
+import sys
+import tempfile
+import os
+
+from pimlico.utils.pimarc import PimarcReader, PimarcWriter
+from pimlico.utils.pimarc.index import reindex, check_index, is_binary_index, PimarcIndex, DuplicateFilename, \
+    FilenameNotInArchive
+from pimlico.utils.pimarc.reader import StartAfterFilenameNotFound, PimarcTailReader
+
+
+def make_test_files(num_files, first=0):
+    """
+    Files to write to a test archive: every third one has some metadata other than its name
+    and one is empty.
+
+    :return: list of `(name, metadata, data)`
+    """
+    files = []
+    for i in range(first, first + num_files):
+        metadata = {"number": i} if i % 3 == 0 else {}
+        data = u"File {} é\n".format(i).encode("utf-8") * (i % 5) if i != 1 else b""
+        files.append((u"file-{:03d}".format(i), metadata, data))
+    return files
+
+
+def write_archive(path, files, mode="w", name_header=False):
+    """ Write the files to an archive and check that duplicate names are rejected. """
+    with PimarcWriter(path, mode=mode, name_header=name_header) as writer:
+        for name, metadata, data in files:
+            writer.write_file(data, name=name, metadata=dict(metadata))
+        try:
+            writer.write_file(b"", name=files[0][0])
+        except DuplicateFilename:
+            pass
+        else:
+            raise PimarcTestError("writing a duplicate filename did not raise an error")
+
+
+def check_read_files(description, read_files, expected_files):
+    """ Compare a list of `(metadata, data)` read from an archive to the expected files. """
+    read_files = [(_metadata_dict(metadata), bytes(data)) for (metadata, data) in read_files]
+    expected = [(dict(metadata, name=name), data) for (name, metadata, data) in expected_files]
+    if read_files != expected:
+        read_names = [metadata.get("name") for (metadata, data) in read_files]
+        raise PimarcTestError("{}: expected files {}, got {}".format(
+            description, [name for (name, __, __) in expected_files], read_names))
+
+
+def _metadata_dict(metadata):
+    # The metadata is only decoded when it's accessed, so dict() alone would leave it out
+    if hasattr(metadata, "decode"):
+        metadata.decode()
+    return dict(metadata)
+
+
+def check_archive(path, files, use_mmap=False):
+    """ Read the archive in every supported way and check that the expected files are read. """
+    names = [name for (name, __, __) in files]
+    with PimarcReader(path, use_mmap=use_mmap) as reader:
+        if len(reader) != len(files):
+            raise PimarcTestError("archive contains {} files, expected {}".format(len(reader), len(files)))
+        if list(reader.iter_filenames()) != names:
+            raise PimarcTestError("wrong filenames in index: {}".format(list(reader.iter_filenames())))
+
+        check_read_files("iter_files()", reader.iter_files(), files)
+        check_read_files("iter_files(skip=4)", reader.iter_files(skip=4), files[4:])
+        check_read_files("iter_files(skip=too many)", reader.iter_files(skip=len(files) + 1), [])
+        check_read_files("iter_files(start_after)", reader.iter_files(start_after=names[2]), files[3:])
+        check_read_files("iter_files(start_after=last)", reader.iter_files(start_after=names[-1]), [])
+        try:
+            list(reader.iter_files(start_after=u"not-a-file"))
+        except StartAfterFilenameNotFound:
+            pass
+        else:
+            raise PimarcTestError("start_after with an unknown filename did not raise an error")
+
+        # A filter that selects few files reads them directly, one that selects most reads sequentially
+        for description, selected_names in [("few", {names[1], names[-2]}), ("most", set(names[1:]))]:
+            check_read_files(
+                "iter_files(filename_filter={})".format(description),
+                reader.iter_files(filename_filter=lambda name: name in selected_names),
+                [f for f in files if f[0] in selected_names]
+            )
+            check_read_files(
+                "iter_files(filename_filter={}, start_after)".format(description),
+                reader.iter_files(filename_filter=lambda name: name in selected_names, start_after=names[2]),
+                [f for f in files[3:] if f[0] in selected_names]
+            )
+            try:
+                list(reader.iter_files(filename_filter=lambda name: name in selected_names, start_after=u"not-a-file"))
+            except StartAfterFilenameNotFound:
+                pass
+            else:
+                raise PimarcTestError("start_after with an unknown filename and a filter did not raise an error")
+
+        # Random access, in reverse order
+        check_read_files("read_file()", [reader.read_file(name) for name in reversed(names)], list(reversed(files)))
+        check_read_files("iter_metadata()", [(metadata, data) for (metadata, (__, __, data))
+                                              in zip(reader.iter_metadata(), files)], files)
+
+        for position, name in enumerate(names):
+            if reader.index.position(name) != position:
+                raise PimarcTestError("wrong index position for {}: {}".format(name, reader.index.position(name)))
+        try:
+            reader.index.position(u"not-a-file")
+        except FilenameNotInArchive:
+            pass
+        else:
+            raise PimarcTestError("looking up the position of an unknown filename did not raise an error")
+
+
+def run_round_trip(path, name_header=False):
+    """ Write, read, reindex and append to an archive at the given path, checking all the reads. """
+    files = make_test_files(10)
+    write_archive(path, files, name_header=name_header)
+    check_archive(path, files)
+    check_archive(path, files, use_mmap=True)
+
+    # Reading the archive while it's written gives the same files
+    check_read_files("PimarcTailReader", PimarcTailReader(path).read_new_files(), files)
+
+    # Rebuild the index in the binary format
+    reindex(path, format="v2")
+    if not is_binary_index("{}i".format(path)):
+        raise PimarcTestError("index not written in binary format by reindex")
+    if check_index(path) != len(files):
+        raise PimarcTestError("wrong number of files checked in index")
+    check_archive(path, files)
+    check_archive(path, files, use_mmap=True)
+
+    # Appending converts the index back to text format and uses the archive's record layout
+    more_files = make_test_files(5, first=len(files))
+    write_archive(path, more_files, mode="a", name_header=not name_header)
+    files.extend(more_files)
+    if is_binary_index("{}i".format(path)):
+        raise PimarcTestError("index not converted to text format when appending")
+    check_index(path)
+    check_archive(path, files)
+    check_archive(path, files, use_mmap=True)
+
+    # Rebuilding the text index gives the same as the one that was written
+    written_index = list(PimarcIndex.load("{}i".format(path)).filenames.items())
+    if list(reindex(path).filenames.items()) != written_index:
+        raise PimarcTestError("rebuilt index does not match the written index")
+
+
+class PimarcTestError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write, read and reindex some small Pimarc archives, checking "
+                                                 "that the files are read back correctly")
+    opts = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    failed = []
+    try:
+        for name_header in [False, True]:
+            layout = "name-header layout" if name_header else "original layout"
+            try:
+                run_round_trip(os.path.join(tmp_dir, "test_{}.prc".format(int(name_header))), name_header=name_header)
+            except PimarcTestError as e:
+                print("{}: failed: {}".format(layout, e))
+                failed.append(layout)
+            else:
+                print("{}: succeeded".format(layout))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if failed:
+        print("Pimarc round-trip test failed for: {}".format(", ".join(failed)), file=sys.stderr)
+        sys.exit(1)
+    else:
+        print("All Pimarc round-trip tests succeeded")
@@ -61,22 +61,23 @@ class TestPipeline(object):
         self.to_run = remove_duplicates(self.requested_modules + [m.module_name for m in collect_unexecuted_dependencies(modules)])
 
     @staticmethod
-    def load_pipeline(path, storage_root):
+    def load_pipeline(path, storage_root, local_config=None):
         """
         Load a test pipeline from a config file.
 
         Path may be absolute, or given relative to Pimlico test data directory (``PIMLICO_ROOT/test/data``)
 
+        :param local_config: additional local config settings to run the pipeline with, e.g. to test
+            alternative ways of executing modules
         """
         if not os.path.isabs(path):
             path = os.path.join(TEST_DATA_DIR, path)
         if not os.path.exists(path):
             raise TestPipelineRunError("could not load test pipeline at '{}': file does not exist".format(path))
         # Set the local config paths to point to the (usually temporary) storage root we're using
-        local_config = {
-            "store": storage_root,
-        }
-        return PipelineConfig.load(path, override_local_config=local_config, only_override_config=True)
+        override_local_config = dict(local_config or {})
+        override_local_config["store"] = storage_root
+        return PipelineConfig.load(path, override_local_config=override_local_config, only_override_config=True)
 
     def get_uninstalled_dependencies(self):
         deps = get_dependencies(self.pipeline, self.to_run, recursive=True)
@@ -133,7 +134,7 @@ class TestPipeline(object):
             raise TestPipelineRunError("module '{}' failed".format(module_name))
 
 
-def run_test_pipeline(path, module_names, log, no_clean=False, debug=False, no_clean_after=False):
+def run_test_pipeline(path, module_names, log, no_clean=False, debug=False, no_clean_after=False, local_config=None):
     """
     Run a test pipeline, loading the pipeline config from a given path (which may be relative to the
     Pimlico test data directory) and running each of the named modules, including any of those
@@ -148,6 +149,9 @@ def run_test_pipeline(path, module_names, log, no_clean=False, debug=False, no_c
     If any of the modules name explicitly is an input dataset, it is loaded and data_ready() is checked.
     If it is an IterableCorpus, it is tested simply by iterating over the full corpus.
 
+    Local config settings may be given, which are used in addition to those set up for the test
+    environment.
+
     """
     # Prepare the storage dir for pipeline output
     if not os.path.exists(TEST_STORAGE_DIR):
@@ -158,7 +162,7 @@ def run_test_pipeline(path, module_names, log, no_clean=False, debug=False, no_c
     try:
         # Load the pipeline config
         try:
-            pipeline = TestPipeline.load_pipeline(path, TEST_STORAGE_DIR)
+            pipeline = TestPipeline.load_pipeline(path, TEST_STORAGE_DIR, local_config=local_config)
             test_pipeline = TestPipeline(pipeline, module_names, log, debug=debug)
         except Exception as e:
             traceback.print_exc()
@@ -202,15 +206,21 @@ def run_test_suite(pipelines_and_modules, log, no_clean=False, debug=False, stop
     """
     :param pipeline_and_modules: list of (pipeline, modules) pairs, where pipeline is a path to a config file and
         modules a list of module names to test. If the module list is empty, all runable modules are run.
+        Optionally, a third item may be given: a dict of local config settings to run the pipeline with
+    :return: list of the tests that failed, each given as (pipeline, modules, local config settings)
     """
     failed = []
-    for path, module_names in pipelines_and_modules:
-        log.info("Running test pipeline {}, modules {}".format(path, ", ".join(module_names)))
+    for test in pipelines_and_modules:
+        path, module_names = test[:2]
+        local_config = test[2] if len(test) > 2 else {}
+        log.info("Running test pipeline {}, modules {}{}".format(
+            path, ", ".join(module_names), format_test_local_config(local_config, ", with ")))
         try:
-            run_test_pipeline(path, module_names, log, no_clean=no_clean, debug=debug, no_clean_after=no_clean_after)
+            run_test_pipeline(path, module_names, log, no_clean=no_clean, debug=debug, no_clean_after=no_clean_after,
+                              local_config=local_config)
         except TestPipelineRunError as e:
             log.error("Test failed: {}".format(e))
-            failed.append((path, module_names))
+            failed.append((path, module_names, local_config))
             if stop_on_error:
                 log.error("Aborting test suite after error on {} [{}]".format(path, ",".join(module_names)))
                 break
@@ -219,6 +229,13 @@ def run_test_suite(pipelines_and_modules, log, no_clean=False, debug=False, stop
     return failed
 
 
+def format_test_local_config(local_config, prefix=""):
+    """ Format the local config settings that a test pipeline is run with, for output """
+    if not local_config:
+        return ""
+    return "{}{}".format(prefix, ", ".join("{}={}".format(key, val) for (key, val) in sorted(local_config.items())))
+
+
 def clear_storage_dir():
     # Should remove any files or directories in there other than the README
     for filename in os.listdir(TEST_STORAGE_DIR):
@@ -0,0 +1,261 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Test that a document map module can pick up where it left off after the process running it has
+been killed forcibly, between the points at which its progress is stored.
+
+Each module is run in a separate process, which kills itself (with SIGKILL) after writing some
+documents beyond the last stored progress, leaving a partly written document at the end of the
+archive it's writing. The module is then run again, which should resume processing from the
+stored progress. The test checks that the output contains every input document exactly once,
+in the right order.
+
+The same is then done while updating the module's complete output incrementally (the `run`
+command's `--incremental` option). Running the update again should put back the previous output
+before updating it.
+
+A small input corpus is written to a temporary directory, which is also used to store the
+output and is removed afterwards.
+
+For example::
+
+    python -m pimlico.test.resume
+
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+
+from pimlico.core.config import PipelineConfig
+from pimlico.core.modules.execute import check_and_execute_modules
+from pimlico.utils.logging import get_console_logger
+from pimlico.utils.pimarc import PimarcReader, PimarcWriter
+
+
+PIPELINE_CONFIG = u"""\
+[pipeline]
+name=resume
+release=latest
+
+[input]
+type=pimlico.datatypes.corpora.GroupedCorpus
+data_point_type=RawTextDocumentType
+dir={input_dir}
+
+# Copies the stored documents straight to its output
+[store]
+type=pimlico.modules.corpora.store
+input=input
+
+# Processes the documents and writes new ones
+[tokenize]
+type=pimlico.modules.text.simple_tokenize
+input=input
+"""
+DEFAULT_MODULES = ["store", "tokenize"]
+#: Input corpus size: number of archives and documents in each
+NUM_ARCHIVES = 3
+DOCS_PER_ARCHIVE = 4
+#: Progress is stored after this many documents
+CHECKPOINT_DOCS = 7
+#: The process is killed once this many documents have been written: two after the stored progress,
+#: one of which starts a new archive
+KILL_AFTER_DOCS = 9
+
+
+def write_input_corpus(input_dir):
+    """
+    Write a small grouped corpus of raw text documents.
+
+    :return: list of the `(archive name, doc name)` of the documents
+    """
+    data_dir = os.path.join(input_dir, "data")
+    os.makedirs(data_dir)
+    doc_names = []
+    for archive_num in range(NUM_ARCHIVES):
+        archive_name = "archive-{}".format(archive_num)
+        with PimarcWriter(os.path.join(data_dir, "{}.prc".format(archive_name))) as writer:
+            for doc_num in range(DOCS_PER_ARCHIVE):
+                doc_name = "doc-{}-{}".format(archive_num, doc_num)
+                writer.write_file(u"This is document {} of {}.\n".format(doc_num, archive_name).encode("utf-8"),
+                                  name=doc_name)
+                doc_names.append((archive_name, doc_name))
+    with io.open(os.path.join(input_dir, "corpus_metadata"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"length": len(doc_names)}))
+    return doc_names
+
+
+def load_pipeline(tmp_dir):
+    config_path = os.path.join(tmp_dir, "resume.conf")
+    if not os.path.exists(config_path):
+        with io.open(config_path, "w", encoding="utf-8") as f:
+            f.write(PIPELINE_CONFIG.format(input_dir=os.path.join(tmp_dir, "input")))
+    return PipelineConfig.load(config_path, override_local_config={
+        "store": os.path.join(tmp_dir, "storage"), "config_cache": "false",
+    }, only_override_config=True)
+
+
+def run_until_killed(tmp_dir, module_name, log, incremental=False):
+    """
+    Run the module, storing progress every `CHECKPOINT_DOCS` documents, and kill the process once
+    `KILL_AFTER_DOCS` documents have been written to the output. Runs in this process, so should
+    be called in a subprocess.
+
+    :param incremental: run with the `run` command's `--incremental` option
+    """
+    from pimlico.core.modules.map import DocumentMapModuleExecutor
+    from pimlico.datatypes.corpora.grouped import GroupedCorpus
+
+    DocumentMapModuleExecutor.checkpoint_docs = CHECKPOINT_DOCS
+    DocumentMapModuleExecutor.checkpoint_interval = 3600.
+    _write_file = GroupedCorpus.Writer._write_file
+    docs_written = [0]
+
+    def _write_file_and_kill(self, *args, **kwargs):
+        _write_file(self, *args, **kwargs)
+        docs_written[0] += 1
+        if docs_written[0] == KILL_AFTER_DOCS:
+            # Make sure that everything written so far is on disk, as it would be if the archive
+            #  had been closed or its buffer flushed when the process was killed
+            self.current_archive.flush()
+            # Start writing another document, but only get part of the way through it
+            with open(self.current_archive.archive_filename, "ab") as f:
+                f.write(b"\x10partial")
+            with open(self.current_archive.index_filename, "a") as f:
+                f.write(u"partial\t")
+            os.kill(os.getpid(), signal.SIGKILL)
+
+    GroupedCorpus.Writer._write_file = _write_file_and_kill
+    check_and_execute_modules(load_pipeline(tmp_dir), [module_name], log=log, incremental=incremental)
+
+
+def kill_in_subprocess(tmp_dir, module_name, incremental=False):
+    """ Run :func:`run_until_killed` in a subprocess """
+    return_code = subprocess.call([sys.executable, "-m", "pimlico.test.resume", "--kill", tmp_dir, module_name] +
+                                  (["--incremental"] if incremental else []))
+    if return_code != -signal.SIGKILL:
+        raise ResumeTestError("module execution was not killed as expected (exit code {})".format(return_code))
+
+
+def check_output(module, input_docs):
+    """ Check that the module is complete and its output contains each input document once, in order """
+    if module.status != "COMPLETE":
+        raise ResumeTestError("module status after resuming is {}".format(module.status))
+    output = module.get_output()
+    output_docs = list(output.list_archive_iter())
+    if output_docs != input_docs:
+        raise ResumeTestError("expected output documents {}, got {}".format(input_docs, output_docs))
+    if len(output) != len(input_docs):
+        raise ResumeTestError("output corpus length is {}, expected {}".format(len(output), len(input_docs)))
+    # Check that the archive data is consistent with the indexes and nothing was left of the partial document
+    output_data_dir = os.path.join(module.get_absolute_output_dir(module.default_output_name), "data")
+    for archive_filename in sorted(os.listdir(output_data_dir)):
+        if archive_filename.endswith(".prc"):
+            with PimarcReader(os.path.join(output_data_dir, archive_filename)) as archive:
+                names = [metadata["name"] for (metadata, data) in archive]
+                if names != list(archive.iter_filenames()):
+                    raise ResumeTestError("documents in {} don't match its index".format(archive_filename))
+
+
+def test_resume(tmp_dir, module_name, input_docs, log):
+    """
+    Run the module in a subprocess that gets killed part-way through, then resume it and check the output.
+
+    """
+    kill_in_subprocess(tmp_dir, module_name)
+
+    module = load_pipeline(tmp_dir)[module_name]
+    if module.status != "PARTIALLY_PROCESSED" or module.get_metadata()["docs_completed"] != CHECKPOINT_DOCS:
+        raise ResumeTestError("expected progress to be stored after {} docs, got status {}, {} docs".format(
+            CHECKPOINT_DOCS, module.status, module.get_metadata().get("docs_completed")))
+    output_data_dir = os.path.join(module.get_absolute_output_dir(module.default_output_name), "data")
+    if not os.path.exists(os.path.join(output_data_dir, "{}.prc".format(input_docs[KILL_AFTER_DOCS-1][0]))):
+        raise ResumeTestError("documents after the stored progress were not written before the process was killed")
+
+    # The lock is left behind when the process is killed, so remove it as the unlock command would
+    module.unlock()
+    log.info("Resuming execution of {}".format(module_name))
+    check_and_execute_modules(load_pipeline(tmp_dir), [module_name], log=log)
+    check_output(load_pipeline(tmp_dir)[module_name], input_docs)
+
+
+def test_resume_update(tmp_dir, module_name, input_docs, log):
+    """
+    Run the module to completion, recording input hashes, then update its output in a subprocess that gets
+    killed part-way through. Running the update again should first put back the previous output.
+
+    """
+    load_pipeline(tmp_dir)[module_name].reset_execution()
+    check_and_execute_modules(load_pipeline(tmp_dir), [module_name], log=log, incremental=True)
+    kill_in_subprocess(tmp_dir, module_name, incremental=True)
+
+    module = load_pipeline(tmp_dir)[module_name]
+    if module.status != "STARTED":
+        raise ResumeTestError("expected status STARTED after killing update, got {}".format(module.status))
+    module.unlock()
+    log.info("Updating {} again".format(module_name))
+    check_and_execute_modules(load_pipeline(tmp_dir), [module_name], log=log, incremental=True)
+
+    module = load_pipeline(tmp_dir)[module_name]
+    check_output(module, input_docs)
+    history = module.execution_history
+    if "previous complete output restored" not in history or \
+            "Updating output" not in history[history.index("previous complete output restored"):]:
+        raise ResumeTestError("previous output was not restored and updated after killing update")
+    output_dir = module.get_absolute_output_dir(module.default_output_name)
+    if os.path.exists("%s.previous" % output_dir):
+        raise ResumeTestError("previous output left behind after update")
+
+
+class ResumeTestError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that document map modules can resume processing after "
+                                                 "being killed between storing their progress")
+    parser.add_argument("modules", nargs="*",
+                        help="Modules of the test pipeline to check. Default: {}".format(", ".join(DEFAULT_MODULES)))
+    parser.add_argument("--kill", help="Used internally to run a module in a subprocess that gets killed: the "
+                                       "temporary directory to use")
+    parser.add_argument("--incremental", action="store_true", help="Used internally with --kill")
+    opts = parser.parse_args()
+
+    log = get_console_logger("Test")
+
+    if opts.kill:
+        run_until_killed(opts.kill, opts.modules[0], log, incremental=opts.incremental)
+        # We should have been killed by now
+        sys.exit(1)
+
+    tmp_dir = tempfile.mkdtemp()
+    failed = []
+    try:
+        input_docs = write_input_corpus(os.path.join(tmp_dir, "input"))
+        for module_name in opts.modules or DEFAULT_MODULES:
+            try:
+                test_resume(tmp_dir, module_name, input_docs, log)
+                test_resume_update(tmp_dir, module_name, input_docs, log)
+            except ResumeTestError as e:
+                log.error("{}: failed: {}".format(module_name, e))
+                failed.append(module_name)
+            else:
+                log.info("{}: succeeded".format(module_name))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if failed:
+        log.error("Resuming failed for: {}".format(", ".join(failed)))
+        sys.exit(1)
+    else:
+        log.info("All modules resumed successfully")
@@ -10,14 +10,16 @@ if __name__ == "__main__":
 import argparse
 import sys
 
-from pimlico.test.pipeline import run_test_suite
+from pimlico.test.pipeline import run_test_suite, format_test_local_config
 from pimlico.utils.logging import get_console_logger
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Pipeline test suite runner")
     parser.add_argument("suite_file", help="CSV file in which each line contains a path to a pipeline config file "
-                                           "(potentially relative to test data dir), then a list of modules to test")
+                                           "(potentially relative to test data dir), then a list of modules to test. "
+                                           "Items of the form 'key=value' are not modules, but local config "
+                                           "settings to run the pipeline with")
     parser.add_argument("--no-clean", help="Do not clean up the storage directory after running tests. By default, "
                                            "all output from the test pipelines is deleted at the end",
                         action="store_true")
@@ -38,14 +40,21 @@ if __name__ == "__main__":
 
     with open(opts.suite_file, "r") as f:
         rows = [row.split(",") for row in f.read().splitlines() if not row.startswith("#") and len(row.strip())]
-    pipelines_and_modules = [(row[0].strip(), [m.strip() for m in row[1:]]) for row in rows]
+    pipelines_and_modules = [
+        (
+            row[0].strip(),
+            [m.strip() for m in row[1:] if "=" not in m],
+            dict((key.strip(), val.strip()) for (key, __, val) in (s.partition("=") for s in row[1:] if "=" in s)),
+        ) for row in rows
+    ]
     log.info("Running {} test pipelines".format(len(pipelines_and_modules)))
 
     failed = run_test_suite(pipelines_and_modules, log, no_clean=opts.no_clean, stop_on_error=opts.exit_error,
                             no_clean_after=opts.no_clean_after, debug=opts.debug)
     if failed:
         log.error("Some tests did not complete successfully: {}. See above for details".format(
-            ", ".join("{}[{}]".format(pipeline, ",".join(modules)) for (pipeline, modules) in failed)
+            ", ".join("{}[{}]{}".format(pipeline, ",".join(modules), format_test_local_config(local_config, " with "))
+                      for (pipeline, modules, local_config) in failed)
         ))
     else:
         log.info("All tests completed successfully")
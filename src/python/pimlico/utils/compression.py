@@ -0,0 +1,239 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Compression codecs for compressing individual documents, or other chunks of data,
+in memory.
+
+A codec is specified by a string of the form `name` or `name:level`, e.g. `zlib:3`.
+Available codecs:
+
+- `none`: no compression
+- `zlib`: zlib/deflate (level 0-9, default 6)
+- `gzip`: deflate with gzip headers, so the data can be easily decompressed outside
+  Pimlico (level 0-9, default 9)
+- `lzma`: LZMA/xz (preset 0-9, default 6)
+- `bz2`: bzip2 (level 1-9, default 9)
+
+zlib and gzip (de)compression are done directly using `zlib`, without wrapping the
+data in file objects, which is much faster when compressing many small documents.
+
+All of the codecs release the GIL while (de)compressing, so :class:`CodecThreadPool`
+can be used to spread the work over several threads, while getting the results back
+in the order the data was submitted.
+
+"""
+import bz2
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+
+class Codec(object):
+    """
+    Base class for compression codecs. Subclasses implement `compress()` and
+    `decompress()`, which operate on bytes-like objects.
+
+    """
+    name = None
+    default_level = None
+    min_level = 0
+    max_level = 9
+
+    def __init__(self, level=None):
+        if level is None:
+            level = self.default_level
+        elif not (self.min_level <= level <= self.max_level):
+            raise CodecSpecError("compression level for {} must be between {} and {}: got {}".format(
+                self.name, self.min_level, self.max_level, level
+            ))
+        self.level = level
+
+    @property
+    def spec(self):
+        """ String specification of the codec, which can be passed to :func:`get_codec`. """
+        if self.level is None:
+            return self.name
+        else:
+            return "{}:{}".format(self.name, self.level)
+
+    def compress(self, data):
+        raise NotImplementedError()
+
+    def decompress(self, data):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return "Codec({})".format(self.spec)
+
+
+class NoCompression(Codec):
+    name = "none"
+
+    def __init__(self, level=None):
+        super(NoCompression, self).__init__(None)
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        # Data read from a memory-mapped archive comes as a memoryview: documents are built from bytes
+        return data if isinstance(data, bytes) else bytes(data)
+
+
+class ZlibCodec(Codec):
+    name = "zlib"
+    default_level = 6
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class GzipCodec(Codec):
+    """
+    Produces exactly the same format as the `gzip` module, but much faster for small
+    pieces of data, since it uses `zlib` directly.
+
+    Decompression also accepts zlib data (without gzip headers), for backwards
+    compatibility with old gzipped corpora.
+
+    """
+    name = "gzip"
+    default_level = 9
+
+    def compress(self, data):
+        # wbits=31 tells zlib to write a gzip header and trailer
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        # wbits=47 (32+15) auto-detects zlib or gzip headers
+        return zlib.decompress(data, 47)
+
+
+class LzmaCodec(Codec):
+    name = "lzma"
+    default_level = 6
+
+    def compress(self, data):
+        # Not available on Python 2, so only imported when needed
+        import lzma
+        return lzma.compress(data, preset=self.level)
+
+    def decompress(self, data):
+        import lzma
+        return lzma.decompress(data)
+
+
+class Bz2Codec(Codec):
+    name = "bz2"
+    default_level = 9
+    min_level = 1
+
+    def compress(self, data):
+        return bz2.compress(data, self.level)
+
+    def decompress(self, data):
+        return bz2.decompress(data)
+
+
+CODECS = dict((codec.name, codec) for codec in [NoCompression, ZlibCodec, GzipCodec, LzmaCodec, Bz2Codec])
+
+
+def get_codec(spec):
+    """
+    Get a codec instance from a string specification, of the form `name` or
+    `name:level`. None is treated the same as `"none"`.
+
+    """
+    if spec is None:
+        spec = "none"
+    name, __, level = spec.partition(":")
+    name = name.strip().lower()
+    try:
+        codec_cls = CODECS[name]
+    except KeyError:
+        raise CodecSpecError("unknown compression codec '{}'. Available codecs: {}".format(
+            name, ", ".join(sorted(CODECS.keys()))
+        ))
+    if level:
+        try:
+            level = int(level)
+        except ValueError:
+            raise CodecSpecError("invalid compression level in codec specification '{}'".format(spec))
+    else:
+        level = None
+    return codec_cls(level)
+
+
+class CodecThreadPool(object):
+    """
+    Pool of threads for compressing or decompressing data, using any function, typically
+    a codec's `compress()` or `decompress()`. Each piece of data is submitted with a key,
+    which is returned along with the result, and results are always returned in the
+    order in which they were submitted.
+
+    At most `max_pending` items are queued up waiting to be processed or collected: once
+    this many are waiting, collecting results blocks until the oldest is ready. This
+    keeps memory use bounded when data is submitted faster than it is processed.
+
+    """
+    def __init__(self, threads, max_pending=None):
+        self.threads = threads
+        self.max_pending = max_pending or 4 * threads
+        self.pool = ThreadPool(threads)
+        self.pending = deque()
+
+    def submit(self, fn, data, key=None):
+        """ Queue up `fn(data)` to be run on one of the threads. """
+        self.pending.append((key, self.pool.apply_async(fn, (data,))))
+
+    def iter_ready(self):
+        """
+        Yield `(key, result)` for the results at the front of the queue that are already
+        available. If the queue is full, waits for results so that it's no longer full.
+
+        """
+        while self.pending and (len(self.pending) >= self.max_pending or self.pending[0][1].ready()):
+            key, result = self.pending.popleft()
+            yield key, result.get()
+
+    def iter_all(self):
+        """ Wait for all the pending results and yield them as `(key, result)`. """
+        while self.pending:
+            key, result = self.pending.popleft()
+            yield key, result.get()
+
+    def imap(self, fn, items):
+        """
+        Apply `fn` to the data in each `(key, data)` pair of the iterable, yielding
+        `(key, fn(data))` in the same order. The input is consumed ahead of the output,
+        but by at most `max_pending` items.
+
+        """
+        for key, data in items:
+            self.submit(fn, data, key)
+            for key_result in self.iter_ready():
+                yield key_result
+        for key_result in self.iter_all():
+            yield key_result
+
+    def close(self):
+        """ Shut down the threads. Any results not yet collected are discarded. """
+        self.pending.clear()
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CodecSpecError(Exception):
+    pass
@@ -20,7 +20,7 @@ from sphinx import __version__
 from .rest import format_heading
 
 from pimlico import install_core_dependencies
-from pimlico.cli.main import SUBCOMMANDS
+from pimlico.cli.main import load_all_subcommands
 from pimlico.cli.subcommands import PimlicoCLISubcommand
 from pimlico.utils.docs.rest import make_table
 
@@ -31,7 +31,7 @@ def generate_docs(output_dir):
 
     """
     command_names, command_descs = list(zip(*(
-        generate_docs_for_command(command, output_dir) for command in SUBCOMMANDS
+        generate_docs_for_command(command, output_dir) for command in load_all_subcommands()
     )))
 
     # Generate an index for all commands
@@ -41,6 +41,22 @@ def format_file_size(bytes):
         return "%db" % bytes
 
 
+def parse_file_size(size):
+    """
+    Parse a size in bytes given as a string, as is common in config files. The size may be
+    given simply as a number of bytes, or with a suffix `K`, `M` or `G` (optionally followed
+    by `B`), e.g. `64M`.
+
+    """
+    size = str(size).strip().upper()
+    if size.endswith("B"):
+        size = size[:-1]
+    multipliers = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if size and size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
 def copy_dir_with_progress(source_dir, target_dir, move=False):
     """
     Utility for moving/copying a large directory and displaying a progress bar showing how much is copied.
@@ -112,6 +128,36 @@ def new_filename(directory, initial_filename="tmp_file"):
             index += 1
 
 
+def write_file_atomically(filename, data):
+    """
+    Write the given data to a file, replacing anything that's already there, in such a way that
+    the file is never left partially written, even if the process is killed during writing. The data
+    is written to a temporary file, which is then renamed to replace the old file.
+
+    The temporary file is in the same directory and its name is unique to the process and thread,
+    so that writers of the same file in different processes or threads never share it. Whichever
+    finishes last replaces the file.
+
+    :param filename: path to write to
+    :param data: text or bytes
+    """
+    temp_filename = "{}.{}.{}.tmp".format(filename, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(temp_filename, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            f.flush()
+            # Make sure the data is on disk before the rename
+            os.fsync(f.fileno())
+        # Rename over the old file, which is atomic
+        # os.replace() is not available on Py2, where rename() does the same on Unix
+        getattr(os, "replace", os.rename)(temp_filename, filename)
+    except BaseException:
+        # Don't leave the partly written file behind
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
 def retry_open(filename, errnos=[13], retry_schedule=[2, 10, 30, 120, 300], **kwargs):
     """
     Try opening a file, using the builtin open() function (Py3, or io.open on Py2).
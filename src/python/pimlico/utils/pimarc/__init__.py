@@ -35,6 +35,14 @@ for example, open an archive and move files around, or delete a file. To do thes
 things, you must read in an archive using a reader and write out a new, modified one
 using a writer.
 
+Each file in the archive is stored as a record containing its metadata, followed by
+its data. There are two record layouts. In the original layout, the file's name is
+stored in the JSON metadata, as the key `name`. In the name-header layout, the name
+is stored in its own length-prefixed field at the start of the record, and the JSON
+only contains any other metadata (and is empty if there is none). An archive using
+the name-header layout starts with a short header to identify it
+(`NAME_HEADER_MAGIC`). Readers detect the layout automatically.
+
 Restrictions on filenames:
 Filenames may use any unicode characters, excluding EOF, newline and tab.
 
@@ -42,6 +50,12 @@ The standard filename for a Pimarc file is `.prc`. This file contains the archiv
 data. A second file is always stored in the same location, with an identical filename,
 except the extension `.prci`.
 
+The index is written by default in a simple text format, with one line per file. This
+can be appended to as files are added to the archive. For large archives, it can
+be converted to a compact binary format (v2), which is memory-mapped on loading and
+so much faster to load (see :class:`~pimlico.utils.pimarc.index.PimarcIndexV2`).
+Readers detect the format automatically.
+
 Some basic command-line utilities for working with Pimarc archives are provided.
 Run `pimlico.utils.pimarc` with one of the various sub-commands.
 
@@ -50,9 +64,9 @@ from .reader import PimarcReader
 from .writer import PimarcWriter
 
 
-def open_archive(path, mode="r"):
+def open_archive(path, mode="r", use_mmap=False):
     if mode == "r":
-        return PimarcReader(path)
+        return PimarcReader(path, use_mmap=use_mmap)
     elif mode in ("w", "a"):
         return PimarcWriter(path, mode=mode)
     else:
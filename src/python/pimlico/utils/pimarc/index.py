@@ -3,11 +3,15 @@
 # Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
 
 import json
+import mmap
 import os
+import struct
+import sys
+from array import array
 from collections import OrderedDict
 from builtins import *
 
-from .utils import _read_var_length_data, _skip_var_length_data
+from .utils import _has_name_header, NAME_HEADER_MAGIC, ChunkedArchiveReader, _MAX_VARINT_LENGTH
 
 
 class PimarcIndex(object):
@@ -21,6 +25,8 @@ class PimarcIndex(object):
     """
     def __init__(self):
         self.filenames = OrderedDict()
+        # Built when a position is first looked up
+        self._positions = None
 
     def get_metadata_start_byte(self, filename):
         try:
@@ -38,6 +44,15 @@ class PimarcIndex(object):
         """ Returns a pair containing the metadata start byte and the data start byte. """
         return self.filenames[item]
 
+    def position(self, filename):
+        """ Position of the file in the archive: the first file is 0. """
+        if self._positions is None:
+            self._positions = dict((name, position) for (position, name) in enumerate(self.filenames))
+        try:
+            return self._positions[filename]
+        except KeyError:
+            raise FilenameNotInArchive(filename)
+
     def __iter__(self):
         """ Simply iterate over the filenames. You can access the data using these as args to other methods. """
         return iter(self.filenames)
@@ -51,13 +66,31 @@ class PimarcIndex(object):
     def keys(self):
         return self.filenames.keys()
 
+    def values(self):
+        """ Iterate over (metadata start byte, data start byte) pairs, in archive order. """
+        return self.filenames.values()
+
     def append(self, filename, metadata_start, data_start):
         if filename in self.filenames:
             raise DuplicateFilename(filename)
+        if self._positions is not None:
+            self._positions[filename] = len(self.filenames)
         self.filenames[filename] = (metadata_start, data_start)
 
+    def close(self):
+        pass
+
     @staticmethod
     def load(filename):
+        """
+        Load an index from a `.prci` file. Both the old text format and the binary
+        format (v2) can be read: the format is detected automatically. In the case
+        of a binary index, a :class:`PimarcIndexV2` is returned.
+
+        """
+        if is_binary_index(filename):
+            return PimarcIndexV2.load(filename)
+
         index = PimarcIndex()
         with open(filename, "r") as f:
             for line in f:
@@ -69,10 +102,213 @@ class PimarcIndex(object):
                 index.append(doc_filename, metadata_start, data_start)
         return index
 
-    def save(self, path):
-        with open(path, "w") as f:
-            for doc_filename, (metadata_start, data_start) in self.filenames.items():
-                f.write(u"{}\t{}\t{}\n".format(doc_filename, metadata_start, data_start))
+    def save(self, path, format="v1"):
+        """
+        Write out the index. By default, uses the text format (v1), which can be appended to.
+        Use `format="v2"` to write the binary format instead.
+
+        """
+        if format == "v2":
+            PimarcIndexV2.save(self.filenames.items(), path)
+        elif format == "v1":
+            with open(path, "w") as f:
+                for doc_filename, (metadata_start, data_start) in self.filenames.items():
+                    f.write(u"{}\t{}\t{}\n".format(doc_filename, metadata_start, data_start))
+        else:
+            raise IndexWriteError("unknown index format '{}'".format(format))
+
+
+# Every binary index file starts with this, so we can distinguish it from the old text format
+BINARY_INDEX_MAGIC = b"PRCIv2\x00\x00"
+# Header: magic, number of files, length of name table
+_BINARY_HEADER = struct.Struct("<8sQQ")
+
+
+def is_binary_index(filename):
+    """ Check whether an index file uses the binary (v2) format. """
+    with open(filename, "rb") as f:
+        return f.read(len(BINARY_INDEX_MAGIC)) == BINARY_INDEX_MAGIC
+
+
+def _uint64_array(buf):
+    """
+    Interpret a buffer as an array of little-endian unsigned 64-bit ints. On little-endian
+    machines this is just a cast of the buffer, so nothing is read until it is needed.
+
+    """
+    if sys.byteorder == "little":
+        return buf.cast("B").cast("Q")
+    else:
+        arr = array("Q", bytes(buf))
+        arr.byteswap()
+        return arr
+
+
+class PimarcIndexV2(object):
+    """
+    Binary index format (v2) for Pimarc archives, stored in the same `.prci` file
+    as the text format would be.
+
+    The index is memory-mapped when loaded, so loading is almost instant, regardless of
+    the size of the archive, and nothing is read from the file until it is needed.
+    Names are looked up using a binary search over a sorted name table, instead of
+    building a dictionary of all the filenames.
+
+    The file is laid out as follows (all ints are little-endian unsigned 64-bit):
+
+    - header: magic bytes (`BINARY_INDEX_MAGIC`), number of files (n), length of name table
+    - n metadata start bytes, in archive order
+    - n data start bytes, in archive order
+    - n+1 offsets into the name table, in archive order
+    - n positions of files in archive order, sorted by filename (UTF-8 bytes)
+    - name table: all filenames, UTF-8 encoded and concatenated, in archive order
+
+    Unlike the text format, the binary index cannot be appended to while writing an
+    archive. The writer therefore always writes a text index, which may later be
+    converted to a binary index using `reindex --format=v2`. If you open an archive
+    with a binary index for appending, its index is first converted back to text.
+
+    Provides the same interface as :class:`PimarcIndex` for reading.
+
+    """
+    def __init__(self, buf, mapped=None):
+        self._mmap = mapped
+        self.buffer = buf
+        magic, self.num_files, names_length = _BINARY_HEADER.unpack_from(buf, 0)
+        if magic != BINARY_INDEX_MAGIC:
+            raise IndexReadError("not a binary Pimarc index")
+        n = self.num_files
+
+        pos = _BINARY_HEADER.size
+        self.metadata_starts = _uint64_array(buf[pos:pos+8*n])
+        pos += 8*n
+        self.data_starts = _uint64_array(buf[pos:pos+8*n])
+        pos += 8*n
+        self.name_offsets = _uint64_array(buf[pos:pos+8*(n+1)])
+        pos += 8*(n+1)
+        self.sorted_positions = _uint64_array(buf[pos:pos+8*n])
+        pos += 8*n
+        self.names = buf[pos:pos+names_length]
+
+    @staticmethod
+    def load(filename):
+        with open(filename, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return PimarcIndexV2(memoryview(mapped), mapped)
+
+    @staticmethod
+    def save(items, path):
+        """
+        Write a binary index.
+
+        :param items: iterable of (filename, (metadata start byte, data start byte)), in archive order
+        :param path: path to write the index to
+        """
+        metadata_starts = array("Q")
+        data_starts = array("Q")
+        name_offsets = array("Q", [0])
+        encoded_names = []
+        names_length = 0
+        for filename, (metadata_start, data_start) in items:
+            encoded = filename.encode("utf-8")
+            encoded_names.append(encoded)
+            names_length += len(encoded)
+            metadata_starts.append(metadata_start)
+            data_starts.append(data_start)
+            name_offsets.append(names_length)
+        sorted_positions = array("Q", sorted(range(len(encoded_names)), key=encoded_names.__getitem__))
+
+        if sys.byteorder != "little":
+            for arr in (metadata_starts, data_starts, name_offsets, sorted_positions):
+                arr.byteswap()
+
+        with open(path, "wb") as f:
+            f.write(_BINARY_HEADER.pack(BINARY_INDEX_MAGIC, len(encoded_names), names_length))
+            for arr in (metadata_starts, data_starts, name_offsets, sorted_positions):
+                arr.tofile(f)
+            for encoded in encoded_names:
+                f.write(encoded)
+
+    def close(self):
+        # Release all views onto the mapped file before closing it
+        for view in (self.metadata_starts, self.data_starts, self.name_offsets, self.sorted_positions, self.names):
+            if isinstance(view, memoryview):
+                view.release()
+        self.buffer.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Something still holds a view onto the index: it will be closed once that's released
+                pass
+            self._mmap = None
+
+    def _name_bytes(self, position):
+        return bytes(self.names[self.name_offsets[position]:self.name_offsets[position+1]])
+
+    def _find(self, filename):
+        """
+        Binary search for a filename in the sorted name table.
+
+        :return: position of the file in the archive, or -1 if not found
+        """
+        target = filename.encode("utf-8")
+        lo, hi = 0, self.num_files
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_bytes(self.sorted_positions[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_files:
+            position = self.sorted_positions[lo]
+            if self._name_bytes(position) == target:
+                return position
+        return -1
+
+    def get_metadata_start_byte(self, filename):
+        position = self._find(filename)
+        if position < 0:
+            raise FilenameNotInArchive(filename)
+        return self.metadata_starts[position]
+
+    def get_data_start_byte(self, filename):
+        position = self._find(filename)
+        if position < 0:
+            raise FilenameNotInArchive(filename)
+        return self.data_starts[position]
+
+    def __getitem__(self, item):
+        """ Returns a pair containing the metadata start byte and the data start byte. """
+        position = self._find(item)
+        if position < 0:
+            raise KeyError(item)
+        return self.metadata_starts[position], self.data_starts[position]
+
+    def position(self, filename):
+        """ Position of the file in the archive: the first file is 0. """
+        position = self._find(filename)
+        if position < 0:
+            raise FilenameNotInArchive(filename)
+        return position
+
+    def __iter__(self):
+        """ Iterate over the filenames, in archive order. """
+        for position in range(self.num_files):
+            yield self._name_bytes(position).decode("utf-8")
+
+    def __len__(self):
+        return self.num_files
+
+    def __contains__(self, item):
+        return self._find(item) >= 0
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        """ Iterate over (metadata start byte, data start byte) pairs, in archive order. """
+        return zip(self.metadata_starts, self.data_starts)
 
 
 class PimarcIndexAppender(object):
@@ -93,8 +329,18 @@ class PimarcIndexAppender(object):
 
         if self.mode == "a":
             # Load the existing index so we can append
-            self._load()
-            self.fileobj = open(self.store_path, "a")
+            if is_binary_index(self.store_path):
+                # A binary index can't be appended to: convert it back to the text format first
+                index = PimarcIndexV2.load(self.store_path)
+                for filename, (metadata_start, data_start) in zip(index, index.values()):
+                    self.filenames[filename] = (metadata_start, data_start)
+                index.close()
+                self.fileobj = open(self.store_path, "w")
+                for filename, (metadata_start, data_start) in self.filenames.items():
+                    self.fileobj.write(u"{}\t{}\t{}\n".format(filename, metadata_start, data_start))
+            else:
+                self._load()
+                self.fileobj = open(self.store_path, "a")
         else:
             # Start a new index
             self.fileobj = open(self.store_path, "w")
@@ -132,13 +378,14 @@ class PimarcIndexAppender(object):
         os.fsync(self.fileobj.fileno())
 
 
-def reindex(pimarc_path):
+def reindex(pimarc_path, format="v1"):
     """
     Rebuild the index of a Pimarc archive from its data file (.prc).
 
     Stores the new index in the correct location (.prci), overwriting any existing index.
 
     :param pimarc_path: path to the .prc file
+    :param format: index format to write: `"v1"` (text) or `"v2"` (binary)
     :return: the PimarcIndex
     """
     if not pimarc_path.endswith(".prc"):
@@ -147,28 +394,59 @@ def reindex(pimarc_path):
 
     # Create an empty index
     index = PimarcIndex()
-    # Read in each file in turn, reading the metadata to get the name and skipping the file content
     with open(pimarc_path, "rb") as data_file:
-        try:
-            while True:
-                # Check where the metadata starts
-                metadata_start_byte = data_file.tell()
-                # First read the file's metadata block
-                metadata = json.loads(_read_var_length_data(data_file).decode("utf-8"))
-                # From that we can get the name
-                filename = metadata["name"]
-                # Now we're at the start of the file data
-                data_start_byte = data_file.tell()
-                # Skip over the data: we don't need to read that
-                _skip_var_length_data(data_file)
-                # Now add the entry to the index, with pointers to the start bytes
+        for filename, metadata_start_byte, data_start_byte in _iter_file_positions(data_file):
+            # Add the entry to the index, with pointers to the start bytes
+            index.append(filename, metadata_start_byte, data_start_byte)
+
+    index.save(index_path, format=format)
+    return index
+
+
+def truncate(pimarc_path, num_files):
+    """
+    Remove all files after the first `num_files` from a Pimarc archive, along with any partly
+    written record at the end of the data file, and rebuild its index (in the text format).
+
+    The positions of the files are read from the archive's data file, not the index, since this is
+    used to restore an archive that was being written when the writing process was killed, whose
+    index may not match the data.
+
+    :param pimarc_path: path to the .prc file
+    :param num_files: number of files to keep
+    :return: number of files left in the archive, which is less than `num_files` if there were fewer
+        complete records in the archive
+    """
+    if not pimarc_path.endswith(".prc"):
+        raise IndexWriteError("input pimarc path does not have the correct extension (.prc)")
+    index_path = "{}i".format(pimarc_path)
+    file_size = os.path.getsize(pimarc_path)
+
+    index = PimarcIndex()
+    # The data file is read through twice at once: once to find the records and once to find where each one ends
+    with open(pimarc_path, "rb") as data_file, open(pimarc_path, "rb") as end_file:
+        # Keep everything up to the end of the header, if there is one
+        end = len(NAME_HEADER_MAGIC) if _has_name_header(data_file) else 0
+        if num_files > 0:
+            for filename, metadata_start_byte, data_start_byte in _iter_file_positions(data_file):
+                # Find where this file's data ends: skipping doesn't check that it's all there
+                chunks = ChunkedArchiveReader(end_file, data_start_byte, chunk_size=_MAX_VARINT_LENGTH)
+                try:
+                    chunks.skip_var_length_data()
+                except EOFError:
+                    break
+                if chunks.tell() > file_size:
+                    # Partly written record
+                    break
                 index.append(filename, metadata_start_byte, data_start_byte)
-        except EOFError:
-            # Reached the end of the file
-            pass
+                end = chunks.tell()
+                if len(index) == num_files:
+                    break
 
+    with open(pimarc_path, "r+b") as data_file:
+        data_file.truncate(end)
     index.save(index_path)
-    return index
+    return len(index)
 
 
 def check_index(pimarc_path):
@@ -189,43 +467,63 @@ def check_index(pimarc_path):
     index_it = iter(index)
     file_num = 0
 
-    # Read in each file in turn, reading the metadata to get the name and skipping the file content
     with open(pimarc_path, "rb") as data_file:
-        try:
-            while True:
-                # Check where the metadata starts
-                metadata_start_byte = data_file.tell()
+        for filename, metadata_start_byte, data_start_byte in _iter_file_positions(data_file):
+            # Get the expected values from the index
+            exp_filename = next(index_it)
+            exp_metadata_start_byte = index.get_metadata_start_byte(exp_filename)
+            exp_data_start_byte = index.get_data_start_byte(exp_filename)
+
+            if metadata_start_byte != exp_metadata_start_byte:
+                raise IndexCheckFailed("file {} expected to start its metadata at {}, got {}"
+                                       .format(file_num, exp_metadata_start_byte, metadata_start_byte))
+
+            if filename != exp_filename:
+                raise IndexCheckFailed("file {} expected to be called {}, got {}"
+                                       .format(file_num, exp_filename, filename))
+
+            if data_start_byte != exp_data_start_byte:
+                raise IndexCheckFailed("file {} expected to start its data at {}, got {}"
+                                       .format(file_num, data_start_byte, exp_data_start_byte))
+
+            file_num += 1
+    index.close()
+    return file_num
+
+
+def _iter_file_positions(data_file):
+    """
+    Read through an archive's data file, yielding the name of each file and the
+    positions where its metadata and data start. Reads the metadata to get the name
+    (or the name field, in the name-header layout), skipping the file content.
+
+    The file is read in large chunks, which are then decoded in memory.
+
+    """
+    name_header = _has_name_header(data_file)
+    # Start reading at the start of the first record
+    chunks = ChunkedArchiveReader(data_file, len(NAME_HEADER_MAGIC) if name_header else 0)
+    try:
+        while True:
+            # Check where the metadata starts
+            metadata_start_byte = chunks.tell()
+            if name_header:
+                # Read the name directly, then skip over the rest of the metadata
+                filename = chunks.read_var_length_data().decode("utf-8")
+                chunks.skip_var_length_data()
+            else:
                 # First read the file's metadata block
-                metadata = json.loads(_read_var_length_data(data_file).decode("utf-8"))
+                metadata = json.loads(chunks.read_var_length_data().decode("utf-8"))
                 # From that we can get the name
                 filename = metadata["name"]
-                # Now we're at the start of the file data
-                data_start_byte = data_file.tell()
-                # Skip over the data: we don't need to read that
-                _skip_var_length_data(data_file)
-
-                # Get the expected values from the index
-                exp_filename = next(index_it)
-                exp_metadata_start_byte = index.get_metadata_start_byte(exp_filename)
-                exp_data_start_byte = index.get_data_start_byte(exp_filename)
-
-                if metadata_start_byte != exp_metadata_start_byte:
-                    raise IndexCheckFailed("file {} expected to start its metadata at {}, got {}"
-                                           .format(file_num, exp_metadata_start_byte, metadata_start_byte))
-
-                if filename != exp_filename:
-                    raise IndexCheckFailed("file {} expected to be called {}, got {}"
-                                           .format(file_num, exp_filename, filename))
-
-                if data_start_byte != exp_data_start_byte:
-                    raise IndexCheckFailed("file {} expected to start its data at {}, got {}"
-                                           .format(file_num, data_start_byte, exp_data_start_byte))
-
-                file_num += 1
-        except EOFError:
-            # Reached the end of the file
-            pass
-    return file_num
+            # Now we're at the start of the file data
+            data_start_byte = chunks.tell()
+            # Skip over the data: we don't need to read that
+            chunks.skip_var_length_data()
+            yield filename, metadata_start_byte, data_start_byte
+    except EOFError:
+        # Reached the end of the file
+        pass
 
 
 class IndexCheckFailed(Exception):
@@ -246,3 +544,7 @@ class DuplicateFilename(Exception):
 
 class IndexWriteError(Exception):
     pass
+
+
+class IndexReadError(Exception):
+    pass
@@ -3,31 +3,86 @@
 # Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
 
 import json
+import mmap
+import os
+import threading
 
 from builtins import super, bytes
 
-from .utils import _read_var_length_data, _skip_var_length_data
-from .index import PimarcIndex
+from .utils import _read_var_length_data, _skip_var_length_data, _read_var_length_data_from_buffer, \
+    _skip_var_length_data_in_buffer, _has_name_header, NAME_HEADER_MAGIC, ChunkedArchiveReader, \
+    DEFAULT_READ_CHUNK_SIZE, prefetch_file_data
+from .index import PimarcIndex, FilenameNotInArchive
+
+
+#: When iterating over an archive with a filename filter, if no more than this proportion of
+#: files are selected, they are read by seeking to each one, instead of reading through the archive
+FILTER_SEEK_MAX_PROPORTION = 0.25
 
 
 class PimarcReader(object):
     """
     The Pimlico Archive format: read-only archive.
 
+    If `use_mmap=True`, the archive's data file is memory-mapped, instead of being
+    read through a file object. File data is then returned as `memoryview` slices of
+    the mapped archive, so nothing is copied until you need it (call `bytes()` on the
+    data if you need a copy). Reads never seek a shared file object, but look up
+    positions in the mapped buffer, so the same reader may be used for random access
+    from multiple threads at once.
+
+    Note that in mmap mode the data slices are only valid until the reader is
+    closed. If any slices are still referenced when the reader is closed, the mapping
+    is released once they have been garbage collected.
+
+    Archives may use either of two record layouts. In the original layout, each file's
+    name is stored in its JSON metadata. In the name-header layout, the name is stored
+    in a separate field before the metadata, which contains only any additional
+    metadata. This means that the name can be read without decoding the JSON. The layout
+    is detected automatically.
+
+    When iterating over the archive without mmap, data is read from disk in chunks of
+    `read_chunk_size` bytes and records are decoded from memory.
+
     """
-    def __init__(self, archive_filename):
+    def __init__(self, archive_filename, use_mmap=False, read_chunk_size=DEFAULT_READ_CHUNK_SIZE):
         self.archive_filename = archive_filename
         if not archive_filename.endswith(".prc"):
             raise IOError("pimarc files should have the extension '.prc'")
         self.index_filename = "{}i".format(archive_filename)
+        self.use_mmap = use_mmap
+        self.read_chunk_size = read_chunk_size
 
-        self.archive_file = open(self.archive_filename, mode="rb")
+        if use_mmap:
+            self.archive_file = None
+            self._mmap, self.buffer = _map_archive_file(self.archive_filename)
+            self.name_header = bytes(self.buffer[:len(NAME_HEADER_MAGIC)]) == NAME_HEADER_MAGIC
+        else:
+            self.archive_file = open(self.archive_filename, mode="rb")
+            self._mmap = self.buffer = None
+            self.name_header = _has_name_header(self.archive_file)
+        # Position at which the first file's record starts
+        self.first_record_byte = len(NAME_HEADER_MAGIC) if self.name_header else 0
         self.index = PimarcIndex.load(self.index_filename)
         self.closed = False
 
     def close(self):
-        self.archive_file.close()
+        if self.closed:
+            return
+        if self.use_mmap:
+            self.buffer.release()
+            self.buffer = None
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    # Some data slices are still in use: the mapping will be closed when they've all been released
+                    pass
+                self._mmap = None
+        else:
+            self.archive_file.close()
         # Allow garbage collection of the index
+        self.index.close()
         self.index = None
         self.closed = True
 
@@ -47,13 +102,26 @@ class PimarcReader(object):
         # There's some redundancy in this case: we're now presumably at the start
         # of the data after reading the metadata, so don't need data_start
         # Assume that this is the case and continue reading from where we stopped
-        metadata, data = read_doc_from_pimarc_file(self.archive_file, metadata_start)
-        return metadata, data
+        return self.read_file_at(metadata_start)
 
     def read_file(self, filename):
         """ Load a file. Same as `reader[filename]` """
         return self[filename]
 
+    def read_file_at(self, metadata_start_byte):
+        """
+        Load a file's metadata and data, given the byte at which its metadata starts,
+        as stored in the index.
+
+        In mmap mode, this does not affect any shared state, so may be called from
+        multiple threads at once.
+
+        """
+        if self.use_mmap:
+            return read_doc_from_pimarc_buffer(self.buffer, metadata_start_byte, name_header=self.name_header)
+        else:
+            return read_doc_from_pimarc_file(self.archive_file, metadata_start_byte, name_header=self.name_header)
+
     def iter_filenames(self):
         """
         Iterate over just the filenames in the archive, without further metadata or file data.
@@ -68,8 +136,7 @@ class PimarcReader(object):
         parse that metadata.
 
         """
-        # Read the metadata
-        return PimarcFileMetadata(_read_var_length_data(self.archive_file))
+        return _read_metadata_from_file(self.archive_file, self.name_header)
 
     def _skip_block(self):
         """
@@ -85,42 +152,64 @@ class PimarcReader(object):
         over the data.
 
         """
-        # Make sure we're at the start of the file
-        self.archive_file.seek(0)
+        if self.use_mmap:
+            for metadata in self._iter_metadata_mmap():
+                yield metadata
+            return
+
+        # Read sequentially from the start of the first record, using a large buffer
+        chunks = ChunkedArchiveReader(self.archive_file, self.first_record_byte, self.read_chunk_size)
         while True:
             # Try reading the metadata of the next file
             try:
-                metadata = self._read_metadata()
+                metadata = _read_metadata_from_chunks(chunks, self.name_header)
             except EOFError:
                 # At this point, it's normal to get an EOF: we've just got to the end neatly
                 break
             # This should be followed by the file's data, which we skip over, since we don't need it
-            self._skip_block()
+            chunks.skip_var_length_data()
             yield metadata
 
-    def iter_files(self, skip=None, start_after=None):
+    def iter_files(self, skip=None, start_after=None, filename_filter=None):
         """
         Iterate over files, together with their JSON metadata, which includes their name (as "name").
 
+        The archive is read sequentially in large chunks (see `read_chunk_size`),
+        rather than one record at a time.
+
         :param start_after: skips all files before that with the given name, which is
             expected to be in the archive
         :param skip: skips over the first portion of the archive, until this number of documents have
             been seen. Ignored is start_after is given.
+        :param filename_filter: callable that takes a filename and returns True if the file should be
+            included. The filter is applied to all the filenames in the index (after skipping) before
+            reading anything, so that files that are filtered out don't need to be read. It is called
+            exactly once for each file, in archive order
         """
+        if filename_filter is not None:
+            for metadata, data in self._iter_filtered_files(filename_filter, skip=skip, start_after=start_after):
+                yield metadata, data
+            return
+
+        if self.use_mmap:
+            for metadata, data in self._iter_files_mmap(skip=skip, start_after=start_after):
+                yield metadata, data
+            return
+
         if start_after is not None:
             # Look up this filename in the index
             if start_after not in self.index:
                 raise StartAfterFilenameNotFound("filename '{}' not found in the Pimarc archive".format(start_after))
             # Get the start byte of the file's data
             start_after_start_byte = self.index.get_data_start_byte(start_after)
-            # Seek to this byte, then skip over the data, so we're at the start of the next file's metadata
-            self.archive_file.seek(start_after_start_byte)
-            self._skip_block()
+            # Start reading at this byte, then skip over the data, so we're at the start of the next file's metadata
+            chunks = ChunkedArchiveReader(self.archive_file, start_after_start_byte, self.read_chunk_size)
+            chunks.skip_var_length_data()
             # Don't skip any more files
             started = True
         else:
-            # Make sure we're at the start of the file
-            self.archive_file.seek(0)
+            # Start reading at the start of the first record
+            chunks = ChunkedArchiveReader(self.archive_file, self.first_record_byte, self.read_chunk_size)
 
             if skip is not None and skip < 1:
                 skip = None
@@ -130,10 +219,16 @@ class PimarcReader(object):
         skipped = 0
         while True:
             if not started:
-                # Skip this file's metadata
-                self._skip_block()
-                # And the file's data
-                self._skip_block()
+                try:
+                    # Skip this file's metadata (and name)
+                    if self.name_header:
+                        chunks.skip_var_length_data()
+                    chunks.skip_var_length_data()
+                    # And the file's data
+                    chunks.skip_var_length_data()
+                except EOFError:
+                    # Asked to skip more files than there are in the archive
+                    break
 
                 skipped += 1
                 if skipped >= skip:
@@ -142,14 +237,14 @@ class PimarcReader(object):
             else:
                 # Try reading the metadata of the next file
                 try:
-                    metadata = self._read_metadata()
+                    metadata = _read_metadata_from_chunks(chunks, self.name_header)
                 except EOFError:
                     # At this point, it's normal to get an EOF: we've just got to the end neatly
                     break
                 # This should be followed by the file's data immediately
                 # Read it in
                 # If there's an EOF here, something's wrong with the file
-                data = _read_var_length_data(self.archive_file)
+                data = chunks.read_var_length_data()
 
                 # Wrap in bytes
                 # In Py2, this converts the string to a bytes backport
@@ -158,6 +253,120 @@ class PimarcReader(object):
 
                 yield metadata, data
 
+    def iter_files_at(self, metadata_start_byte, count, end_byte=None):
+        """
+        Read `count` consecutive files, starting with the one whose metadata starts at the
+        given byte, as stored in the index. Yields the metadata and data of each file, like
+        :meth:`iter_files`.
+
+        This allows a run of files to be read without reading the rest of the archive, so
+        that different parts of an archive can be read by different processes.
+
+        :param end_byte: if given, the byte at which the last of the files' record ends (i.e.
+            the metadata start byte of the following file, or the length of the archive). The
+            whole run of files is then read from disk at once
+        """
+        if self.use_mmap:
+            buf = self.buffer
+            pos = metadata_start_byte
+        elif end_byte is not None:
+            self.archive_file.seek(metadata_start_byte)
+            buf = memoryview(self.archive_file.read(end_byte - metadata_start_byte))
+            pos = 0
+        else:
+            chunks = ChunkedArchiveReader(self.archive_file, metadata_start_byte, self.read_chunk_size)
+            for i in range(count):
+                metadata = _read_metadata_from_chunks(chunks, self.name_header)
+                data = bytes(chunks.read_var_length_data())
+                yield metadata, data
+            return
+
+        for i in range(count):
+            metadata, pos = _read_metadata_from_buffer(buf, pos, self.name_header)
+            data, pos = _read_var_length_data_from_buffer(buf, pos)
+            if not self.use_mmap:
+                data = bytes(data)
+            yield metadata, data
+
+    def _iter_filtered_files(self, filename_filter, skip=None, start_after=None):
+        """
+        Implementation of `iter_files()` with a filename filter. The filter is applied to the
+        filenames in the index. If only a small proportion of the files are selected
+        (see `FILTER_SEEK_MAX_PROPORTION`), each of these files is read directly from its
+        position in the archive. Otherwise, it's faster to read through the whole archive
+        sequentially, yielding just the selected files.
+
+        """
+        filenames = list(self.index.keys())
+        if start_after is not None:
+            try:
+                first = self.index.position(start_after) + 1
+            except FilenameNotInArchive:
+                raise StartAfterFilenameNotFound("filename '{}' not found in the Pimarc archive".format(start_after))
+        elif skip is not None and skip > 0:
+            first = skip
+        else:
+            first = 0
+        remaining = len(filenames) - first
+        if remaining <= 0:
+            return
+        # Apply the filter to every file we're not skipping
+        selected = [filename_filter(filename) for filename in filenames[first:]]
+        num_selected = sum(selected)
+        if num_selected == 0:
+            return
+
+        if num_selected <= FILTER_SEEK_MAX_PROPORTION * remaining:
+            # Jump straight to each of the selected files
+            positions = list(self.index.values())[first:]
+            for include, (metadata_start, data_start) in zip(selected, positions):
+                if include:
+                    yield self.read_file_at(metadata_start)
+        else:
+            # Most of the files are needed: read them all sequentially, which is faster than seeking
+            for include, (metadata, data) in zip(selected, self.iter_files(skip=first)):
+                if include:
+                    yield metadata, data
+
+    def _iter_metadata_mmap(self):
+        buf = self.buffer
+        pos = self.first_record_byte
+        end = len(buf)
+        while pos < end:
+            metadata, pos = _read_metadata_from_buffer(buf, pos, self.name_header)
+            pos = _skip_var_length_data_in_buffer(buf, pos)
+            yield metadata
+
+    def _iter_files_mmap(self, skip=None, start_after=None):
+        """
+        Equivalent of `iter_files()` for mmap mode. Keeps track of the position in
+        the mapped archive locally, so multiple iterators can be used at once.
+
+        """
+        buf = self.buffer
+        end = len(buf)
+        if start_after is not None:
+            if start_after not in self.index:
+                raise StartAfterFilenameNotFound("filename '{}' not found in the Pimarc archive".format(start_after))
+            # Jump to the start of the file's data, then skip over the data
+            pos = _skip_var_length_data_in_buffer(buf, self.index.get_data_start_byte(start_after))
+        else:
+            pos = self.first_record_byte
+            if skip is not None and skip > 0:
+                for i in range(skip):
+                    if pos >= end:
+                        break
+                    # Skip this file's metadata (and name) and data
+                    if self.name_header:
+                        pos = _skip_var_length_data_in_buffer(buf, pos)
+                    pos = _skip_var_length_data_in_buffer(buf, pos)
+                    pos = _skip_var_length_data_in_buffer(buf, pos)
+
+        while pos < end:
+            metadata, pos = _read_metadata_from_buffer(buf, pos, self.name_header)
+            data, pos = _read_var_length_data_from_buffer(buf, pos)
+            yield metadata, data
+
     def __iter__(self):
         return self.iter_files()
 
@@ -165,6 +374,122 @@ class PimarcReader(object):
         return len(self.index)
 
 
+class PimarcPrefetcher(object):
+    """
+    Opens a Pimarc archive in a background thread, so that it's ready to read when we
+    get to it. This loads the archive's index and, if `read_ahead` is given, prefetches
+    this many bytes from the start of the archive's data file (see
+    :func:`~pimlico.utils.pimarc.utils.prefetch_file_data`).
+
+    Typically used to open the next archive while the current one is being iterated
+    over, so that there's no stall at the boundary between them. This makes a big
+    difference when archives are stored on a high-latency network filesystem.
+
+    Call `get()` to get the opened :class:`PimarcReader`. If opening the archive failed,
+    `get()` returns None, so you can just open it in the normal way to get the error.
+
+    """
+    def __init__(self, archive_filename, read_ahead=0, **kwargs):
+        self.archive_filename = archive_filename
+        self.read_ahead = read_ahead
+        self.reader_kwargs = kwargs
+        self.reader = None
+        self._thread = threading.Thread(target=self._prefetch)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _prefetch(self):
+        try:
+            self.reader = PimarcReader(self.archive_filename, **self.reader_kwargs)
+            if self.read_ahead:
+                prefetch_file_data(self.archive_filename, self.read_ahead)
+        except Exception:
+            # Leave the error to be raised when the archive is opened normally
+            pass
+
+    def get(self):
+        """
+        Wait for the archive to be opened and return the reader. Once the reader has been
+        returned, the caller is responsible for closing it.
+
+        """
+        self._thread.join()
+        reader, self.reader = self.reader, None
+        return reader
+
+    def cancel(self):
+        """
+        The prefetched archive is not needed after all: close it once it's been opened.
+
+        """
+        reader = self.get()
+        if reader is not None:
+            reader.close()
+
+
+class PimarcTailReader(object):
+    """
+    Reads the files from an archive that is still being written, as they are added to it.
+
+    Unlike :class:`PimarcReader`, this does not use the archive's index, which might
+    end part-way through an entry while it's being written. Instead, the records are
+    decoded straight from the data file. Each call to :meth:`read_new_files` returns the
+    files whose records have been completely written to disk since the last call. If the
+    last record has only been partly written, it is left until a later call.
+
+    Once the writer has closed the archive, a final call to :meth:`read_new_files`
+    returns all of the remaining files.
+
+    """
+    def __init__(self, archive_filename):
+        self.archive_filename = archive_filename
+        # Not known until the start of the archive has been written
+        self.name_header = None
+        # Number of bytes of the file read so far
+        self._file_pos = 0
+        # Start of a record that hasn't been completely written yet
+        self._pending = bytes()
+
+    def read_new_files(self):
+        """
+        Read any files that have been added to the archive since the last call.
+
+        :return: list of `(metadata, data)` pairs
+        """
+        if not os.path.exists(self.archive_filename):
+            # Not started writing yet
+            return []
+        with open(self.archive_filename, mode="rb") as archive_file:
+            archive_file.seek(self._file_pos)
+            new_data = archive_file.read()
+        self._file_pos += len(new_data)
+        buf = self._pending + new_data
+
+        pos = 0
+        if self.name_header is None:
+            if NAME_HEADER_MAGIC.startswith(buf):
+                # Not enough has been written to tell which record layout is used
+                self._pending = buf
+                return []
+            self.name_header = buf.startswith(NAME_HEADER_MAGIC)
+            if self.name_header:
+                pos = len(NAME_HEADER_MAGIC)
+
+        buf = memoryview(buf)
+        files = []
+        while pos < len(buf):
+            try:
+                metadata, data_pos = _read_metadata_from_buffer(buf, pos, self.name_header)
+                data, end_pos = _read_var_length_data_from_buffer(buf, data_pos)
+            except EOFError:
+                # The rest of the record hasn't been written yet
+                break
+            files.append((metadata, bytes(data)))
+            pos = end_pos
+        self._pending = bytes(buf[pos:])
+        return files
+
+
 def read_doc_from_pimarc(archive_filename, metadata_start_byte):
     """
     Read a single file's metadata and file data from a given start point in the
@@ -176,29 +501,105 @@ def read_doc_from_pimarc(archive_filename, metadata_start_byte):
     :return: tuple (metadata, raw file data)
     """
     with open(archive_filename, mode="rb") as archive_file:
-        return read_doc_from_pimarc_file(archive_file, metadata_start_byte)
+        name_header = _has_name_header(archive_file)
+        return read_doc_from_pimarc_file(archive_file, metadata_start_byte, name_header=name_header)
 
 
-def read_doc_from_pimarc_file(archive_file, metadata_start_byte):
+def read_doc_from_pimarc_file(archive_file, metadata_start_byte, name_header=False):
     """
     Same as `read_doc_from_pimarc`, but operates on an already-opened
     archive file.
 
     :param archive_file: file-like object
     :param metadata_start_byte: byte from which metadata starts
+    :param name_header: True if the archive uses the name-header record layout
     :return: tuple (metadata, raw file data)
     """
 
     # Jump to the start of the metadata
     archive_file.seek(metadata_start_byte)
     # Read the metadata
-    metadata = PimarcFileMetadata(_read_var_length_data(archive_file))
+    metadata = _read_metadata_from_file(archive_file, name_header)
     # We're now presumably at the start of the data
     # Assume that this is the case and continue reading from where we stopped
     data = _read_var_length_data(archive_file)
     return metadata, data
 
 
+def read_doc_from_pimarc_buffer(buf, metadata_start_byte, name_header=False):
+    """
+    Same as `read_doc_from_pimarc`, but operates on an in-memory buffer containing
+    the archive's data, typically a memoryview of an mmapped archive.
+
+    The file data is returned as a slice of the buffer, without copying.
+
+    :param buf: buffer (e.g. memoryview)
+    :param metadata_start_byte: byte from which metadata starts
+    :param name_header: True if the archive uses the name-header record layout
+    :return: tuple (metadata, raw file data)
+    """
+    metadata, data_start_byte = _read_metadata_from_buffer(buf, metadata_start_byte, name_header)
+    data, __ = _read_var_length_data_from_buffer(buf, data_start_byte)
+    return metadata, data
+
+
+def _read_metadata_from_file(archive_file, name_header):
+    """
+    Read a file's metadata block (and name, in the name-header layout) from the current
+    position in an archive file.
+
+    """
+    if name_header:
+        name = _read_var_length_data(archive_file).decode("utf-8")
+        return PimarcFileMetadata(_read_var_length_data(archive_file), name=name)
+    else:
+        return PimarcFileMetadata(_read_var_length_data(archive_file))
+
+
+def _read_metadata_from_chunks(chunks, name_header):
+    """
+    Like `_read_metadata_from_file`, but reading from a :class:`~.utils.ChunkedArchiveReader`.
+
+    """
+    if name_header:
+        name = chunks.read_var_length_data().decode("utf-8")
+        return PimarcFileMetadata(chunks.read_var_length_data(), name=name)
+    else:
+        return PimarcFileMetadata(chunks.read_var_length_data())
+
+
+def _read_metadata_from_buffer(buf, pos, name_header):
+    """
+    Like `_read_metadata_from_file`, but reading from a buffer at the given position.
+
+    :return: tuple (metadata, position after metadata)
+    """
+    if name_header:
+        name_data, pos = _read_var_length_data_from_buffer(buf, pos)
+        metadata_data, pos = _read_var_length_data_from_buffer(buf, pos)
+        return PimarcFileMetadata(bytes(metadata_data), name=bytes(name_data).decode("utf-8")), pos
+    else:
+        metadata_data, pos = _read_var_length_data_from_buffer(buf, pos)
+        return PimarcFileMetadata(bytes(metadata_data)), pos
+
+
+def _map_archive_file(archive_filename):
+    """
+    Memory-map an archive's data file for reading. The file object does not need to
+    be kept open once the mapping has been created.
+
+    :return: tuple (mmap object, memoryview of the mapping). The mmap is None if
+        the archive is empty, since empty files cannot be mapped
+    """
+    with open(archive_filename, mode="rb") as archive_file:
+        try:
+            mapped = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Can't map an empty file
+            return None, memoryview(b"")
+    return mapped, memoryview(mapped)
+
+
 def metadata_decode_decorator(fn):
     def _new_fn(self, *args, **kwargs):
         self.decode()
@@ -206,6 +607,14 @@ def metadata_decode_decorator(fn):
     return _new_fn
 
 
+def metadata_modify_decorator(fn):
+    def _new_fn(self, *args, **kwargs):
+        self.decode()
+        self._modified = True
+        return fn(self, *args, **kwargs)
+    return _new_fn
+
+
 class PimarcFileMetadata(dict):
     """
     Simple wrapper around the JSON-encoded metadata associated with a file in a
@@ -217,11 +626,22 @@ class PimarcFileMetadata(dict):
     data the first time you try accessing it. You can also call `dict(obj)` to
     get a plain dict instead.
 
+    If the name is given separately (from the name-header record layout), the
+    raw data contains only any other metadata, possibly none at all. The name can
+    then be accessed as `obj["name"]` without decoding anything.
+
     """
-    def __init__(self, raw_data):
+    def __init__(self, raw_data, name=None):
         super().__init__()
         self.raw_data = raw_data
+        self.name = name
         self._decoded = False
+        self._modified = False
+        if name is not None:
+            dict.__setitem__(self, "name", name)
+            if len(raw_data) == 0:
+                # No other metadata to decode
+                self._decoded = True
 
     def decode(self):
         if not self._decoded:
@@ -229,9 +649,35 @@ class PimarcFileMetadata(dict):
             self.update(json.loads(self.raw_data.decode("utf-8")))
             self._decoded = True
 
-    __getitem__ = metadata_decode_decorator(dict.__getitem__)
-    __setitem__ = metadata_decode_decorator(dict.__setitem__)
-    __delitem__ = metadata_decode_decorator(dict.__delitem__)
+    def __getitem__(self, key):
+        if key == "name" and self.name is not None:
+            # Available without decoding the JSON
+            return self.name
+        self.decode()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @property
+    def encoded_other_metadata(self):
+        """
+        The raw, encoded metadata, not including the name, as stored in the name-header record
+        layout. This can be written straight to another archive using the same layout.
+
+        None if the metadata was read from an archive using the original layout, or if it has
+        been modified since it was read.
+
+        """
+        if self.name is None or self._modified:
+            return None
+        return self.raw_data
+
+    __setitem__ = metadata_modify_decorator(dict.__setitem__)
+    __delitem__ = metadata_modify_decorator(dict.__delitem__)
     keys = metadata_decode_decorator(dict.keys)
     values = metadata_decode_decorator(dict.values)
     items = metadata_decode_decorator(dict.items)
@@ -115,8 +115,8 @@ def reindex_pimarcs(opts):
         sys.exit(1)
 
     for pimarc_path in opts.paths:
-        print("Rebuilding index for {}".format(pimarc_path))
-        reindex(pimarc_path)
+        print("Rebuilding index for {} (format {})".format(pimarc_path, opts.format))
+        reindex(pimarc_path, format=opts.format)
         print("  Success")
 
 
@@ -154,8 +154,9 @@ def remove(opts):
     # Write to a temporary new archive
     tmp_arc = "{}.tmp".format(path)
     try:
-        with PimarcWriter(tmp_arc, mode="w") as writer:
-            with PimarcReader(path) as reader:
+        with PimarcReader(path) as reader:
+            # Keep the same record layout as the original archive
+            with PimarcWriter(tmp_arc, mode="w", name_header=reader.name_header) as writer:
                 for metadata, data in reader:
                     name = metadata["name"]
                     if name in files_to_remove:
@@ -226,9 +227,14 @@ def run():
     subparser = subparsers.add_parser("reindex",
                                       help="Rebuild a pimarc's index (the .prci file) from its data (the .prc file). "
                                            "This can be necessary if the index has become corrupted or something when "
-                                           "wrong during writing of the archive")
+                                           "wrong during writing of the archive. Can also be used to "
+                                           "convert an index to the binary format (--format=v2)")
     subparser.set_defaults(func=reindex_pimarcs)
     subparser.add_argument("paths", nargs="+", help="Path to the pimarc(s) - .prc files")
+    subparser.add_argument("--format", choices=["v1", "v2"], default="v1",
+                           help="Index format to write. v1 (default) is the original text format. v2 is a "
+                                "binary format, which is much faster to load for large archives, but cannot "
+                                "be appended to without first converting back to v1")
 
     subparser = subparsers.add_parser("check",
                                       help="Check a pimarc's index (the .prci file) against its data (the .prc file). "
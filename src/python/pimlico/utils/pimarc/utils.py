@@ -2,7 +2,24 @@
 # Copyright (C) 2020 Mark Granroth-Wilding
 # Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
 
-from pimlico.utils.varint import decode_stream, encode
+import os
+
+from pimlico.utils.varint import decode_stream, decode_buffer, encode
+
+# Archives that store each file's name in its record header, instead of in the JSON metadata,
+# start with this. It can't be mistaken for the start of the original layout, where the first
+# byte is the length of the first file's metadata, which is never 0.
+NAME_HEADER_MAGIC = b"\x00PRCNAME"
+
+
+def _has_name_header(archive_file):
+    """
+    Check whether an archive (given as a file object opened for reading) uses the
+    name-header record layout. Moves the file pointer.
+
+    """
+    archive_file.seek(0)
+    return archive_file.read(len(NAME_HEADER_MAGIC)) == NAME_HEADER_MAGIC
 
 
 def _read_var_length_data(reader):
@@ -27,6 +44,32 @@ def _skip_var_length_data(reader):
     reader.seek(data_length, 1)
 
 
+def _read_var_length_data_from_buffer(buf, pos):
+    """
+    Like read_var_length_data, but reads from an in-memory buffer (e.g. a memoryview
+    of an mmapped archive), starting at the given position. Nothing is read from
+    disk and nothing is copied: the data is a slice of the buffer.
+
+    Returns the data and the position immediately after it.
+
+    """
+    data_length, pos = decode_buffer(buf, pos)
+    end = pos + data_length
+    if end > len(buf):
+        raise EOFError("Unexpected EOF while reading data")
+    return buf[pos:end], end
+
+
+def _skip_var_length_data_in_buffer(buf, pos):
+    """
+    Like read_var_length_data_from_buffer, but doesn't slice out the data. Just
+    returns the position immediately after the data.
+
+    """
+    data_length, pos = decode_buffer(buf, pos)
+    return pos + data_length
+
+
 def _write_var_length_data(writer, data):
     """
     Write some data to a file-like object by first writing a varint that says how many
@@ -37,4 +80,106 @@ def _write_var_length_data(writer, data):
     data_length = len(data)
     writer.write(encode(data_length))
     # Write the data as a bytes array
-    return writer.write(data)
\ No newline at end of file
+    return writer.write(data)
+
+#: Size of the chunks read from disk when iterating sequentially over an archive
+DEFAULT_READ_CHUNK_SIZE = 8 * 1024 * 1024
+# The longest varint we could need to read (a 64-bit int)
+_MAX_VARINT_LENGTH = 10
+
+
+class ChunkedArchiveReader(object):
+    """
+    Reads records from an archive file sequentially, reading large chunks from disk
+    at once and decoding varints and slicing records out of the in-memory buffer.
+    This avoids the many small reads needed to read the archive record-by-record
+    from the file object. More data is only read from disk when the end of the
+    buffer is reached.
+
+    Provides an equivalent of `_read_var_length_data` and `_skip_var_length_data`.
+    Skipping over data that extends beyond the current buffer seeks the file,
+    instead of reading the data.
+
+    The file object should not be used by anything else while iterating, since the
+    reader assumes the file position stays where it left it.
+
+    """
+    def __init__(self, archive_file, start=0, chunk_size=DEFAULT_READ_CHUNK_SIZE):
+        self.archive_file = archive_file
+        self.chunk_size = chunk_size
+        archive_file.seek(start)
+        # Position in the file of the start of the buffer
+        self.buffer_start = start
+        self.buffer = b""
+        # Position within the buffer
+        self.pos = 0
+
+    def tell(self):
+        """ Current position in the archive file. """
+        return self.buffer_start + self.pos
+
+    def _fill(self, length):
+        """
+        Make sure that at least `length` bytes are available in the buffer after the current position,
+        reading more from disk if necessary.
+
+        :return: False if the end of the file was reached before `length` bytes could be read
+        """
+        available = len(self.buffer) - self.pos
+        if available >= length:
+            return True
+        # Keep the remainder of the buffer and read another chunk after it
+        more = self.archive_file.read(max(self.chunk_size, length - available))
+        self.buffer = self.buffer[self.pos:] + more
+        self.buffer_start += self.pos
+        self.pos = 0
+        return len(self.buffer) >= length
+
+    def _read_length(self):
+        # Make sure there's enough in the buffer to read a whole varint
+        # Near the end of the file, there might not be, but then the varint will be shorter
+        self._fill(_MAX_VARINT_LENGTH)
+        data_length, self.pos = decode_buffer(self.buffer, self.pos)
+        return data_length
+
+    def read_var_length_data(self):
+        data_length = self._read_length()
+        if not self._fill(data_length):
+            raise EOFError("Unexpected EOF while reading data")
+        data = self.buffer[self.pos:self.pos+data_length]
+        self.pos += data_length
+        return data
+
+    def skip_var_length_data(self):
+        data_length = self._read_length()
+        if self.pos + data_length <= len(self.buffer):
+            self.pos += data_length
+        else:
+            # The data extends beyond the buffer: seek past it and empty the buffer
+            self.buffer_start += self.pos + data_length
+            self.archive_file.seek(self.buffer_start)
+            self.buffer = b""
+            self.pos = 0
+
+
+def prefetch_file_data(filename, length, chunk_size=DEFAULT_READ_CHUNK_SIZE):
+    """
+    Ask for the first `length` bytes of a file to be loaded into the OS's page cache, so that
+    reading it later doesn't have to wait for the disk (or network).
+
+    Where available, uses `posix_fadvise(WILLNEED)`, which returns immediately and leaves
+    the OS to load the data in the background. Otherwise, reads the data and throws it
+    away, so this should be called from a background thread.
+
+    """
+    with open(filename, mode="rb") as f:
+        try:
+            os.posix_fadvise(f.fileno(), 0, length, os.POSIX_FADV_WILLNEED)
+        except (AttributeError, OSError):
+            # Not available on this system (or Python version): read the data instead
+            remaining = length
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
@@ -5,19 +5,31 @@
 import json
 import os
 
+from builtins import bytes
+
 from future.utils import raise_from
 
 from pimlico.utils.pimarc.index import DuplicateFilename
-from .utils import _write_var_length_data
+from .utils import _write_var_length_data, _has_name_header, NAME_HEADER_MAGIC
 from .index import PimarcIndexAppender
+from .reader import PimarcFileMetadata, read_doc_from_pimarc_file
 
 
 class PimarcWriter(object):
     """
     The Pimlico Archive format: writing new archives or appending existing ones.
 
+    If `name_header=True`, a new archive is written using the name-header record
+    layout: each file's name is stored in its own field, before the metadata, instead
+    of as part of the JSON metadata. Readers can then get the names of files without
+    decoding their metadata. The JSON metadata is only written if there is some
+    metadata other than the name.
+
+    When appending, the layout of the existing archive is always used, regardless
+    of `name_header`.
+
     """
-    def __init__(self, archive_filename, mode="w"):
+    def __init__(self, archive_filename, mode="w", name_header=False):
         self.archive_filename = archive_filename
         self.index_filename = "{}i".format(archive_filename)
         self.append = mode == "a"
@@ -35,7 +47,17 @@ class PimarcWriter(object):
             if os.path.exists(self.index_filename):
                 os.remove(self.index_filename)
 
+        if self.append:
+            # Use whichever layout the existing archive uses
+            with open(self.archive_filename, mode="rb") as existing_file:
+                self.name_header = _has_name_header(existing_file)
+        else:
+            self.name_header = name_header
+
         self.archive_file = open(self.archive_filename, mode="ab" if self.append else "wb")
+        if self.name_header and not self.append:
+            # Mark the archive as using the name-header layout
+            self.archive_file.write(NAME_HEADER_MAGIC)
         self.index = PimarcIndexAppender(self.index_filename, mode="a" if self.append else "w")
 
     @staticmethod
@@ -73,9 +95,23 @@ class PimarcWriter(object):
         Setting `name=X` is simply a shorthand for setting `metadata["name"]=X`.
         Either `name` or a metadata dict including the `name` key is required.
 
+        The metadata may be a :class:`~pimlico.utils.pimarc.reader.PimarcFileMetadata` read
+        from another archive. If both archives use the name-header layout, the encoded
+        metadata is then copied without decoding it (see :meth:`write_file_encoded_metadata`).
+
+        :return: tuple `(metadata_start, data_start, end)` giving the position of the new record
+            in the archive file, which can be used to copy it with :meth:`copy_record`
         """
         if metadata is None:
             metadata = {}
+        elif isinstance(metadata, PimarcFileMetadata):
+            encoded_metadata = metadata.encoded_other_metadata
+            if encoded_metadata is not None:
+                return self.write_file_encoded_metadata(
+                    data, name if name is not None else metadata.name, encoded_metadata)
+            # Decode the metadata and take a copy, so we don't modify the original
+            metadata.decode()
+            metadata = dict(metadata)
 
         if name is not None:
             filename = name
@@ -91,16 +127,85 @@ class PimarcWriter(object):
         if filename in self.index:
             raise DuplicateFilename(filename)
 
-        # Check where we're up to in the file
-        # This tells us where the metadata starts, which will be stored in the index
-        metadata_start = self.archive_file.tell()
+        if self.name_header:
+            # The name is stored separately, so the JSON only contains any other metadata
+            metadata = dict((key, val) for (key, val) in metadata.items() if key != "name")
         # Encode the metadata as utf-8 JSON
         try:
-            metadata_data = json.dumps(metadata).encode("utf-8")
+            if self.name_header and len(metadata) == 0:
+                # No need to store anything: empty metadata is read as {}
+                metadata_data = b""
+            else:
+                metadata_data = json.dumps(metadata).encode("utf-8")
         except Exception as e:
             raise_from(MetadataError("problem encoding metadata as JSON"), e)
 
+        return self._write_record(filename, metadata_data, data)
+
+    def write_file_encoded_metadata(self, data, name, metadata_data):
+        """
+        Append a file to the archive, where the metadata is given already encoded, as it is
+        stored in the name-header record layout: that is, JSON-encoded metadata not including
+        the name, or empty bytes if there's no metadata other than the name.
+
+        This allows a record read from a name-header archive to be copied to another archive
+        without decoding and re-encoding its metadata. If this archive uses the original
+        layout, the metadata does need to be decoded, so that the name can be added.
+
+        """
+        if not self.name_header:
+            metadata = json.loads(bytes(metadata_data).decode("utf-8")) if len(metadata_data) else {}
+            return self.write_file(data, name=name, metadata=metadata)
+
+        if name in self.index:
+            raise DuplicateFilename(name)
+        return self._write_record(name, metadata_data, data)
+
+    def copy_record(self, source_file, filename, metadata_start, data_start, end, source_name_header=False):
+        """
+        Append a file by copying its record byte-for-byte from another archive, given the
+        position of the record in the other archive's file (as returned by :meth:`write_file`).
+        This is much faster than reading the file and writing it again, as nothing is decoded.
+
+        If the other archive uses a different record layout to this one, the file is read and
+        written in this archive's layout instead.
+
+        :param source_file: the other archive's file, opened for reading in binary mode
+        :param filename: name of the file, which must be the name stored in the record
+        :param source_name_header: True if the other archive uses the name-header record layout
+        :return: tuple `(metadata_start, data_start, end)` giving the position of the new record
+        """
+        if source_name_header != self.name_header:
+            metadata, data = read_doc_from_pimarc_file(source_file, metadata_start, name_header=source_name_header)
+            return self.write_file(data, name=filename, metadata=metadata)
+
+        if filename in self.index:
+            raise DuplicateFilename(filename)
+        source_file.seek(metadata_start)
+        record = source_file.read(end - metadata_start)
+        if len(record) < end - metadata_start:
+            raise IOError("record for {} ends after the end of the source archive".format(filename))
+
+        new_metadata_start = self.archive_file.tell()
         try:
+            self.archive_file.write(record)
+            new_data_start = new_metadata_start + (data_start - metadata_start)
+            self.index.append(filename, new_metadata_start, new_data_start)
+        except:
+            # Don't leave a partial record behind, as in _write_record()
+            self.archive_file.truncate(new_metadata_start)
+            self.archive_file.seek(new_metadata_start)
+            raise
+        return new_metadata_start, new_data_start, new_metadata_start + len(record)
+
+    def _write_record(self, filename, metadata_data, data):
+        # Check where we're up to in the file
+        # This tells us where the metadata starts, which will be stored in the index
+        metadata_start = self.archive_file.tell()
+        try:
+            if self.name_header:
+                # Write the name first, including its length
+                _write_var_length_data(self.archive_file, filename.encode("utf-8"))
             # Write it to the file, including its length
             _write_var_length_data(self.archive_file, metadata_data)
 
@@ -110,6 +215,8 @@ class PimarcWriter(object):
             # Write out the data, including its length
             _write_var_length_data(self.archive_file, data)
 
+            end = self.archive_file.tell()
+
             # Add the file to the index
             self.index.append(filename, metadata_start, data_start)
         except:
@@ -120,6 +227,7 @@ class PimarcWriter(object):
             self.archive_file.seek(metadata_start)
             # Re-raise the exception for handling further up
             raise
+        return metadata_start, data_start, end
 
     def flush(self):
         """
@@ -0,0 +1,107 @@
+# This file is part of Pimlico
+# Copyright (C) 2020 Mark Granroth-Wilding
+# Licensed under the GNU LGPL v3.0 - https://www.gnu.org/licenses/lgpl-3.0.en.html
+
+"""
+Tools for passing large amounts of data between processes through shared memory,
+instead of pickling it and sending it down a pipe.
+
+Shared memory is only available from Python 3.8. Use :func:`shared_memory_available`
+to check whether it can be used and fall back to something else if not.
+
+"""
+import multiprocessing
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+
+def shared_memory_available():
+    return shared_memory is not None
+
+
+class SharedMemorySlots(object):
+    """
+    A block of shared memory divided into a fixed number of equal-sized slots. A process
+    wanting to send data acquires a free slot, writes its data into it and sends the slot
+    number and offsets to the receiving process (e.g. on a queue), which reads the data
+    and releases the slot, so that it can be reused. The slots are cycled through in turn,
+    so this works like a ring buffer, but data may be received out of order, or by more
+    than one process.
+
+    The free slots are kept on a multiprocessing queue, so once there are no free slots,
+    senders block until one is released. This limits the amount of data in transit.
+
+    Create the slots in the parent process, before starting the processes that use them.
+    When they're no longer needed, call :meth:`close` in every process and :meth:`unlink`
+    in the parent.
+
+    """
+    def __init__(self, num_slots, slot_size):
+        if shared_memory is None:
+            raise SharedMemoryUnavailable("shared memory is only available on Python 3.8+")
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots * slot_size)
+        self.free_slots = multiprocessing.Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+
+    def acquire(self, block=True, timeout=None):
+        """
+        Get the number of a free slot, waiting until one is free.
+
+        :raises queue.Empty: if `block=False` or a `timeout` is given and no slot was free
+        """
+        return self.free_slots.get(block, timeout)
+
+    def release(self, slot):
+        """ Mark a slot as no longer in use, once its data has been read. """
+        self.free_slots.put(slot)
+
+    def write(self, slot, chunks):
+        """
+        Write the given bytes objects one after another into a slot.
+
+        :return: a list of `(offset, length)` pairs giving the position in the shared
+            memory of each chunk, which can be passed to :meth:`read`
+        :raises SlotOverflow: if the data doesn't fit in a slot
+        """
+        if sum(len(chunk) for chunk in chunks) > self.slot_size:
+            raise SlotOverflow("data too big for a {}-byte slot".format(self.slot_size))
+        buf = self.shm.buf
+        offset = slot * self.slot_size
+        positions = []
+        for chunk in chunks:
+            buf[offset:offset+len(chunk)] = chunk
+            positions.append((offset, len(chunk)))
+            offset += len(chunk)
+        return positions
+
+    def read(self, offset, length):
+        """ Copy data out of the shared memory. """
+        return bytes(self.shm.buf[offset:offset+length])
+
+    def close(self):
+        """ Release this process' access to the shared memory. """
+        self.shm.close()
+        self.free_slots.close()
+
+    def unlink(self):
+        """ Free the shared memory. Call once, from the process that created it. """
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            # Already freed
+            pass
+
+
+class SharedMemoryUnavailable(Exception):
+    pass
+
+
+class SlotOverflow(Exception):
+    pass
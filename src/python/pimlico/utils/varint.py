@@ -33,10 +33,16 @@ import sys
 if sys.version > '3':
     def _byte(b):
         return bytes((b, ))
+
+    def _ord(c):
+        return c
 else:
     def _byte(b):
         return chr(b)
 
+    def _ord(c):
+        return ord(c)
+
 
 def encode(number):
     """Pack `number` into varint bytes"""
@@ -71,6 +77,33 @@ def decode_bytes(buf):
     return decode_stream(BytesIO(buf))
 
 
+def decode_buffer(buf, pos=0):
+    """Read a varint from `buf`, starting at `pos`
+
+    `buf` may be any object supporting indexing into bytes, such as
+    `bytes`, `memoryview` or `mmap`. Nothing is copied.
+
+    Returns a pair `(number, next_pos)`, where `next_pos` is the position
+    in the buffer immediately after the varint.
+
+    raises EOFError if the buffer ends while reading bytes.
+    """
+    shift = 0
+    result = 0
+    try:
+        while True:
+            i = _ord(buf[pos])
+            pos += 1
+            result |= (i & 0x7f) << shift
+            shift += 7
+            if not (i & 0x80):
+                break
+    except IndexError:
+        raise EOFError("Unexpected EOF while reading bytes")
+
+    return result, pos
+
+
 def _read_one(stream):
     """Read a byte from the file (as an integer)
 